@@ -1,11 +1,32 @@
 #!/usr/bin/env python3
 # coding:utf-8
 import logging
-from .core import CrawlerPipeline, CrawlerPipelineHandler
-from .config import CrawlerConfig
+import importlib
 
 logging.root.addHandler(hdlr=logging.NullHandler())
 
+# imported on first access, a worker process only loads what it uses
+_LAZY = {
+    "CrawlerPipelineHandler": ".core",
+    "CrawlerPipeline": ".core",
+    "AsyncCrawlerPipeline": ".aiocore",
+    "DistributedCrawlerPipeline": ".distributed",
+    "CrawlerConfig": ".config",
+}
+
 __all__ = [
-    "CrawlerPipelineHandler", "CrawlerPipeline", "CrawlerConfig"
+    "CrawlerPipelineHandler", "CrawlerPipeline", "AsyncCrawlerPipeline",
+    "DistributedCrawlerPipeline", "CrawlerConfig"
 ]
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
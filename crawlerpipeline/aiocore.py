@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import time
+import typing
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlparse
+import requests
+from .core import CrawlerPipeline, _FetchResult, _Link, logger
+from .utils.frontier import FrontierRecord
+from .utils.recrawl import CacheEntry
+from .utils.transport import build_response
+
+
+def _aiohttp():
+    """aiohttp takes 100 ms to import, only AsyncCrawlerPipeline needs it"""
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError("AsyncCrawlerPipeline requires aiohttp")
+    return aiohttp
+
+
+class AsyncCrawlerPipeline(CrawlerPipeline):
+    """
+    CrawlerPipeline running every fetch on one asyncio event loop.
+
+    Handlers and request_filter are used exactly like the thread engine,
+    all of them are called from the event loop thread.
+    """
+
+    def _init_engine(self):
+        self.concurrency = self.config.async_concurrency
+        self._loop: asyncio.AbstractEventLoop = None
+        self._results: asyncio.Queue = None
+        self._client = None
+        # the loop keeps weak references to its tasks only
+        self._tasks: typing.Set[asyncio.Task] = set()
+        # (put, args) a full queue did not take, put before the next result
+        self._backlog = deque()
+
+        # the scheduler thread hands requests over to the event loop
+        self.scheduler = self._build_scheduler(self.concurrency, self._execute)
+
+        # run the event loop in a thread to keep start/wait_until_finished
+        self.dispacher_thread = threading.Thread(target=self._run_loop)
+        self.dispacher_thread.daemon = True
+        self._main = None
+
+    def start(self, start_url, method="GET", headers=None, data=None,
+              params=None, auth=None, cookies=None):
+        self._start_loop(lambda: self.run(start_url, method, headers, data,
+                                          params, auth, cookies))
+
+    def resume(self, checkpoint=None):
+        self._start_loop(lambda: self.run_resume(checkpoint))
+
+    def _start_loop(self, main):
+        if self._have_started_event.is_set():
+            raise ValueError("the pipeline is started.")
+        _aiohttp()
+
+        self._main = main
+        self._have_started_event.set()
+        self.dispacher_thread.start()
+
+    def _run_loop(self):
+        try:
+            asyncio.run(self._main())
+        except Exception:
+            logger.exception("crawl failed")
+            self._have_started_event.clear()
+
+    async def run(self, start_url, method="GET", headers=None, data=None,
+                  params=None, auth=None, cookies=None):
+        """Crawl from start_url until no request is pending."""
+        req = self._build_start_request(start_url, method, headers, data,
+                                        params, auth, cookies)
+        # a new crawl
+        self.frontier.clear()
+        self.budget.admit(self._init_domain)
+        self._schedule(req.url, req.method, depth=0)
+        await self._crawl()
+
+    async def run_resume(self, checkpoint=None):
+        """Continue the crawl saved in checkpoint dir."""
+        self._load_checkpoint(checkpoint)
+        await self._crawl()
+
+    async def _crawl(self):
+        aiohttp = _aiohttp()
+
+        self._have_started_event.set()
+        self._loop = asyncio.get_running_loop()
+        self._results = asyncio.Queue()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=0)
+        timeout = self.config.timeout or (None, None)
+        timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+        # cookies are kept in self.transport and sent by the prepared request
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         cookie_jar=aiohttp.DummyCookieJar()) as client:
+            self._client = client
+            self._start_writers()
+            self.budget.start()
+            self.metrics.start()
+            self._feed_scheduler()
+            self.scheduler.start()
+            self.handlers.on_pipeline_starting()
+
+            logger.info("dispatcher is running")
+            try:
+                while self._finished < self._started:
+                    self._dispatch(await self._results.get())
+                    # backpressure of the handlers and the sink without blocking the loop
+                    await self._flush_backlog()
+            finally:
+                self.scheduler.stop()
+                await self._cancel_fetches()
+
+        self._client = None
+        self._have_started_event.clear()
+        self._on_finished()
+
+    def _execute(self, host, record: FrontierRecord):
+        # called from the scheduler thread
+        trace_id = self.tracer.trace_id(record.url)
+        self.tracer.done_waiting(trace_id, "host queue")
+        self.tracer.wait(trace_id, "event loop")
+        self._loop.call_soon_threadsafe(self._start_fetch, host, record)
+
+    def _start_fetch(self, host, record: FrontierRecord):
+        task = self._loop.create_task(self._fetch_async(host, record))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _put_event(self, hook, items):
+        # never blocks the loop, the events keep their order
+        if self._backlog or not self.delivery.put_nowait(hook, items):
+            self._backlog.append((self.delivery.put, (hook, items)))
+
+    def _put_sink(self, record):
+        if self._backlog or not self.sink_writer.put_nowait(record):
+            self._backlog.append((self.sink_writer.put, (record,)))
+
+    async def _flush_backlog(self):
+        """wait for the queues in a thread, the fetches go on meanwhile"""
+        while self._backlog:
+            put, args = self._backlog.popleft()
+            await self._loop.run_in_executor(None, put, *args)
+
+    async def _cancel_fetches(self):
+        """the fetches left when the crawl stops, after a failure"""
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _fetch_async(self, host, record: FrontierRecord):
+        trace_id = self.tracer.trace_id(record.url)
+        self.tracer.done_waiting(trace_id, "event loop")
+        started = time.perf_counter()
+        try:
+            # sqlite lookups are short enough for the event loop
+            entry = self.recrawl_cache.get(record.url) if self.recrawl_cache is not None else None
+            response, prepared_request, links = await self.request_async(
+                self._build_record_request(record, entry), record, entry)
+        except Exception:
+            # a handler hook raised
+            logger.debug("fetch failed: %s", record.url, exc_info=True)
+            response, prepared_request, links = None, None, []
+        # with the awaits of the other requests in between
+        self.tracer.span(trace_id, "fetch", started, url=record.url)
+        self.tracer.wait(trace_id, "result queue")
+        await self._results.put(_FetchResult(host, record, response, prepared_request, links))
+
+    async def request_async(self, request: requests.Request, record: FrontierRecord = None,
+                            entry: CacheEntry = None) -> typing.Tuple[
+            requests.Response, requests.PreparedRequest, typing.List[_Link]]:
+        """
+        Send the request and extract the links while streaming the body,
+        the returned response keeps no content unless config.sink_body.
+        entry is the recrawl cache entry of record.
+        """
+        self._log_url("%s -> %s", request.method, request.url)
+
+        request = self.handlers.hook_before_preparing_request(request)
+        prepared_request = self.transport.prepare_request(request)
+
+        response: requests.Response = None
+        raw_links = []
+        try:
+            prepared_request = self.handlers.hook_before_sending_request(prepared_request)
+            self.handlers.on_new_prepared_request(prepared_request)
+            started = time.monotonic()
+            async with self._client.request(prepared_request.method,
+                                            prepared_request.url,
+                                            headers=dict(prepared_request.headers),
+                                            data=prepared_request.body) as rsp:
+                response = build_response(rsp.status, rsp.reason, rsp.url, rsp.headers, None,
+                                          prepared_request, time.monotonic() - started)
+                self._keep_cookies(rsp, response.url)
+                if entry is not None and rsp.status == 304:
+                    self.recrawl_cache.touch(record.url)
+                    return response, prepared_request, self._build_links(entry.links)
+                reader = self._link_reader(response, entry)
+                if reader is not None:
+                    async for chunk in rsp.content.iter_chunked(self.config.chunk_size):
+                        if not reader.feed(chunk):
+                            # drop the connection instead of reading the rest
+                            rsp.close()
+                            break
+                    raw_links = self._close_reader(reader, response, record, entry)
+        except Exception:
+            logger.debug("request failed: %s", request.url, exc_info=True)
+
+        links = self._build_links(raw_links) if response is not None else []
+        return response, prepared_request, links
+
+    def _keep_cookies(self, rsp, url):
+        if self.config.fixed_cookie:
+            return
+
+        hostname = urlparse(url).hostname
+        for name, morsel in rsp.cookies.items():
+            self.transport.cookiejar.set(name, morsel.value,
+                                         domain=morsel["domain"] or hostname,
+                                         path=morsel["path"] or "/")
@@ -0,0 +1,5 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Benchmarks, run each module with ``python -m crawlerpipeline.bench.<name>``.
+"""
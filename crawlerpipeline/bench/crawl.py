@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Crawl a synthetic site end to end and report the throughput.
+
+    python -m crawlerpipeline.bench.crawl [--engine thread|async|distributed]
+                                          [--server thread|asyncio] [--processes N]
+                                          [--pages 1000] [--fanout 10] ...
+                                          [--option poolsize=50 ...]
+
+The site is served by another process so the peak RSS is the crawler
+only. recall is the ratio of normal pages fetched, the fake static pages
+fetched should be close to the number of templates.
+"""
+import sys
+import time
+import typing
+import resource
+import argparse
+import multiprocessing
+from urllib.parse import urlparse
+import yaml
+from ..config import CrawlerConfig
+from ..core import CrawlerPipeline
+from ..aiocore import AsyncCrawlerPipeline
+from ..distributed import DistributedCrawlerPipeline
+from .site import (SiteSpec, SyntheticSite, SiteServer, FAKE_STATIC_TEMPLATES,
+                   add_spec_arguments, spec_from_arguments)
+
+
+class CrawlReport(typing.NamedTuple):
+    requests: int
+    seconds: float
+    pages_per_second: float
+    p50: float
+    p99: float
+    # MB, the whole process
+    peak_rss: float
+    recall: float
+    fake_static: int
+    templates: int
+    errors: int
+    # pages with a session id
+    traps: int = 0
+    # pages not parsed, near duplicates of another one
+    near_dups: int = 0
+    # connections opened by the transport
+    connections: int = 0
+
+
+def _serve(spec, use_asyncio, conn):
+    server = SiteServer(SyntheticSite(spec), use_asyncio=use_asyncio).start()
+    conn.send(server.port)
+    # wait until the crawl is finished
+    conn.recv()
+    server.stop()
+
+
+class _Recorder(object):
+    """remember the paths fetched, in the dispatcher of every engine"""
+
+    def _on_result(self, fetch_result):
+        parts = urlparse(fetch_result.record.url)
+        self.fetched_paths.append(parts.path + ("?" + parts.query if parts.query else ""))
+        super()._on_result(fetch_result)
+
+
+ENGINES = {
+    "thread": CrawlerPipeline,
+    "async": AsyncCrawlerPipeline,
+    "distributed": DistributedCrawlerPipeline,
+}
+
+
+def build_config(**options) -> CrawlerConfig:
+    config = CrawlerConfig()
+    config.merge_config_from_dict({"crawler_options": options})
+    return config
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB on linux
+    if sys.platform == "darwin":
+        rss /= 1024
+    return rss / 1024
+
+
+def run_crawl(spec: SiteSpec, engine="thread", server="thread", processes=None, **options) -> CrawlReport:
+    conn, child = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_serve, args=(spec, server == "asyncio", child))
+    process.daemon = True
+    process.start()
+    try:
+        port = conn.recv()
+        cls = type("Recording" + ENGINES[engine].__name__, (_Recorder, ENGINES[engine]), {})
+        if engine == "distributed":
+            pipeline = cls(build_config(**options), processes=processes)
+        else:
+            pipeline = cls(build_config(**options))
+        pipeline.fetched_paths = []
+        started = time.monotonic()
+        pipeline.start("http://127.0.0.1:{}/".format(port))
+        pipeline.wait_until_finished()
+        seconds = time.monotonic() - started
+    finally:
+        conn.send(None)
+        process.join()
+
+    site = SyntheticSite(spec)
+    fetched = set(pipeline.fetched_paths)
+    summary = pipeline.get_summary()
+    latency = summary.metrics["histograms"]["fetch_seconds"][""]
+    statuses = summary.metrics["counters"].get("responses_total", {})
+    errors = sum(v for k, v in statuses.items() if k not in ("status=200", "status=304"))
+    errors += summary.metrics["counters"]["fetch_errors_total"][""]
+    requests_ = summary.current_finished_request_count
+    return CrawlReport(
+        requests=requests_,
+        seconds=seconds,
+        pages_per_second=requests_ / seconds,
+        p50=latency.p50,
+        p99=latency.p99,
+        peak_rss=peak_rss_mb(),
+        recall=len(fetched.intersection(site.paths)) / len(site.paths),
+        fake_static=sum(1 for path in fetched if site.is_fake_static(path)),
+        templates=len(FAKE_STATIC_TEMPLATES),
+        errors=errors,
+        traps=sum(1 for path in fetched if site.is_trap(path)),
+        near_dups=summary.metrics["counters"]["near_dup_pages_total"][""],
+        connections=summary.metrics["gauges"].get("transport_connections", 0),
+    )
+
+
+def _option(text):
+    name, _, value = text.partition("=")
+    return name, yaml.safe_load(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--engine", choices=list(ENGINES), default="thread")
+    parser.add_argument("--server", choices=("thread", "asyncio"), default="thread")
+    parser.add_argument("--processes", type=int, help="worker processes of the distributed engine")
+    parser.add_argument("--option", type=_option, action="append", default=[],
+                        help="crawler_options name=value")
+    add_spec_arguments(parser)
+    args = parser.parse_args(argv)
+
+    options = dict(args.option)
+    # keep the log out of the measure unless asked
+    options.setdefault("log_level", "WARNING")
+    spec = spec_from_arguments(args)
+    report = run_crawl(spec, args.engine, args.server, args.processes, **options)
+    print("{} engine, {} server, {}".format(args.engine, args.server, spec))
+    print("requests     {:>10}   errors {}   connections {}".format(
+        report.requests, report.errors, report.connections))
+    print("seconds      {:>10.2f}   {:.1f} pages/s".format(report.seconds, report.pages_per_second))
+    print("latency      p50 {:.2f} ms  p99 {:.2f} ms".format(report.p50 * 1000, report.p99 * 1000))
+    print("peak rss     {:>10.1f} MB".format(report.peak_rss))
+    print("recall       {:>10.3f}".format(report.recall))
+    print("fake static  {:>10}   for {} templates".format(report.fake_static, report.templates))
+    print("traps        {:>10}   {} near duplicates".format(report.traps, report.near_dups))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Pages per second of every link extractor.
+
+    python -m crawlerpipeline.bench.extractor [saved pages dir] [--rounds N]
+
+Without a directory a synthetic corpus is generated.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from ..utils.extractor import EXTRACTORS
+
+
+def synthetic_corpus(count=50, links=400, seed=0):
+    rand = random.Random(seed)
+    pages = []
+    for i in range(count):
+        blocks = ['<html><head><title>page {}</title>'.format(i),
+                  '<script src="/static/app.js">var s = "<a href=x>";</script>',
+                  '</head><body><div class="content">']
+        for j in range(links):
+            blocks.append(
+                '<div class="item"><a class="title" href="/post/{}/{}?p={}">post {}</a>'
+                '<p>{}</p><img alt="x" src="/img/{}.png"></div>'.format(
+                    rand.randint(1, 10000), j, rand.randint(1, 50), j,
+                    "lorem ipsum dolor sit amet " * rand.randint(1, 8), j))
+        blocks.append('</div></body></html>')
+        pages.append("\n".join(blocks).encode())
+    return pages
+
+
+def load_corpus(path):
+    pages = []
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if name.endswith((".html", ".htm")):
+                with open(os.path.join(root, name), "rb") as fp:
+                    pages.append(fp.read())
+    return pages
+
+
+def bench(pages, rounds=3):
+    results = {}
+    for name, cls in EXTRACTORS.items():
+        best = None
+        links = 0
+        for _ in range(rounds):
+            start = time.perf_counter()
+            links = sum(len(cls("utf-8").extract(page)) for page in pages)
+            cost = time.perf_counter() - start
+            best = cost if best is None else min(best, cost)
+        results[name] = (len(pages) / best, links)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("corpus", nargs="?", help="directory of saved html pages")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_corpus()
+    size = sum(len(x) for x in pages)
+    print("{} pages, {:.1f} MB".format(len(pages), size / 1024 / 1024))
+
+    results = bench(pages, args.rounds)
+    baseline = results["bs4"][0]
+    for name, (pps, links) in results.items():
+        print("{:<12} {:>10.1f} pages/s {:>8.1f}x  {} links".format(
+            name, pps, pps / baseline, links))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
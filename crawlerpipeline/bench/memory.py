@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Bytes kept in memory for each url waiting in the frontier or in the task
+queue of the pool, and for each fetch result waiting for the dispatcher.
+
+    python -m crawlerpipeline.bench.memory [--urls 100000] [--results 500]
+
+Measured with tracemalloc, the urls are the links of a synthetic site.
+"""
+import gc
+import sys
+import argparse
+import tracemalloc
+from ..core import CrawlerPipeline
+from ..utils import pool
+from ..utils.frontier import MemoryFrontier, FrontierRecord
+from .site import SiteSpec, SyntheticSite, SiteServer
+
+BASE_URL = "http://127.0.0.1:8765"
+
+
+def _urls(count):
+    """(url, parent) of the pages of a site, fanout 10 by page"""
+    site = SyntheticSite(SiteSpec(pages=max(count // 10, 1)))
+    urls = []
+    for path in site.paths:
+        parent = BASE_URL + path
+        urls.extend((BASE_URL + link, parent) for link in site.links(path))
+    return urls[:count]
+
+
+def _measure(build):
+    """bytes allocated by build and still referenced after it"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return size
+
+
+def bench_frontier(urls):
+    def build():
+        frontier = MemoryFrontier()
+        for url, parent in urls:
+            frontier.push(FrontierRecord(url, "GET", 2, priority=2, parent=parent))
+        return frontier
+    return _measure(build) / len(urls)
+
+
+def bench_task_queue(urls):
+    def noop(*args):
+        pass
+
+    def build():
+        # never started, the tasks stay in the queue
+        workers = pool.Pool(1)
+        for url, parent in urls:
+            workers.execute(noop, args=("127.0.0.1:8765", FrontierRecord(url, "GET", 2, parent=parent)))
+        return workers
+    return _measure(build) / len(urls)
+
+
+def bench_results(count):
+    """fetch results of pages of 8 KB waiting in the result queue"""
+    site = SyntheticSite(SiteSpec(pages=count, page_size=8192))
+    with SiteServer(site) as server:
+        pipeline = CrawlerPipeline()
+        pipeline._build_start_request(server.url, "GET", None, None, None, None, None)
+        records = [FrontierRecord(server.url.rstrip("/") + path, "GET", 1) for path in site.paths]
+        # connections and caches warmed up
+        pipeline._fetch("127.0.0.1", records[0])
+
+        def build():
+            queue = []
+            for record in records:
+                result = pipeline._fetch("127.0.0.1", record)
+                queue.append(pool._Result(pool._Task(pipeline._fetch, ("127.0.0.1", record), {}), result))
+            return queue
+        size = _measure(build) / count
+        pipeline.transport.close()
+    return size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--urls", type=int, default=100000)
+    parser.add_argument("--results", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.getLogger("pipeline").setLevel("WARNING")
+
+    urls = _urls(args.urls)
+    print("frontier     {:>10.0f} bytes/url".format(bench_frontier(urls)))
+    print("task queue   {:>10.0f} bytes/url".format(bench_task_queue(urls)))
+    print("result queue {:>10.0f} bytes/result".format(bench_results(args.results)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
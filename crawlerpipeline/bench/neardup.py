@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+FakeStaticPathFilter.check_and_add over synthetic site urls.
+
+    python -m crawlerpipeline.bench.neardup [--sizes 10000,100000,1000000]
+                                           [--baseline]
+
+--baseline also runs the old url_is_duplicate + add_url flow on
+simhash.SimhashIndex (sizes up to 100k only, it is slow).
+"""
+import sys
+import time
+import random
+import argparse
+from ..utils import neardup
+from ..utils.reqfilter import FakeStaticPathFilter
+
+_WORDS = ["news", "post", "tag", "user", "item", "shop", "list", "detail",
+          "search", "archive", "category", "page", "blog", "api", "video"]
+
+
+def synthetic_urls(count, hosts=20, seed=0):
+    rand = random.Random(seed)
+    for i in range(count):
+        host = "site{}.example.com".format(rand.randrange(hosts))
+        path = "/".join(rand.choice(_WORDS) + str(rand.randrange(1000))
+                        for _ in range(rand.randint(1, 4)))
+        query = "&".join("{}={}".format(rand.choice(_WORDS), rand.randrange(100))
+                         for _ in range(rand.randint(0, 3)))
+        yield "http://{}/{}{}".format(host, path, "?" + query if query else "")
+
+
+class _SimhashIndexFilter(FakeStaticPathFilter):
+    """the filter before neardup.NearDupIndex"""
+
+    def __init__(self, distance=2):
+        import simhash
+        import uuid
+
+        FakeStaticPathFilter.__init__(self, distance)
+        self._simhash = simhash
+        self._uuid = uuid
+        self._simindex = simhash.SimhashIndex([], k=distance)
+
+    def check_and_add(self, url, **kwargs):
+        _final = self._final_url(url, **kwargs)
+        if _final in self.bfilter:
+            return True
+        shash = self._simhash.Simhash(_final)
+        if self._simindex.get_near_dups(shash):
+            return True
+        self.bfilter.add(_final)
+        # the dispatcher used to hash and query twice per url
+        shash = self._simhash.Simhash(_final)
+        if not self._simindex.get_near_dups(shash):
+            self._simindex.add(self._uuid.uuid4(), shash)
+        return False
+
+
+def bench_filter(cls, size):
+    urls = list(synthetic_urls(size))
+    f = cls(distance=2)
+    start = time.perf_counter()
+    dups = sum(1 for url in urls if f.check_and_add(url, method="GET"))
+    cost = time.perf_counter() - start
+    return size / cost, dups, f
+
+
+def bench_index(size, distance=2):
+    rand = random.Random(size)
+    fps = [rand.getrandbits(64) for _ in range(size)]
+    index = neardup.NearDupIndex(distance)
+    start = time.perf_counter()
+    for fp in fps:
+        index.check_and_add(fp)
+    cost = time.perf_counter() - start
+    return size / cost, index.nbytes()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--baseline", action="store_true")
+    args = parser.parse_args(argv)
+
+    for size in [int(x) for x in args.sizes.split(",")]:
+        rate, nbytes = bench_index(size)
+        print("{:>8} fingerprints  NearDupIndex.check_and_add {:>10.0f}/s  {:.1f} MB".format(
+            size, rate, nbytes / 1024 / 1024))
+
+        rate, dups, _ = bench_filter(FakeStaticPathFilter, size)
+        print("{:>8} urls          FakeStaticPathFilter        {:>10.0f}/s  {} dups".format(
+            size, rate, dups))
+
+        if args.baseline and size <= 100000:
+            rate, dups, _ = bench_filter(_SimhashIndexFilter, size)
+            print("{:>8} urls          simhash.SimhashIndex        {:>10.0f}/s  {} dups".format(
+                size, rate, dups))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
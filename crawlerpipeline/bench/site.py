@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+A synthetic site served from localhost, the same seed always gives the
+same pages.
+
+    python -m crawlerpipeline.bench.site [--pages 1000] [--port 8765] ...
+
+Normal pages have distinct word paths. A part of the links point to fake
+static pages (/archive/2019/03/1234.html ...) built from a few templates,
+a crawler with a working FakeStaticPathFilter fetches about one page of
+each template.
+
+With --trap, links carry a new session id (?sid=<32 hex>) on every page,
+the same page under endless urls. Only content dedup stops them, run the
+crawl with a page budget.
+
+With --throttle, a part of the pages is answered 429 the first time they
+are requested, with a Retry-After date.
+"""
+import sys
+import time
+import random
+import typing
+import asyncio
+import argparse
+import threading
+import http.server
+import email.utils
+from hashlib import blake2b
+
+_WORDS = ["news", "post", "about", "team", "product", "service", "guide",
+          "docs", "support", "pricing", "career", "event", "press", "store",
+          "forum", "wiki", "report", "story", "gallery", "contact"]
+
+# n has 5 digits, every template gives one url pattern
+FAKE_STATIC_TEMPLATES = (
+    "/archive/{y}/{m:02d}/{n}.html",
+    "/item/{n}.html",
+    "/bulletin/{y}-{m:02d}-{n}.htm",
+    "/p/{n}/detail.html",
+)
+# bytes of the filler text copied at once
+_PIECE = 256
+
+
+class SiteSpec(typing.NamedTuple):
+    pages: int = 1000
+    # links in each page
+    fanout: int = 10
+    # bytes of a page, filled with text
+    page_size: int = 8192
+    # ratio of the links to fake static pages
+    fake_static: float = 0.2
+    # seconds before each response
+    latency: float = 0.0
+    # ratio of the responses with status 500
+    error_rate: float = 0.0
+    # ratio of the links with a session id
+    trap: float = 0.0
+    # send an ETag and answer If-None-Match with 304
+    etag: int = 1
+    # ratio of the pages answered 429 on their first request
+    throttle: float = 0.0
+    seed: int = 0
+
+
+def _slug(i):
+    """letters only, the dedup filter turns digits into a template"""
+    letters = []
+    i += 26 * 26
+    while i:
+        i, r = divmod(i, 26)
+        letters.append(chr(ord("a") + r))
+    return "".join(letters)
+
+
+class SyntheticSite(object):
+
+    def __init__(self, spec: SiteSpec = SiteSpec()):
+        self.spec = spec
+        rand = random.Random(spec.seed)
+        self.paths = ["/"] + ["/{}/{}-{}".format(rand.choice(_WORDS), _slug(i), rand.choice(_WORDS))
+                              for i in range(1, spec.pages)]
+        self._index = {path: i for i, path in enumerate(self.paths)}
+        # distinct text for every page, slices of a long text of many words
+        vocabulary = [_slug(rand.randrange(1 << 20)) for _ in range(4096)]
+        self._filler = " ".join(rand.choice(vocabulary) for _ in range(1 << 18)).encode()
+        # the throttled paths already answered 429
+        self._throttled = set()
+        self._lock = threading.Lock()
+
+    def _rand(self, path) -> random.Random:
+        digest = blake2b(path.encode(), digest_size=8, key=str(self.spec.seed).encode()).digest()
+        return random.Random(int.from_bytes(digest, "big"))
+
+    @staticmethod
+    def is_fake_static(path):
+        return path.startswith(("/archive/", "/item/", "/bulletin/", "/p/"))
+
+    @staticmethod
+    def is_trap(path):
+        return "?sid=" in path
+
+    def links(self, path) -> typing.List[str]:
+        """the links of a page with a session id only differ in the ids"""
+        base = path.split("?", 1)[0]
+        rand = self._rand(base)
+        i = self._index.get(base, rand.randrange(self.spec.pages))
+        # the next page keeps every page reachable
+        links = [self.paths[(i + 1) % self.spec.pages]]
+        for k in range(self.spec.fanout - 1):
+            r = rand.random()
+            if r < self.spec.fake_static:
+                template = rand.choice(FAKE_STATIC_TEMPLATES)
+                links.append(template.format(y=rand.randint(2010, 2020), m=rand.randint(1, 12),
+                                             n=rand.randint(10000, 99999)))
+            elif r < self.spec.fake_static + self.spec.trap:
+                sid = blake2b("{}#{}".format(path, k).encode(), digest_size=16).hexdigest()
+                links.append("{}?sid={}".format(self.paths[rand.randrange(self.spec.pages)], sid))
+            else:
+                links.append(self.paths[rand.randrange(self.spec.pages)])
+        return links
+
+    def throttled(self, path) -> bool:
+        """True the first time a throttled page is requested"""
+        if not self.spec.throttle or self._rand(path + "#throttle").random() >= self.spec.throttle:
+            return False
+        with self._lock:
+            if path in self._throttled:
+                return False
+            self._throttled.add(path)
+            return True
+
+    @staticmethod
+    def retry_after() -> str:
+        return email.utils.formatdate(usegmt=True)
+
+    def etag(self, body: bytes) -> str:
+        return '"{}"'.format(blake2b(body, digest_size=8).hexdigest()) if self.spec.etag else ""
+
+    def response(self, path) -> typing.Tuple[int, bytes]:
+        """status and body"""
+        full = path.split("#", 1)[0]
+        path = full.split("?", 1)[0]
+        rand = self._rand(path)
+        if self.spec.error_rate and rand.random() < self.spec.error_rate:
+            return 500, b"<html><body>error</body></html>"
+        if path not in self._index and not self.is_fake_static(path):
+            return 404, b"<html><body>not found</body></html>"
+
+        head = "<!DOCTYPE html><html><head><title>{}</title></head><body>\n".format(path)
+        items = "".join('<p><a href="{}">{}</a></p>\n'.format(link, link) for link in self.links(full))
+        body = (head + items).encode()
+        fill = max(0, self.spec.page_size - len(body) - 20)
+        # pieces from random places, two pages share little text
+        filler, parts = self._filler, []
+        while fill > 0:
+            size = min(fill, _PIECE)
+            start = rand.randrange(len(filler) - size + 1)
+            parts.append(filler[start:start + size])
+            fill -= size
+        return 200, body + b"<p>" + b"".join(parts) + b"</p></body></html>"
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # buffered headers, a body over the buffer size goes out without
+    # waiting for the delayed ack
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    site: SyntheticSite = None
+
+    def do_GET(self):
+        if self.site.spec.latency:
+            time.sleep(self.site.spec.latency)
+        if self.site.throttled(self.path):
+            self.send_response(429)
+            self.send_header("Retry-After", self.site.retry_after())
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        status, body = self.site.response(self.path)
+        etag = self.site.etag(body)
+        if etag and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _ThreadingServer(http.server.ThreadingHTTPServer):
+    # the default backlog of 5 drops connections of a busy crawler
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class SiteServer(object):
+    """Serve a SyntheticSite in a thread, with threads or asyncio."""
+
+    def __init__(self, site: SyntheticSite, host="127.0.0.1", port=0, use_asyncio=False):
+        self.site = site
+        self.host = host
+        self.port = port
+        self.use_asyncio = use_asyncio
+        self._server = None
+        self._loop = None
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+
+    @property
+    def url(self):
+        return "http://{}:{}/".format(self.host, self.port)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        elif self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _serve(self):
+        if self.use_asyncio:
+            self._serve_asyncio()
+            return
+
+        handler = type("Handler", (_Handler,), {"site": self.site})
+        self._server = _ThreadingServer((self.host, self.port), handler)
+        self.port = self._server.server_address[1]
+        self._ready.set()
+        self._server.serve_forever()
+
+    def _serve_asyncio(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port, backlog=1024))
+        self.port = server.sockets[0].getsockname()[1]
+        self._loop = loop
+        self._ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            # the keep-alive connections still open
+            tasks = asyncio.all_tasks(loop)
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = True
+                if_none_match = None
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    if line.lower().startswith(b"connection:") and b"close" in line.lower():
+                        keep_alive = False
+                    if line.lower().startswith(b"if-none-match:"):
+                        if_none_match = line.split(b":", 1)[1].strip().decode("latin-1")
+
+                if self.site.spec.latency:
+                    await asyncio.sleep(self.site.spec.latency)
+                path = request_line.split(b" ")[1].decode("latin-1")
+                status, body = self.site.response(path)
+                etag = self.site.etag(body)
+                if self.site.throttled(path):
+                    writer.write("HTTP/1.1 429 Too Many Requests\r\nRetry-After: {}\r\n"
+                                 "Content-Length: 0\r\n\r\n".format(self.site.retry_after()).encode())
+                elif etag and if_none_match == etag:
+                    writer.write("HTTP/1.1 304 Not Modified\r\nETag: {}\r\n\r\n".format(etag).encode())
+                else:
+                    writer.write(
+                        "HTTP/1.1 {} {}\r\nContent-Type: text/html; charset=utf-8\r\n"
+                        "Content-Length: {}\r\n{}\r\n".format(
+                            status, http.server.BaseHTTPRequestHandler.responses[status][0], len(body),
+                            "ETag: {}\r\n".format(etag) if etag else ""
+                        ).encode() + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--asyncio", action="store_true")
+    add_spec_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = SiteServer(SyntheticSite(spec_from_arguments(args)), port=args.port,
+                        use_asyncio=args.asyncio).start()
+    print("serving {} pages on {}".format(args.pages, server.url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser):
+    for name, default in SiteSpec._field_defaults.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(default), default=default)
+
+
+def spec_from_arguments(args) -> SiteSpec:
+    return SiteSpec(**{name: getattr(args, name) for name in SiteSpec._fields})
+
+
+if __name__ == "__main__":
+    sys.exit(main())
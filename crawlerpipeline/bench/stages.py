@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Micro benchmarks of every stage a page goes through, on the pages of a
+synthetic site.
+
+    python -m crawlerpipeline.bench.stages [--pages 1000] [--tasks 100000]
+"""
+import sys
+import time
+import argparse
+from ..utils import pool
+from ..utils.admission import AdmissionRules
+from ..utils.extractor import EXTRACTORS
+from ..utils.reqfilter import FakeStaticPathFilter
+from ..utils.urlinfo import URLNormalizer
+from .site import SiteSpec, SyntheticSite
+
+BASE_URL = "http://127.0.0.1:8765/"
+
+
+def _timeit(func, count, rounds=3):
+    """items per second of the best round"""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        cost = time.perf_counter() - start
+        best = cost if best is None else min(best, cost)
+    return count / best
+
+
+def bench_extract(pages):
+    results = {}
+    for name, cls in EXTRACTORS.items():
+        results[name] = _timeit(lambda: [cls("utf-8").extract(page) for page in pages], len(pages))
+    return results
+
+
+def bench_normalize(links):
+    f = FakeStaticPathFilter(2)
+
+    def cold():
+        normalizer = URLNormalizer(BASE_URL, False, f.path_template, f.query_template)
+        for link in links:
+            normalizer.parse(link)
+
+    normalizer = URLNormalizer(BASE_URL, False, f.path_template, f.query_template)
+
+    def warm():
+        for link in links:
+            normalizer.parse(link)
+
+    warm()
+    return {"cold": _timeit(cold, len(links)), "warm": _timeit(warm, len(links))}
+
+
+def bench_filters(links):
+    templates = FakeStaticPathFilter(2)
+    normalizer = URLNormalizer(BASE_URL, False, templates.path_template, templates.query_template)
+    infos = [normalizer.parse(link) for link in links]
+    rules = AdmissionRules("127.0.0.1:8765", domain_blacklist=["*.example.com"],
+                           suffix_blacklist=[".jpg", ".png", ".zip"], path_exclude=[r"^/logout"])
+
+    def dedup():
+        f = FakeStaticPathFilter(2)
+        for info in infos:
+            f.check_and_add(info, method="GET")
+
+    return {
+        "admission": _timeit(lambda: rules.evaluate(infos), len(infos)),
+        "FakeStaticPathFilter": _timeit(dedup, len(infos), rounds=1),
+    }
+
+
+def bench_pool(tasks, size=20):
+    """tasks per second through execute and the result queue"""
+    workers = pool.Pool(size)
+    workers.start()
+    start = time.perf_counter()
+    for i in range(tasks):
+        workers.execute(int, args=(i,))
+    for _ in range(tasks):
+        workers.result_queue.get()
+    cost = time.perf_counter() - start
+    workers.stop()
+    return tasks / cost
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--tasks", type=int, default=100000)
+    args = parser.parse_args(argv)
+
+    site = SyntheticSite(SiteSpec(pages=args.pages))
+    pages = [site.response(path)[1] for path in site.paths]
+    links = [link for path in site.paths for link in site.links(path)]
+    print("{} pages, {} links".format(len(pages), len(links)))
+
+    for name, rate in bench_extract(pages).items():
+        print("extract      {:<22} {:>12.0f} pages/s".format(name, rate))
+    for name, rate in bench_normalize(links).items():
+        print("normalize    {:<22} {:>12.0f} links/s".format(name, rate))
+    for name, rate in bench_filters(links).items():
+        print("filter       {:<22} {:>12.0f} links/s".format(name, rate))
+    print("pool         {:<22} {:>12.0f} tasks/s".format("execute + result", bench_pool(args.tasks)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
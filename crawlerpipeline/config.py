@@ -1,49 +1,202 @@
 #!/usr/bin/env python3
 # coding:utf-8
-import yaml
-
-_DEFAULT_CONFIG = """
-request_params:
-  method: "GET"
-  headers:
-    User-Agent: "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36"
-  data:
-  params:
-  auth:
-  cookies:
-  json:
-
-crawler_options:
-  
-
-  fixed_cookie: false
-  poolsize: 20
-
-  url_simhash_distance: 2
-  filter_dothtml: true
-  ignore_param_value: false
-  allow_fragment: false
-  allow_to_crawl_subdomain: false
-  allow_static_file_with_query: false
-  allow_fake_static_filter: true
-  
-  domain_whitelist: []
-  domain_blacklist: []
-  
-  suffix_blacklist: [
-    ".pdf", ".zip",
-    ".docx", ".doc", ".ppt", ".pptx",
-    ".jpg", ".png", ".gif", ".jpeg"
-    # ".js", ".css"
-  ]
-"""
+import os
+
+# plain data, copied for each CrawlerConfig, yaml is only imported for
+# the config files
+_DEFAULT_CONFIG = {
+    "request_params": {
+        "method": "GET",
+        "headers": {
+            "User-Agent": "Mozilla/5.0 (Windows NT 6.1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/41.0.2228.0 Safari/537.36",
+        },
+        "data": None,
+        "params": None,
+        "auth": None,
+        "cookies": None,
+        "json": None,
+    },
+    "crawler_options": {
+        "fixed_cookie": False,
+        "poolsize": 20,
+        # > 0 for an elastic pool: from poolsize, between pool_min_size and
+        # pool_max_size workers, growing while requests wait on the network
+        "pool_max_size": 0,
+        "pool_min_size": 2,
+        # seconds between two scaling decisions
+        "pool_scale_interval": 0.5,
+        # seconds without a request before a worker above pool_min_size exits
+        "pool_idle_timeout": 10,
+        # grow only if the requests spend this part of their time off the cpu
+        "pool_io_ratio": 0.5,
+
+        # requests, or httpx for HTTP/2 (needs httpx[http2])
+        "transport": "requests",
+        # seconds, [connect, read]
+        "timeout": [10, 30],
+        # retry on connection errors and 502/504
+        "max_retries": 2,
+        "retry_backoff": 0.5,
+        # max in-flight requests for AsyncCrawlerPipeline
+        "async_concurrency": 1000,
+
+        # per host politeness, 0 for no per host concurrency limit
+        "host_concurrency": 0,
+        # requests per second for each host, 0 for no limit
+        "host_rate_limit": 0,
+        "host_rate_burst": 1,
+        # shrink per host concurrency on 429/503 and rising latency
+        "adaptive_host_limit": False,
+        # a page answered 429/503 is fetched again after the back off of
+        # its host, up to this many times
+        "slowdown_retries": 3,
+
+        "url_simhash_distance": 2,
+        "filter_dothtml": True,
+        "ignore_param_value": False,
+        "allow_fragment": False,
+        "allow_to_crawl_subdomain": False,
+        "allow_static_file_with_query": False,
+        "allow_fake_static_filter": True,
+
+        # url dedup: bloom (grows in stages) or exact (64 bit hashes)
+        "dedup_backend": "bloom",
+        # urls before the first growth
+        "dedup_capacity": 1000000,
+        # false positive rate of the bloom filter, all the stages together
+        "dedup_error_rate": 0.0001,
+        # bytes, the set stops growing there, 0 for no limit, a full exact
+        # set puts the new urls in a bloom filter of the bytes left
+        "dedup_memory_limit": 0,
+        # keep the dedup table in a file mapped in this dir, "" for memory
+        "dedup_mmap_dir": "",
+        # pages whose text, template left out, is within this simhash
+        # distance of a page parsed are not parsed, 0 for off
+        "content_simhash_distance": 0,
+        # priority added to the urls of a pattern (path template and query
+        # keys) for each near duplicated page it gave
+        "near_dup_penalty": 1,
+
+        # keep the frontier and dedup state in this dir to resume the crawl
+        "checkpoint_dir": "",
+        # seconds between two checkpoints
+        "checkpoint_interval": 60,
+        # max records moved from the frontier into the scheduler
+        "frontier_window": 1000,
+        # batches of on_new_urls/on_new_domains queued for a background
+        # thread, 0 for calling them in the dispatcher
+        "handler_queue_size": 0,
+        # write every response to a sink: jsonl, warc or sqlite, "" for none
+        "sink": "",
+        # directory of the jsonl/warc files, file of sqlite
+        "sink_path": "crawl",
+        # keep the body read for the links, up to max_body_size
+        "sink_body": False,
+        # bytes of a file before the next one, 0 for one file
+        "sink_rotate_size": 268435456,
+        # bytes of the records waiting for the writer thread
+        "sink_buffer_size": 16777216,
+        "sink_batch_size": 500,
+        # sqlite file of the etags, content hashes and links of the pages
+        # crawled, for rescans of the same site, "" for none
+        "recrawl_cache": "",
+        # seconds an entry is used, 0 for ever
+        "recrawl_cache_max_age": 604800,
+        # bytes of the entries, the oldest are dropped first, 0 for no limit
+        "recrawl_cache_max_size": 268435456,
+        # level of the pipeline logger, "" to leave it alone
+        "log_level": "INFO",
+        # write the log records in a background thread
+        "log_queue": True,
+        # debug records of one url or response in every log_url_every
+        "log_url_every": 100,
+        # spans of the stages of one request in every trace_sample_every,
+        # written to trace_path as Chrome trace events, 0 for off
+        "trace_sample_every": 0,
+        "trace_path": "trace.json",
+        # worker processes of DistributedCrawlerPipeline, 0 for the cpu count
+        "worker_processes": 0,
+        # seconds without a heartbeat of a shard's worker before its
+        # requests are failed
+        "worker_timeout": 60,
+        # bfs, dfs or score (CrawlerPipelineHandler.score_url, higher first)
+        "crawl_order": "bfs",
+        # budgets of a crawl, 0 for no limit
+        "max_depth": 0,
+        "max_pages": 0,
+        "max_pages_per_domain": 0,
+        # seconds
+        "time_budget": 0,
+
+        # parsed urls kept in the LRU cache
+        "url_cache_size": 65536,
+
+        # fast (regex tag scanner), htmlparser or bs4
+        "link_extractor": "fast",
+        # bodies are streamed, stop reading after max_body_size bytes (0 for no limit)
+        "max_body_size": 5242880,
+        "chunk_size": 65536,
+        # drop the responses not looking like html before downloading them
+        "html_only": True,
+
+        # a rule is a domain, *.domain for its subdomains or .domain for both
+        "domain_whitelist": [],
+        "domain_blacklist": [],
+        # regex searched in the url path, include is ignored if empty
+        "path_include": [],
+        "path_exclude": [],
+
+        "suffix_blacklist": [
+            ".pdf", ".zip",
+            ".docx", ".doc", ".ppt", ".pptx",
+            ".jpg", ".png", ".gif", ".jpeg",
+            # ".js", ".css"
+        ],
+    },
+}
+
+
+def copy_config(value):
+    """deepcopy of plain config data, a few times faster"""
+    if isinstance(value, dict):
+        return {k: copy_config(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_config(v) for v in value]
+    return value
+
+
+def merge_config(config: dict, other: dict) -> dict:
+    """merge other into config, the dicts recursively"""
+    for key, value in other.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            merge_config(config[key], value)
+        else:
+            config[key] = copy_config(value)
+    return config
+
+
+# path -> ((mtime, size), parsed data)
+_file_cache = {}
+
+
+def load_config_file(path) -> dict:
+    """a yaml config file, parsed again only when it changes"""
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _file_cache.get(path)
+    if cached is None or cached[0] != version:
+        import yaml
+
+        with open(path) as fp:
+            cached = _file_cache[path] = (version, yaml.safe_load(fp))
+    return copy_config(cached[1])
 
 
 class CrawlerConfig:
 
     def __init__(self, config={}):
         if not config:
-            config = yaml.load(_DEFAULT_CONFIG)
+            config = copy_config(_DEFAULT_CONFIG)
 
         self._config = config
         self._options = config["crawler_options"]
@@ -60,6 +213,91 @@ class CrawlerConfig:
 
     poolsize = crawler_poolsize
 
+    @property
+    def pool_max_size(self):
+        """"""
+        return int(self._options.get("pool_max_size", 0))
+
+    @property
+    def pool_min_size(self):
+        """"""
+        return int(self._options.get("pool_min_size", 2))
+
+    @property
+    def pool_scale_interval(self):
+        """"""
+        return float(self._options.get("pool_scale_interval", 0.5))
+
+    @property
+    def pool_idle_timeout(self):
+        """"""
+        return float(self._options.get("pool_idle_timeout", 10))
+
+    @property
+    def pool_io_ratio(self):
+        """"""
+        return float(self._options.get("pool_io_ratio", 0.5))
+
+    @property
+    def max_workers(self):
+        """poolsize, or pool_max_size of an elastic pool"""
+        return max(self.poolsize, self.pool_max_size)
+
+    @property
+    def transport(self):
+        """name of the transport in utils.transport.TRANSPORTS"""
+        return str(self._options.get("transport", "requests"))
+
+    @property
+    def timeout(self):
+        """(connect, read) seconds, None for no timeout"""
+        timeout = self._options.get("timeout", [10, 30])
+        if not timeout:
+            return None
+        if isinstance(timeout, (list, tuple)):
+            return tuple(float(x) for x in timeout)
+        return float(timeout), float(timeout)
+
+    @property
+    def max_retries(self):
+        """"""
+        return int(self._options.get("max_retries", 2))
+
+    @property
+    def retry_backoff(self):
+        """"""
+        return float(self._options.get("retry_backoff", 0.5))
+
+    @property
+    def async_concurrency(self):
+        """max in-flight requests on the event loop"""
+        return int(self._options.get("async_concurrency", 1000))
+
+    @property
+    def host_concurrency(self):
+        """max concurrent requests for each host, 0 for no limit"""
+        return int(self._options.get("host_concurrency", 0))
+
+    @property
+    def host_rate_limit(self):
+        """token bucket rate (requests/sec) for each host, 0 for no limit"""
+        return float(self._options.get("host_rate_limit", 0))
+
+    @property
+    def host_rate_burst(self):
+        """"""
+        return int(self._options.get("host_rate_burst", 1))
+
+    @property
+    def adaptive_host_limit(self):
+        """"""
+        return bool(self._options.get("adaptive_host_limit", False))
+
+    @property
+    def slowdown_retries(self):
+        """times a page answered 429/503 is fetched again"""
+        return int(self._options.get("slowdown_retries", 3))
+
     @property
     def fixed_cookie(self):
         """"""
@@ -99,6 +337,16 @@ class CrawlerConfig:
         """"""
         return list(self._options['domain_blacklist'])
 
+    @property
+    def path_include(self):
+        """"""
+        return list(self._options.get('path_include') or [])
+
+    @property
+    def path_exclude(self):
+        """"""
+        return list(self._options.get('path_exclude') or [])
+
     @property
     def suffix_blacklist(self):
         """"""
@@ -113,15 +361,199 @@ class CrawlerConfig:
     def allow_fake_static_filter(self):
         return bool(self._options.get("allow_fake_static_filter", False))
 
-    def merge_config_from_file(self, config_file):
+    @property
+    def worker_processes(self):
+        """"""
+        return int(self._options.get("worker_processes", 0))
+
+    @property
+    def worker_timeout(self):
+        """seconds without a heartbeat before a worker is dead"""
+        return float(self._options.get("worker_timeout", 60))
+
+    @property
+    def crawl_order(self):
+        """"""
+        return str(self._options.get("crawl_order") or "bfs").lower()
+
+    @property
+    def max_depth(self):
+        """"""
+        return int(self._options.get("max_depth", 0))
+
+    @property
+    def max_pages(self):
+        """"""
+        return int(self._options.get("max_pages", 0))
+
+    @property
+    def max_pages_per_domain(self):
+        """"""
+        return int(self._options.get("max_pages_per_domain", 0))
+
+    @property
+    def time_budget(self):
+        """seconds of crawling before stop scheduling, resumable with checkpoint"""
+        return float(self._options.get("time_budget", 0))
+
+    @property
+    def url_cache_size(self):
         """"""
-        with open(config_file) as fp:
-            config = yaml.load(fp)
+        return int(self._options.get("url_cache_size", 65536))
 
-        return self._config.update(config)
+    @property
+    def link_extractor(self):
+        """name of the link extractor in utils.extractor.EXTRACTORS"""
+        return str(self._options.get("link_extractor", "fast"))
+
+    @property
+    def max_body_size(self):
+        """"""
+        return int(self._options.get("max_body_size", 5242880))
+
+    @property
+    def chunk_size(self):
+        """"""
+        return int(self._options.get("chunk_size", 65536))
+
+    @property
+    def html_only(self):
+        """check Content-Type or the first bytes before extracting links"""
+        return bool(self._options.get("html_only", True))
+
+    @property
+    def checkpoint_dir(self):
+        """"""
+        return str(self._options.get("checkpoint_dir") or "")
+
+    @property
+    def checkpoint_interval(self):
+        """"""
+        return float(self._options.get("checkpoint_interval", 60))
+
+    @property
+    def frontier_window(self):
+        """"""
+        return int(self._options.get("frontier_window", 1000))
+
+    @property
+    def handler_queue_size(self):
+        """"""
+        return int(self._options.get("handler_queue_size", 0))
+
+    @property
+    def sink(self):
+        """"""
+        return self._options.get("sink") or ""
+
+    @property
+    def sink_path(self):
+        """"""
+        return self._options.get("sink_path") or "crawl"
+
+    @property
+    def sink_body(self):
+        """"""
+        return bool(self._options.get("sink_body", False))
+
+    @property
+    def sink_rotate_size(self):
+        """"""
+        return int(self._options.get("sink_rotate_size", 268435456))
+
+    @property
+    def sink_buffer_size(self):
+        """"""
+        return int(self._options.get("sink_buffer_size", 16777216))
+
+    @property
+    def sink_batch_size(self):
+        """"""
+        return int(self._options.get("sink_batch_size", 500))
+
+    @property
+    def recrawl_cache(self):
+        """"""
+        return self._options.get("recrawl_cache") or ""
+
+    @property
+    def recrawl_cache_max_age(self):
+        """"""
+        return float(self._options.get("recrawl_cache_max_age", 604800))
+
+    @property
+    def recrawl_cache_max_size(self):
+        """"""
+        return int(self._options.get("recrawl_cache_max_size", 268435456))
+
+    @property
+    def log_level(self):
+        """"""
+        return self._options.get("log_level", "INFO")
+
+    @property
+    def log_queue(self):
+        """"""
+        return bool(self._options.get("log_queue", True))
+
+    @property
+    def log_url_every(self):
+        """"""
+        return int(self._options.get("log_url_every", 100))
+
+    @property
+    def trace_sample_every(self):
+        """"""
+        return int(self._options.get("trace_sample_every", 0))
+
+    @property
+    def trace_path(self):
+        """"""
+        return self._options.get("trace_path") or ""
+
+    @property
+    def dedup_backend(self):
+        """"""
+        return self._options.get("dedup_backend") or "bloom"
+
+    @property
+    def dedup_capacity(self):
+        """"""
+        return int(self._options.get("dedup_capacity", 1000000))
+
+    @property
+    def dedup_error_rate(self):
+        """"""
+        return float(self._options.get("dedup_error_rate", 0.0001))
+
+    @property
+    def dedup_memory_limit(self):
+        """"""
+        return int(self._options.get("dedup_memory_limit", 0))
+
+    @property
+    def dedup_mmap_dir(self):
+        """"""
+        return self._options.get("dedup_mmap_dir") or ""
+
+    @property
+    def content_simhash_distance(self):
+        """"""
+        return int(self._options.get("content_simhash_distance", 0))
+
+    @property
+    def near_dup_penalty(self):
+        """"""
+        return float(self._options.get("near_dup_penalty", 1))
+
+    def merge_config_from_file(self, config_file):
+        """"""
+        return self.merge_config_from_dict(load_config_file(config_file))
 
     def merge_config_from_dict(self, dict_):
-        self._config.update(dict_)
+        """the sections of dict_ are merged over the current ones, the options left out are kept"""
+        merge_config(self._config, dict_)
+        self._options = self._config["crawler_options"]
 
 
 global_config = CrawlerConfig()
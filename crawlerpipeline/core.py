@@ -1,21 +1,34 @@
 #!/usr/bin/env python3
 # coding:utf-8
 import os
+import copy
+import time
+import functools
+import pickle
 import typing
-import bs4
-import queue
-from urllib.parse import urljoin, urlparse
 import requests
-import traceback
 import threading
 from .config import CrawlerConfig
-from .utils import outils, pool, reqfilter
+from .utils import (outils, pool, reqfilter, scheduler, extractor, frontier, urlinfo, transport,
+                    admission, metrics, delivery, sink, recrawl, neardup, dedup, trace)
 
 logger = outils.get_logger("pipeline")
-logger.setLevel("DEBUG")
 
 
 class CrawlerPipelineHandler(object):
+    """
+    The batch hooks (on_new_urls, on_new_domains, extra_url_checker_batch)
+    get the urls of a page at once, by default they call the hooks of one
+    url. Override them for a handler with a round trip per call.
+
+    A handler overriding only on_new_url and on_new_domain gets them in
+    the order of the links, on_new_domain right after the first url of the
+    domain. With on_new_urls or on_new_domains overridden, the new urls of
+    a page come before its new domains.
+
+    With handler_queue_size, on_new_urls and on_new_domains are called in
+    a background thread, batches of several pages are merged.
+    """
 
     def __init__(self, pipeline):
         self.pipeline: CrawlerPipeline = pipeline
@@ -23,6 +36,10 @@ class CrawlerPipelineHandler(object):
     def extra_url_checker(self, url):
         return True
 
+    def extra_url_checker_batch(self, urls: typing.List[str]) -> typing.List[bool]:
+        """true for pass, one for each url"""
+        return [self.extra_url_checker(url) for url in urls]
+
     def hook_before_preparing_request(self, request):
         return request
 
@@ -35,6 +52,18 @@ class CrawlerPipelineHandler(object):
     def on_new_url(self, url: str):
         pass
 
+    def on_new_domains(self, domains: typing.List[str]):
+        for domain in domains:
+            self.on_new_domain(domain)
+
+    def on_new_urls(self, urls: typing.List[str]):
+        for url in urls:
+            self.on_new_url(url)
+
+    def score_url(self, url: str, depth: int, parent: str) -> float:
+        """priority of a url for crawl_order score, higher is crawled first"""
+        return 0.0
+
     def on_new_prepared_request(self, request: requests.PreparedRequest):
         pass
 
@@ -45,43 +74,201 @@ class CrawlerPipelineHandler(object):
         pass
 
 
+class _Link(typing.NamedTuple):
+    info: urlinfo.URLInfo
+    # passed the domain and suffix checks
+    allowed: bool
+
+
+class _FetchResult(typing.NamedTuple):
+    host: str
+    record: frontier.FrontierRecord
+    response: requests.Response
+    prepared_request: requests.PreparedRequest
+    links: typing.List[_Link]
+
+
 class CrawlerPipelineSummary(typing.NamedTuple):
     current_finished_request_count: int
     current_started_request_count: int
+    # Metrics.snapshot() of the crawl
+    metrics: dict = None
+    # requests per second of every host
+    host_rates: typing.Dict[str, float] = None
+
+
+class _LinkReader(object):
+    """
+    Extract links from the chunks of a streamed body, stop reading at
+    max_size or when the first chunk does not look like html.
+    """
+
+    def __init__(self, link_extractor: extractor.LinkExtractor, html=True, max_size=0, keep_body=False,
+                 hash_content=False, known_hash=None, content_check=None):
+        self.extractor = link_extractor
+        # None until the first chunk is sniffed
+        self.html = html
+        self.max_size = max_size
+        self.size = 0
+        self.received = 0
+        self.truncated = False
+        self.links = []
+        # seconds spent in the extractor
+        self.parse_time = 0.0
+        # the chunks read, for the sink
+        self.chunks = [] if keep_body else None
+        self.hasher = recrawl.content_hasher() if hash_content or known_hash else None
+        # a page of the recrawl cache is parsed only if its content changed
+        self.known_hash = known_hash
+        # content_check(body) is True for a near duplicated page, not parsed
+        self.content_check = content_check
+        self._deferred = [] if known_hash or content_check else None
+        self.unchanged = False
+        self.near_dup = False
+        # the body could not be read to the end
+        self.failed = False
+
+    @property
+    def content_hash(self):
+        return self.hasher.hexdigest() if self.hasher else ""
+
+    def feed(self, chunk: bytes) -> bool:
+        """False for stop reading"""
+        self.received += len(chunk)
+        if self.html is None:
+            self.html = extractor.sniff_html(chunk)
+        if not self.html:
+            return False
+
+        if self.max_size and self.size + len(chunk) > self.max_size:
+            chunk = chunk[:self.max_size - self.size]
+            self.truncated = True
+        self.size += len(chunk)
+        if self.chunks is not None:
+            self.chunks.append(chunk)
+        if self.hasher is not None:
+            self.hasher.update(chunk)
+        if self._deferred is not None:
+            self._deferred.append(chunk)
+            return not self.truncated
+        self._parse(chunk)
+        return not self.truncated
+
+    def _parse(self, chunk):
+        started = time.perf_counter()
+        self.links.extend(self.extractor.feed(chunk))
+        self.parse_time += time.perf_counter() - started
+
+    def close(self) -> typing.List[str]:
+        """the links, empty if unchanged"""
+        if not self.html:
+            return self.links
+        if self._deferred is not None:
+            if self.known_hash and self.content_hash == self.known_hash:
+                self.unchanged = True
+                return self.links
+            if self.content_check is not None:
+                started = time.perf_counter()
+                self.near_dup = self.content_check(b"".join(self._deferred))
+                self.parse_time += time.perf_counter() - started
+                if self.near_dup:
+                    return self.links
+            for chunk in self._deferred:
+                self._parse(chunk)
+            self._deferred = None
+        started = time.perf_counter()
+        self.links.extend(self.extractor.close())
+        self.parse_time += time.perf_counter() - started
+        return self.links
 
 
 def _null(*v, **kw):
     pass
 
 
+def _call_in_order(events):
+    """(hook, item) of the per url hooks"""
+    for hook, item in events:
+        hook(item)
+
+
+def _overrides(handler, *names):
+    return any(getattr(type(handler), name) is not getattr(CrawlerPipelineHandler, name)
+               for name in names)
+
+
 class CrawlerPipeline(object):
 
     def __init__(self, config: CrawlerConfig = None, handler=None):
         self.config = config or CrawlerConfig()
+        self._setup_logging()
         handler = handler or CrawlerPipelineHandler
         self.handlers: CrawlerPipelineHandler = handler(pipeline=self)
-
-        # build worker pool and disable result queue
-        self.worker_pool = pool.Pool(self.config.poolsize)
-        self._old_execute = self.worker_pool.execute
-        self.worker_pool.execute = self._fake_execute
-
-        # dispatcher thread
-        self.dispacher_thread = threading.Thread(target=self._pipeline_dispatcher)
-        self.dispacher_thread.daemon = True
+        # the hooks left to CrawlerPipelineHandler are not called at all
+        self._url_hooks = _overrides(self.handlers, "on_new_urls", "on_new_url")
+        self._domain_hooks = _overrides(self.handlers, "on_new_domains", "on_new_domain")
+        self._extra_checker = _overrides(self.handlers, "extra_url_checker_batch", "extra_url_checker")
+        # only the per url hooks, called one link after the other
+        self._per_item_hooks = not _overrides(self.handlers, "on_new_urls", "on_new_domains")
+        # on_new_urls and on_new_domains in a background thread
+        self.delivery = None
+        if self.config.handler_queue_size > 0:
+            self.delivery = delivery.EventDelivery(self.config.handler_queue_size)
+        # every response is written to config.sink
+        self.sink_writer = self._build_sink_writer()
+        self._keep_body = self.sink_writer is not None and self.config.sink_body
+        # validators and links of the previous crawls
+        self.recrawl_cache = self._build_recrawl_cache()
+        # spans of the stages of the requests, off by default
+        self.tracer = trace.Tracer(self.config.trace_sample_every)
+        # simhash of the text of the pages parsed
+        self.content_index = None
+        if self.config.content_simhash_distance > 0:
+            self.content_index = neardup.NearDupIndex(self.config.content_simhash_distance)
+        # the shingles every page of a host has, left out of the simhash
+        self._templates = neardup.TemplateShingles()
+        self._content_lock = threading.Lock()
+        # url pattern -> near duplicated pages it gave
+        self._dup_patterns: typing.Dict[str, int] = {}
+        # patterns for the coordinator of a distributed crawl
+        self._dup_log = None
+
+        self.metrics = metrics.Metrics()
+        self._fetch_seconds = self.metrics.histogram("fetch_seconds")
+        self._parse_seconds = self.metrics.histogram("parse_seconds")
+        self._admission_seconds = self.metrics.histogram("filter_seconds", stage="admission")
+        self._dispatch_seconds = self.metrics.histogram("filter_seconds", stage="dispatch")
+        # bytes of the bodies after the Content-Encoding is decoded, not on the wire
+        self._body_bytes = self.metrics.counter("decoded_body_bytes_total")
+        self._fetch_errors = self.metrics.counter("fetch_errors_total")
+        self._near_dups = self.metrics.counter("near_dup_pages_total")
+        self._retries = self.metrics.counter("slowdown_retries_total")
+        self._dispatch_errors = self.metrics.counter("dispatch_errors_total")
+
+        self._init_engine()
 
         self._have_started_event = threading.Event()
 
-        self.session = requests.Session()
+        # keep-alive connections sized for the workers of every host
+        self.transport = transport.get_transport(self.config.transport)(
+            pool_maxsize=max(self.config.max_workers, self.config.host_concurrency),
+            pool_connections=self.config.max_workers,
+            timeout=self.config.timeout,
+            max_retries=self.config.max_retries,
+            retry_backoff=self.config.retry_backoff,
+            fixed_cookie=self.config.fixed_cookie,
+        )
         self._init_cookie = None
         self._init_request = None
         self._init_domain = None
         self._init_netloc = None
+        self.normalizer: urlinfo.URLNormalizer = None
+        self.admission: admission.AdmissionRules = None
 
         # set reqfilter
         self.request_filter = reqfilter.FakeStaticPathFilter(
             self.config.url_simhash_distance,
-            None,
+            self._build_dedup_set(),
             self.config.filter_dothtml,
             self.config.ignore_param_value
         )
@@ -89,57 +276,507 @@ class CrawlerPipeline(object):
         # domain
         self.domains = set()
 
-        # counter
+        self.link_extractor = extractor.get_extractor(self.config.link_extractor)
+
+        # urls waiting for the scheduler
+        self.checkpoint_dir = self.config.checkpoint_dir
+        self.frontier = self._build_frontier(self.checkpoint_dir)
+        self._last_checkpoint = time.monotonic()
+        self._request_params = self.config.default_request_params
+        self._default_method = str(self._request_params.get("method") or "GET")
+
+        self.crawl_order = self.config.crawl_order
+        if self.crawl_order not in frontier.CRAWL_ORDERS:
+            raise ValueError("unknown crawl order: {}, choose from {}".format(
+                self.crawl_order, list(frontier.CRAWL_ORDERS)))
+        self.budget = frontier.CrawlBudget(
+            max_pages=self.config.max_pages,
+            max_domain_pages=self.config.max_pages_per_domain,
+            max_depth=self.config.max_depth,
+            seconds=self.config.time_budget,
+        )
+        # the time budget is used up, urls are only kept for resuming
+        self._out_of_time = False
+
+        # counter, only changed by the dispatcher (or before it starts)
         self._started = 0
         self._finished = 0
 
+        self.metrics.gauge("requests_started", lambda: self._started)
+        self.metrics.gauge("requests_finished", lambda: self._finished)
+        self.metrics.gauge("frontier_size", lambda: len(self.frontier))
+        self.metrics.gauge("scheduler_pending", lambda: self.scheduler.pending_count)
+        self.metrics.gauge("scheduler_in_flight", lambda: self.scheduler.in_flight_count)
+        self.metrics.gauge("dedup_urls", lambda: self._dedup_stat("count"))
+        self.metrics.gauge("dedup_bytes", lambda: self._dedup_stat("nbytes"))
+        self.metrics.gauge("dedup_fp_rate", lambda: self._dedup_stat("fp_rate"))
+        self.metrics.gauge("dedup_saturated", lambda: int(self._dedup_stat("saturated")))
+        if self.delivery is not None:
+            self.metrics.gauge("handler_queue_size", lambda: self.delivery.pending_count)
+            self.metrics.gauge("handler_queue_blocked", lambda: self.delivery.blocked)
+        if self.sink_writer is not None:
+            self.metrics.gauge("sink_buffered_bytes", lambda: self.sink_writer.buffered_bytes)
+            self.metrics.gauge("sink_written", lambda: self.sink_writer.written)
+        if self.recrawl_cache is not None:
+            self.metrics.gauge("recrawl_cache_hits", lambda: self.recrawl_cache.hits)
+            self.metrics.gauge("recrawl_cache_misses", lambda: self.recrawl_cache.misses)
+
+    def _init_engine(self):
+        # build worker pool and disable result queue
+        self.worker_pool = self._build_pool()
+
+        # per host politeness between dispatcher and worker pool, an
+        # elastic pool sees the queue of the requests over its workers
+        self.scheduler = self._build_scheduler(self.config.max_workers, self._execute)
+
+        # dispatcher thread
+        self.dispacher_thread = threading.Thread(target=self._pipeline_dispatcher)
+        self.dispacher_thread.daemon = True
+
+        self.metrics.gauge("pool_queued", lambda: self.worker_pool.task_queue.qsize())
+        self.metrics.gauge("pool_outstanding", lambda: self.worker_pool.outstanding_count)
+        self.metrics.gauge("pool_workers", lambda: self.worker_pool.worker_count)
+        self.metrics.gauge("pool_busy", lambda: self.worker_pool.busy_count)
+        # keep-alive reuse: requests sent over connections opened
+        self.metrics.gauge("transport_connections", lambda: self.transport.stats().connections)
+        self.metrics.gauge("transport_requests", lambda: self.transport.stats().requests)
+
     def start(self, start_url, method="GET", headers=None, data=None,
               params=None, auth=None, cookies=None):
         if self._have_started_event.is_set():
             raise ValueError("the pipeline is started.")
 
+        req = self._build_start_request(start_url, method, headers, data,
+                                        params, auth, cookies)
+
+        # a new crawl
+        self.frontier.clear()
+        self.budget.admit(self._init_domain)
+        self._schedule(req.url, req.method, depth=0)
+        self._feed_scheduler()
+
+        self._start_writers()
+        self._launch()
+        self.handlers.on_pipeline_starting()
+
+    def resume(self, checkpoint=None):
+        """
+        Continue the crawl saved in checkpoint dir (config.checkpoint_dir
+        by default) instead of start.
+        """
+        if self._have_started_event.is_set():
+            raise ValueError("the pipeline is started.")
+
+        self._load_checkpoint(checkpoint)
+        self._feed_scheduler()
+
+        self._start_writers()
+        self._launch()
+        self.handlers.on_pipeline_starting()
+
+    def _launch(self):
+        self._have_started_event.set()
+        self.budget.start()
+        self.metrics.start()
+        self.worker_pool.start()
+        self.scheduler.start()
+        self.dispacher_thread.start()
+
+    def _start_writers(self):
+        if self.delivery is not None:
+            self.delivery.start()
+        if self.sink_writer is not None:
+            self.sink_writer.start()
+
+    def _setup_logging(self):
+        if self.config.log_level:
+            logger.setLevel(self.config.log_level)
+        if self.config.log_queue:
+            outils.use_queue_handler(logger)
+        # debug records of the urls and responses, sampled
+        self._log_url = outils.SampledLog(logger, self.config.log_url_every)
+
+    def _build_dedup_set(self) -> dedup.DedupSet:
+        mmap_dir = self.config.dedup_mmap_dir
+        return dedup.build_dedup_set(
+            self.config.dedup_backend, self.config.dedup_capacity, self.config.dedup_error_rate,
+            self.config.dedup_memory_limit, os.path.join(mmap_dir, "urls") if mmap_dir else None,
+        )
+
+    def _dedup_stat(self, name):
+        # the filter of a checkpoint may be another bloomfilter
+        stats = self.request_filter.stats()
+        return getattr(stats, name) if stats else 0
+
+    def _build_recrawl_cache(self) -> typing.Optional[recrawl.RecrawlCache]:
+        if not self.config.recrawl_cache:
+            return None
+        cache = recrawl.RecrawlCache(self.config.recrawl_cache, self.config.recrawl_cache_max_age,
+                                     self.config.recrawl_cache_max_size)
+        cache.evict()
+        return cache
+
+    def _build_sink_writer(self) -> typing.Optional[sink.SinkWriter]:
+        if not self.config.sink:
+            return None
+        return sink.SinkWriter(
+            sink.get_sink(self.config.sink)(self.config.sink_path, self.config.sink_rotate_size),
+            max_buffer=self.config.sink_buffer_size,
+            batch_size=self.config.sink_batch_size,
+        )
+
+    def _build_start_request(self, start_url, method, headers, data,
+                             params, auth, cookies):
         req = self.build_request(start_url, method, headers, data,
                                  params, auth, cookies)
         self._init_cookie = cookies
         self._init_request = req
-        self._init_domain, self._init_netloc = self.__extract_domainNnetloc(req.url)
+        self._build_normalizer()
+        self._fix_cookie()
+        return req
 
-        self._have_started_event.set()
-        self.worker_pool.start()
-        self.dispacher_thread.start()
+    def _fix_cookie(self):
+        """with fixed_cookie, every request is sent with the start cookies"""
+        if self.config.fixed_cookie and self._init_cookie:
+            self.transport.cookiejar.update(
+                transport.build_cookiejar(self._init_cookie))
+
+    def _build_normalizer(self):
+        """relative links are joined with the start url"""
+        self.normalizer = urlinfo.URLNormalizer(
+            self._init_request.url, self.config.allow_fragment,
+            self.request_filter.path_template, self.request_filter.query_template,
+            self.config.url_cache_size
+        )
+        info = self.normalizer.parse(self._init_request.url)
+        self._init_domain, self._init_netloc = info.domain, info.netloc
+        # the url rules are compiled once for the crawl
+        self.admission = admission.AdmissionRules.from_config(self.config, self._init_netloc)
+
+    def _build_pool(self) -> pool.Pool:
+        config = self.config
+        if not config.pool_max_size:
+            return pool.Pool(config.poolsize)
+        return pool.Pool(
+            config.poolsize, min_size=config.pool_min_size, max_size=config.pool_max_size,
+            scale_interval=config.pool_scale_interval, idle_timeout=config.pool_idle_timeout,
+            io_ratio=config.pool_io_ratio,
+        )
 
-        self.worker_pool.execute(self.request, args=(req,))
+    def _build_scheduler(self, max_in_flight, submit):
+        return scheduler.HostScheduler(
+            submit, max_in_flight=max_in_flight,
+            host_concurrency=self.config.host_concurrency,
+            host_rate=self.config.host_rate_limit,
+            host_burst=self.config.host_rate_burst,
+            adaptive=self.config.adaptive_host_limit,
+        )
 
-        self.handlers.on_pipeline_starting()
+    def _build_frontier(self, checkpoint_dir):
+        if checkpoint_dir:
+            return frontier.SQLiteFrontier(os.path.join(checkpoint_dir, "frontier.sqlite3"))
+        return frontier.MemoryFrontier()
+
+    def _schedule(self, url, method="GET", depth=0, parent=""):
+        if not self._out_of_time:
+            self._started += 1
+        self.frontier.push(frontier.FrontierRecord(
+            url, method, depth, priority=self._priority(url, depth, parent), parent=parent))
+
+    def _priority(self, url, depth, parent):
+        if self.crawl_order == "dfs":
+            priority = -depth
+        elif self.crawl_order == "score":
+            priority = -float(self.handlers.score_url(url, depth, parent))
+        else:
+            priority = depth
+        if self._dup_patterns:
+            # url patterns giving near duplicated pages go last
+            priority += self.config.near_dup_penalty * self._dup_patterns.get(self._url_pattern(url), 0)
+        return priority
+
+    def _url_pattern(self, url):
+        info = self.normalizer.parse(url)
+        if info is None:
+            return ""
+        return "{}{}?{}".format(info.netloc, info.path_template, "&".join(info.query_keys))
+
+    def _content_is_near_dup(self, url, body: bytes, encoding=None) -> bool:
+        """called in the workers, count the near duplicates of the url pattern"""
+        hashes = neardup.content_shingles(body, encoding)
+        info = self.normalizer.parse(url)
+        with self._content_lock:
+            template = self._templates.observe(info.netloc if info else "", hashes)
+        # unknown for the first pages of a host, they may share nothing but it
+        if template is None:
+            return False
+        fp = neardup.shingles_fingerprint(hashes, template)
+        if fp is None:
+            return False
+        with self._content_lock:
+            if not self.content_index.check_and_add(fp):
+                return False
+            self._count_dup_pattern(self._url_pattern(url))
+            if self._dup_log is not None:
+                self._dup_log.append(self._url_pattern(url))
+        self._log_url("near duplicated content: %s", url)
+        return True
+
+    def _count_dup_pattern(self, pattern):
+        self._near_dups.inc()
+        self._dup_patterns[pattern] = self._dup_patterns.get(pattern, 0) + 1
+
+    def _feed_scheduler(self):
+        """Move records from the frontier to the scheduler, up to frontier_window"""
+        if not self._out_of_time and self.budget.out_of_time():
+            self._stop_scheduling()
+        if self._out_of_time:
+            return
+
+        window = self.config.frontier_window
+        while self.scheduler.pending_count < window:
+            record = self.frontier.pop()
+            if record is None:
+                break
+            info = self.normalizer.parse(record.url)
+            if info is None:
+                # a url the normalizer ignores, e.g. from a checkpoint of another config
+                logger.warning("skip the url %s", record.url)
+                self._fetch_errors.inc()
+                self._finished += 1
+                self.frontier.done(record)
+                continue
+            self.tracer.wait(self.tracer.trace_id(record.url), "host queue")
+            # the host queues keep the crawl order of the records fed
+            self.scheduler.put(info.netloc, record, record.priority)
+
+    def _stop_scheduling(self):
+        """
+        Only wait for the requests in flight, the pending records are left
+        in the frontier for resume.
+        """
+        logger.info("time budget is used up, stop scheduling.")
+        self._out_of_time = True
+        drained = self.scheduler.drain()
+        self._started -= len(drained) + len(self.frontier)
+
+    def _build_record_request(self, record: frontier.FrontierRecord,
+                              entry: recrawl.CacheEntry = None) -> requests.Request:
+        if record.depth == 0 and self._init_request is not None:
+            request = self._init_request
+            if entry is not None and entry.validators:
+                request = copy.copy(request)
+                request.headers = dict(request.headers or {}, **entry.validators)
+            return request
+
+        params = self._request_params
+        if entry is not None and entry.validators:
+            params = dict(params, headers=dict(params.get("headers") or {}, **entry.validators))
+        return requests.Request(url=record.url, **dict(params, method=record.method))
+
+    def _execute(self, host, record: frontier.FrontierRecord):
+        trace_id = self.tracer.trace_id(record.url)
+        self.tracer.done_waiting(trace_id, "host queue")
+        self.tracer.wait(trace_id, "task queue")
+        self.worker_pool.execute(self._fetch, args=(host, record))
+
+    def _fetch(self, host, record: frontier.FrontierRecord) -> _FetchResult:
+        trace_id = self.tracer.trace_id(record.url)
+        self.tracer.done_waiting(trace_id, "task queue")
+        with self.tracer.stage(trace_id, "fetch", url=record.url):
+            entry = self.recrawl_cache.get(record.url) if self.recrawl_cache is not None else None
+            response, prepared_request = self.request(
+                self._build_record_request(record, entry), stream=True, trace_id=trace_id)
+            # parsing runs in the worker, not in the dispatcher
+            with self.tracer.stage(trace_id, "read and extract"):
+                links = self._extract_links(response, record, entry)
+        self.tracer.wait(trace_id, "result queue")
+        return _FetchResult(host, record, response, prepared_request, links)
+
+    def _on_result(self, fetch_result: _FetchResult):
+        """Handle a finished fetch, only called from the dispatcher."""
+        trace_id = self.tracer.trace_id(fetch_result.record.url)
+        self.tracer.done_waiting(trace_id, "result queue")
+        started = time.perf_counter()
+        self._task_done(fetch_result)
+        if self._retry(fetch_result):
+            self.tracer.span(trace_id, "on_result", started, url=fetch_result.record.url)
+            return
+        self._finished += 1
+        if self.sink_writer is not None:
+            with self.tracer.stage(trace_id, "sink"):
+                self._put_sink(self._sink_record(fetch_result))
+        self._handle_links(fetch_result, trace_id)
+        self.frontier.done(fetch_result.record)
+        self._feed_scheduler()
+        self.tracer.span(trace_id, "on_result", started, url=fetch_result.record.url)
+
+        interval = self.config.checkpoint_interval
+        if self.checkpoint_dir and time.monotonic() - self._last_checkpoint > interval:
+            self.checkpoint()
+
+    def _sink_record(self, fetch_result: _FetchResult) -> sink.SinkRecord:
+        record, response = fetch_result.record, fetch_result.response
+        if response is None:
+            return sink.SinkRecord(record.url, record.method, None, "", {}, 0.0, time.time(),
+                                   record.depth, record.parent)
+        body = response._content if self._keep_body and isinstance(response._content, bytes) else None
+        return sink.SinkRecord(
+            record.url, str(fetch_result.prepared_request.method), response.status_code,
+            response.reason, dict(response.headers), response.elapsed.total_seconds(),
+            time.time(), record.depth, record.parent, body,
+            getattr(response, "truncated", "") if body is not None else "",
+        )
+
+    def _on_finished(self):
+        self.metrics.stop()
+        self.scheduler.stop()
+        self.transport.close()
+        if self.checkpoint_dir:
+            self.checkpoint()
+        if self.delivery is not None:
+            # the events left are delivered before on_pipeline_finished
+            self.delivery.close()
+        if self.sink_writer is not None:
+            self.sink_writer.close()
+        if self.recrawl_cache is not None:
+            self.recrawl_cache.evict()
+            self.recrawl_cache.close()
+        if self.tracer.enabled and self.config.trace_path:
+            self.tracer.write_chrome_trace(self.config.trace_path)
+            logger.info("trace of %s events written to %s", len(self.tracer), self.config.trace_path)
+        logger.info("dispatcher is finished.")
+        self.handlers.on_pipeline_finished()
+
+    def checkpoint(self):
+        """
+        Commit the frontier with the dedup state, the dispatcher does it
+        every checkpoint_interval seconds.
+        """
+        state = {
+            "request_filter": self.request_filter,
+            "domains": self.domains,
+            "init_request": self._init_request,
+            "init_cookie": self._init_cookie,
+            "budget": (self.budget.pages, self.budget.domain_pages),
+        }
+        self.frontier.save_state("pipeline", pickle.dumps(state))
+        self.frontier.commit()
+        self._last_checkpoint = time.monotonic()
+
+    def _load_checkpoint(self, checkpoint=None):
+        checkpoint = checkpoint or self.checkpoint_dir
+        if not checkpoint:
+            raise ValueError("no checkpoint dir to resume from.")
+        if checkpoint != self.checkpoint_dir:
+            self.frontier.close()
+            self.frontier = self._build_frontier(checkpoint)
+            self.checkpoint_dir = checkpoint
+
+        raw = self.frontier.load_state("pipeline")
+        if raw is None:
+            raise ValueError("no checkpoint in {}".format(checkpoint))
+        if not len(self.frontier):
+            raise ValueError("the crawl in {} is finished".format(checkpoint))
+
+        state = pickle.loads(raw)
+        self.request_filter = state["request_filter"]
+        self.domains = state["domains"]
+        self._init_cookie = state["init_cookie"]
+        self._init_request = state["init_request"]
+        self.budget.pages, self.budget.domain_pages = state["budget"]
+        self._build_normalizer()
+        self._fix_cookie()
+        self._started = len(self.frontier)
+
+    def _task_done(self, fetch_result: _FetchResult):
+        """Tell the scheduler the host is free again"""
+        response = fetch_result.response
+        self.metrics.counter("host_requests_total", host=fetch_result.host).inc()
+        if response is None:
+            self._fetch_errors.inc()
+            self.scheduler.task_done(fetch_result.host)
+            return
+
+        elapsed = response.elapsed.total_seconds()
+        self._fetch_seconds.observe(elapsed)
+        self.metrics.counter("responses_total", status=response.status_code).inc()
+        self.scheduler.task_done(
+            fetch_result.host, response.status_code, elapsed,
+            scheduler.parse_retry_after(response.headers.get("Retry-After"))
+        )
+
+    def _retry(self, fetch_result: _FetchResult) -> bool:
+        """
+        Put a record answered 429/503 back in its host queue, it is
+        fetched again after the back off of the host.
+        """
+        response, record = fetch_result.response, fetch_result.record
+        if response is None or response.status_code not in scheduler.SLOWDOWN_STATUS:
+            return False
+        if record.retries >= self.config.slowdown_retries or self._out_of_time:
+            return False
+        self._retries.inc()
+        self._log_url("retry %s after %s", record.url, response.status_code)
+        self.tracer.wait(self.tracer.trace_id(record.url), "host queue")
+        self.scheduler.put(fetch_result.host, record._replace(retries=record.retries + 1), record.priority)
+        return True
+
+    def profile(self, seconds, path=None, interval=0.005) -> trace.StackSampler:
+        """
+        Sample the stacks of every thread for the next seconds, written to
+        path as collapsed stacks (flamegraph.pl, speedscope) at the end.
+        """
+        return trace.StackSampler(interval).start(seconds, path)
 
     def get_summary(self):
+        snapshot = self.metrics.snapshot()
+        elapsed = max(snapshot["elapsed"], 1e-6)
+        hosts = snapshot["counters"].get("host_requests_total", {})
         return CrawlerPipelineSummary(
             current_finished_request_count=self._finished,
             current_started_request_count=self._started,
+            metrics=snapshot,
+            host_rates={k[len("host="):]: v / elapsed for k, v in hosts.items()},
         )
 
+    def export_metrics(self, fmt="json") -> str:
+        """json or prometheus text"""
+        if fmt == "prometheus":
+            return self.metrics.to_prometheus()
+        return self.metrics.to_json()
+
     def build_request(self, url, method="GET", headers=None, data=None, param=None,
                       auth=None, cookies=None):
         req = requests.Request(method, url, headers, data=data, params=param, auth=auth,
                                cookies=cookies)
         return req
 
-    def request(self, request: requests.Request) -> typing.Tuple[requests.Response, requests.PreparedRequest]:
-        if self.config.fixed_cookie and self._init_cookie:
-            self.session.cookies = self._init_cookie
+    @property
+    def session(self) -> requests.Session:
+        """the session of current thread"""
+        return self.transport.session()
 
-        logger.info("{} -> {}".format(request.method, request.url))
+    def request(self, request: requests.Request, stream=False,
+                trace_id=0) -> typing.Tuple[requests.Response, requests.PreparedRequest]:
+        self._log_url("%s -> %s", request.method, request.url)
+        stage = self.tracer.stage
 
-        request = self.handlers.hook_before_preparing_request(request)
-        prepared_request = self.session.prepare_request(request)
+        with stage(trace_id, "hook_before_preparing_request"):
+            request = self.handlers.hook_before_preparing_request(request)
+        with stage(trace_id, "prepare"):
+            prepared_request = self.transport.prepare_request(request)
 
         response: requests.Response = None
         try:
-            prepared_request = self.handlers.hook_before_sending_request(prepared_request)
-            self.handlers.on_new_prepared_request(prepared_request)
-            response = self.session.send(prepared_request)
+            with stage(trace_id, "hook_before_sending_request"):
+                prepared_request = self.handlers.hook_before_sending_request(prepared_request)
+                self.handlers.on_new_prepared_request(prepared_request)
+            # until the headers, the body is streamed by _extract_links
+            with stage(trace_id, "send"):
+                response = self.transport.send(prepared_request, stream=stream)
         except Exception:
-            logger.debug(traceback.format_exc())
+            logger.debug("request failed: %s", request.url, exc_info=True)
 
         return response, prepared_request
 
@@ -150,145 +787,197 @@ class CrawlerPipeline(object):
         :return:
         """
         logger.info("dispatcher is running")
-        while self._have_started_event.is_set():
-            try:
-                result = self.worker_pool.result_queue.get(timeout=2)
-                logger.debug("got result from result queue: {}".format(result))
+        try:
+            while self._have_started_event.is_set():
+                # results arrive as soon as a labor finishes its task
+                result = self.worker_pool.result_queue.get()
+                self._log_url("got result from result queue: %s", result)
 
-                # set finished
+                if result.result:
+                    self._dispatch(result.result)
+                else:
+                    # a handler hook raised in _fetch
+                    logger.debug("error in pipeline.request %s", result.traceback)
+                    host, record = result.task.args
+                    self._dispatch(_FetchResult(host, record, None, None, []))
+
+                # check whether the pipeline is finished.
+                if self._finished >= self._started:
+                    self._have_started_event.clear()
+        finally:
+            self.worker_pool.stop()
+            self._on_finished()
+
+    def _dispatch(self, fetch_result: _FetchResult):
+        """_on_result, an error fails the result instead of the dispatcher"""
+        finished = self._finished
+        try:
+            self._on_result(fetch_result)
+        except Exception:
+            self._dispatch_errors.inc()
+            logger.exception("error on the result of %s", fetch_result.record.url)
+            # not counted yet, the crawl would never end
+            if self._finished == finished:
                 self._finished += 1
 
-            except queue.Empty:
-                continue
-
-            if result.result:
-                rsp, req = result.result
+    def _extract_links(self, response: requests.Response, record: frontier.FrontierRecord = None,
+                       entry: recrawl.CacheEntry = None) -> typing.List[_Link]:
+        """
+        Read the streamed body and find the urls in it, called in the
+        worker threads. entry is the recrawl cache entry of record.
+        """
+        if response is None:
+            return []
+        if entry is not None and response.status_code == 304:
+            response.close()
+            self.recrawl_cache.touch(record.url)
+            return self._build_links(entry.links)
+
+        reader = self._link_reader(response, entry)
+        try:
+            if reader is not None:
+                for chunk in response.iter_content(self.config.chunk_size):
+                    if not reader.feed(chunk):
+                        break
+        except Exception:
+            logger.debug("reading failed: %s", response.url, exc_info=True)
+            if reader is not None:
+                reader.failed = True
+        finally:
+            # an unfinished body closes the connection instead of reading it
+            response.close()
+        links = self._close_reader(reader, response, record, entry)
+        # the urllib3 response and its buffers wait in the result queue otherwise
+        response.raw = None
+        response._content_consumed = True
+        if response._content is False:
+            response._content = None
+        return self._build_links(links)
+
+    def _close_reader(self, reader: typing.Optional[_LinkReader], response: requests.Response,
+                      record: frontier.FrontierRecord = None, entry: recrawl.CacheEntry = None) -> typing.List[str]:
+        if reader is None:
+            return []
+        links = reader.close()
+        if reader.chunks is not None:
+            response._content = b"".join(reader.chunks)
+            # the body kept is cut at max_body_size or where reading failed
+            response.truncated = "length" if reader.truncated else "disconnect" if reader.failed else ""
+        self._body_bytes.inc(reader.received)
+        self._parse_seconds.observe(reader.parse_time)
+        if reader.unchanged:
+            links = entry.links
+        if self.recrawl_cache is not None and record is not None and response.status_code == 200 \
+                and reader.html and not reader.failed:
+            if reader.unchanged:
+                self.recrawl_cache.touch(record.url)
             else:
-                logger.debug("error in pipeline.request {}".format(
-                    result.traceback
-                ))
-                continue
+                self.recrawl_cache.put(record.url, response.headers.get("ETag"),
+                                       response.headers.get("Last-Modified"), reader.content_hash, links)
+        return links
+
+    def _link_reader(self, response: requests.Response,
+                     entry: recrawl.CacheEntry = None) -> typing.Optional[_LinkReader]:
+        """None if the Content-Type says the response is not html"""
+        html = True
+        if self.config.html_only:
+            html = extractor.content_type_is_html(response.headers.get("Content-Type"))
+            if html is False:
+                self._log_url("skip %s: %s", response.headers.get("Content-Type"), response.url)
+                return None
+        content_check = None
+        if self.content_index is not None:
+            content_check = functools.partial(self._content_is_near_dup, response.url,
+                                              encoding=response.encoding)
+        return _LinkReader(self.link_extractor(response.encoding), html, self.config.max_body_size,
+                           self._keep_body, hash_content=self.recrawl_cache is not None,
+                           known_hash=entry.content_hash if entry is not None and response.status_code == 200 else None,
+                           content_check=content_check)
+
+    def _build_links(self, raw_links: typing.List[str]) -> typing.List[_Link]:
+        """Parse the links of a page and run the admission rules on them."""
+        started = time.perf_counter()
+        infos = []
+        # the same href repeats a lot in one page
+        for _url in dict.fromkeys(raw_links):
+            info = self.normalizer.parse(_url)
+            if info:
+                infos.append(info)
+        links = [_Link(info, allowed) for info, allowed in zip(infos, self.admission.evaluate(infos))]
+        self._admission_seconds.observe(time.perf_counter() - started)
+        return links
+
+    def _handle_links(self, fetch_result: _FetchResult, trace_id=0):
+        """
+        Dedup the links found by a worker and schedule the new ones, the
+        shared state and handlers are only touched by the dispatcher.
 
-            response: requests.Response = rsp
-            request: requests.PreparedRequest = req
-
-            #
-            # 1. remove duplicated urls (request_filter)
-            # 2. check domain
-            # 3. suffix filter
-            # 4. allow static file with query or not
-            # 5. extra filter
-            #
-            for url in self.__find_all_urls(response):
-                logger.debug("checking: {}".format(url))
+        1. remove duplicated urls (request_filter)
+        5. extra filter
+        6. depth and page budgets
+        """
+        if fetch_result.response is None:
+            return
+
+        started = time.perf_counter()
+        method = str(fetch_result.prepared_request.method)
+        depth = fetch_result.record.depth + 1
+        parent = fetch_result.record.url
+        new_urls, new_domains, candidates = [], [], []
+        events = [] if self._per_item_hooks else None
+        on_new_url, on_new_domain = self.handlers.on_new_url, self.handlers.on_new_domain
+        stage = self.tracer.stage
+        with stage(trace_id, "dedup", links=len(fetch_result.links)):
+            for info, allowed in fetch_result.links:
+                self._log_url("checking: %s", info.url)
                 # 1.
-                method = str(request.method)
-                if not self.request_filter.url_is_duplicate(url, method=method):
-                    self.request_filter.add_url(url, method=method)
-                    self.handlers.on_new_url(url)
-                else:
-                    continue
-
-                # 2.
-                domain, netloc = self.__extract_domainNnetloc(url)
-                if domain not in self.domains:
-                    self.handlers.on_new_domain(domain)
-                    self.domains.add(domain)
-                if domain in self.config.domain_blacklist:
+                if self.request_filter.check_and_add(info, method=method):
                     continue
-                if self.config.domain_whitelist:
-                    if domain not in self.config.domain_whitelist:
-                        continue
-                else:
-                    if self.config.allow_to_crawl_subdomain:
-                        if netloc.endswith(self._init_netloc):
-                            pass
-                        else:
-                            continue
-                    else:
-                        if netloc != self._init_netloc:
-                            logger.debug("filtered by netloc: cur:{} != init:{}".format(netloc, self._init_netloc))
-                            continue
-
-                # 3.
-                suffix, query = self.__extract_suffix(url)
-                if suffix in self.config.suffix_blacklist:
-                    # 4. config
-                    if self.config.allow_static_file_with_query and query:
-                        pass
-                    else:
-                        continue
-
-                # 5. true for pass
-                if not self.handlers.extra_url_checker(url):
+                new_urls.append(info.url)
+                if events is not None and self._url_hooks:
+                    events.append((on_new_url, info.url))
+                if info.domain not in self.domains:
+                    self.domains.add(info.domain)
+                    new_domains.append(info.domain)
+                    if events is not None and self._domain_hooks:
+                        events.append((on_new_domain, info.domain))
+                if allowed:
+                    candidates.append(info)
+        with stage(trace_id, "handlers"):
+            if events is not None:
+                self._deliver(_call_in_order, events)
+            else:
+                self._deliver(self.handlers.on_new_urls, new_urls, self._url_hooks)
+                self._deliver(self.handlers.on_new_domains, new_domains, self._domain_hooks)
+
+            # 5. true for pass
+            if candidates and self._extra_checker:
+                passed = self.handlers.extra_url_checker_batch([info.url for info in candidates])
+                candidates = [info for info, ok in zip(candidates, passed) if ok]
+
+        with stage(trace_id, "schedule", urls=len(candidates)):
+            for info in candidates:
+                # 6. depth and page budgets
+                if not self.budget.admit(info.domain, depth):
                     continue
+                self._schedule(info.url, self._default_method, depth, parent)
+        self._dispatch_seconds.observe(time.perf_counter() - started)
+
+    def _deliver(self, hook, items, active=True):
+        if not items or not active:
+            return
+        if self.delivery is not None:
+            self._put_event(hook, items)
+        else:
+            hook(items)
 
-                defaul_request_params = self.config.default_request_params
-                request = requests.Request(url=url, **defaul_request_params)
-                self.worker_pool.execute(self.request, kwargs={
-                    "request": request
-                })
-
-            # check whether the pipeline is finished.
-            if self._finished >= self._started:
-                self._have_started_event.clear()
+    def _put_event(self, hook, items):
+        """waits for room in the handler queue"""
+        self.delivery.put(hook, items)
 
-        logger.info("dispatcher is finished.")
+    def _put_sink(self, record: sink.SinkRecord):
+        """waits for room in the sink buffer"""
+        self.sink_writer.put(record)
 
     def wait_until_finished(self):
         self.dispacher_thread.join()
-
-    def __find_all_urls(self, response: requests.Response):
-        """"""
-        raw = response.text
-        soup = bs4.BeautifulSoup(raw, 'html.parser')
-
-        def genurls():
-            for atag in soup.find_all():
-                _url = atag.attrs.get("href")
-                if _url:
-                    yield self.__fix_url(_url)
-
-                _url1 = atag.attrs.get("src")
-                if _url1:
-                    yield self.__fix_url(_url1)
-
-        for _url in genurls():
-            if _url:
-                yield _url
-
-    def __fix_url(self, url):
-        def basic():
-            if url.startswith("javascript:"):
-                return
-            elif url.startswith("data:"):
-                return
-            elif url.startswith("ftp:"):
-                return
-            elif url.startswith("mailto:"):
-                return
-            elif url.startswith("http"):
-                return url
-            else:
-                return urljoin(self._init_request.url, url)
-
-        url = basic()
-        if not self.config.allow_fragment and url and "#" in url:
-            return url[:url.index("#")]
-        else:
-            return url
-
-    def __extract_domainNnetloc(self, url):
-        nlc = urlparse(url).netloc
-        domain = nlc[:nlc.index(":")] if ":" in nlc else nlc
-        return domain, nlc
-
-    def __extract_suffix(self, url):
-        path = urlparse(url).path
-        query = urlparse(url).query
-        _, suffix = os.path.splitext(path)
-        return suffix, query
-
-    def _fake_execute(self, func, args=(), kwargs={}, id=None):
-        self._old_execute(func, args, kwargs, id)
-        self._started += 1
@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Crawl with worker processes on one or several boxes.
+
+The coordinator (DistributedCrawlerPipeline) owns the frontier, the
+dedup filter, the host scheduler and the handlers. Workers only fetch
+and extract: a worker is a CrawlerPipeline which is never started, its
+thread pool runs ``_fetch`` for the records of its shard.
+
+Workers send a heartbeat every few seconds. The requests of a shard
+whose worker exited, or sent nothing for worker_timeout seconds, are
+failed, so are the later ones of its hosts.
+
+Hooks on the request (hook_before_preparing_request,
+hook_before_sending_request, on_new_prepared_request) are called in the
+workers, all the other hooks in the coordinator.
+
+Workers of another box:
+
+    python -m crawlerpipeline.worker --address 10.0.0.1:7777 \\
+        --authkey <hex key logged by the coordinator> --shards 8 --shard 3 \\
+        [--config crawler.yml] [--handler package.module:Handler]
+
+The authkey may be given in CRAWLERPIPELINE_AUTHKEY instead.
+"""
+import os
+import time
+import typing
+import argparse
+import importlib
+import threading
+import multiprocessing
+from collections import deque
+import requests
+from .config import CrawlerConfig, copy_config
+from .core import CrawlerPipeline, CrawlerPipelineHandler, _FetchResult, _Link, logger
+from .utils.broker import Broker, QueueBroker, ManagerBroker, shard_of
+from .utils.frontier import FrontierRecord
+from .utils.transport import build_response
+
+# messages to the workers
+_SETUP = "setup"
+_FETCH = "fetch"
+_STOP = "stop"
+# seconds between two heartbeats of a worker
+_HEARTBEAT_INTERVAL = 5
+# seconds the dispatcher waits for a result before checking the workers
+_POLL_INTERVAL = 1
+# the authkey of a worker without --authkey, in hex
+_AUTHKEY_ENV = "CRAWLERPIPELINE_AUTHKEY"
+
+
+class _RemoteResult(typing.NamedTuple):
+    """the picklable part of _FetchResult"""
+    host: str
+    record: FrontierRecord
+    # None if the request failed
+    status_code: typing.Optional[int]
+    reason: str
+    url: str
+    headers: typing.Dict[str, str]
+    elapsed: float
+    method: str
+    links: typing.List[_Link]
+    # kept for the sink of the coordinator
+    body: typing.Optional[bytes] = None
+    # the WARC-Truncated reason of body
+    truncated: str = ""
+    # url patterns of the near duplicated pages found since the last result
+    dup_patterns: typing.Tuple[str, ...] = ()
+
+
+class _Heartbeat(typing.NamedTuple):
+    """a worker is alive"""
+    shard: int
+
+
+def _pack(fetch_result: typing.Optional[_FetchResult], host, record) -> _RemoteResult:
+    response = fetch_result.response if fetch_result else None
+    if response is None:
+        return _RemoteResult(host, record, None, "", record.url, {}, 0.0, record.method, [])
+    return _RemoteResult(
+        host, record, response.status_code, response.reason, response.url,
+        dict(response.headers), response.elapsed.total_seconds(),
+        str(fetch_result.prepared_request.method), fetch_result.links,
+        response._content if isinstance(response._content, bytes) else None,
+        getattr(response, "truncated", ""),
+    )
+
+
+def _unpack(result: _RemoteResult) -> _FetchResult:
+    if result.status_code is None:
+        return _FetchResult(result.host, result.record, None, None, [])
+
+    prepared_request = requests.PreparedRequest()
+    prepared_request.method = result.method
+    prepared_request.url = result.record.url
+    response = build_response(result.status_code, result.reason, result.url, result.headers,
+                              result.body, prepared_request, result.elapsed)
+    response.truncated = result.truncated
+    return _FetchResult(result.host, result.record, response, prepared_request, result.links)
+
+
+class CrawlWorker(object):
+    """Fetch the records of one shard with a thread pool."""
+
+    def __init__(self, broker: Broker, shard: int, config: CrawlerConfig = None, handler=None):
+        self.broker = broker
+        self.shard = shard
+        config = CrawlerConfig(copy_config((config or CrawlerConfig())._config))
+        # the checkpoint and the sink belong to the coordinator
+        keep_body = bool(config.sink and config.sink_body)
+        config._options["checkpoint_dir"] = ""
+        config._options["sink"] = ""
+        # a worker process exits without writing a log queue
+        config._options["log_queue"] = False
+        config._options["trace_sample_every"] = 0
+        # the dedup filter too, workers never look at it
+        config._options["dedup_mmap_dir"] = ""
+        config._options["dedup_capacity"] = 1000
+        self.pipeline = CrawlerPipeline(config, handler)
+        self.pipeline._keep_body = keep_body
+        self.pipeline._dup_log = deque()
+        self._forwarder = threading.Thread(target=self._forward_results, daemon=True)
+
+    def _setup(self, init_request, init_cookie):
+        pipeline = self.pipeline
+        pipeline._init_request = init_request
+        pipeline._init_cookie = init_cookie
+        pipeline._build_normalizer()
+        pipeline._fix_cookie()
+
+    def _forward_results(self):
+        while True:
+            result = self.pipeline.worker_pool.result_queue.get()
+            if result is None:
+                break
+            host, record = result.task.args
+            if result.result is None:
+                logger.debug("error in worker %s: %s", self.shard, result.traceback)
+            log = self.pipeline._dup_log
+            patterns = tuple(log.popleft() for _ in range(len(log)))
+            self.broker.put_result(_pack(result.result, host, record)._replace(dup_patterns=patterns))
+
+    def run(self):
+        pool = self.pipeline.worker_pool
+        pool.start()
+        self._forwarder.start()
+        last_heartbeat = 0
+        try:
+            while True:
+                if time.monotonic() - last_heartbeat >= _HEARTBEAT_INTERVAL:
+                    self.broker.put_result(_Heartbeat(self.shard))
+                    last_heartbeat = time.monotonic()
+                message = self.broker.get_task(self.shard, timeout=_HEARTBEAT_INTERVAL)
+                if message is None:
+                    continue
+                kind, payload = message
+                if kind == _FETCH:
+                    pool.execute(self.pipeline._fetch, args=payload)
+                elif kind == _SETUP:
+                    self._setup(*payload)
+                elif kind == _STOP:
+                    break
+        finally:
+            pool.wait_until_all_is_finished()
+            pool.result_queue.put(None)
+            self._forwarder.join()
+            pool.stop()
+            self.pipeline.transport.close()
+
+
+def run_worker(broker: Broker, shard: int, config: CrawlerConfig = None, handler=None):
+    CrawlWorker(broker, shard, config, handler).run()
+
+
+class DistributedCrawlerPipeline(CrawlerPipeline):
+    """
+    CrawlerPipeline fetching in worker processes, one shard of hosts for
+    each of them.
+
+    The broker is a QueueBroker with a shard for every process by
+    default. With processes=0 no worker is started here, they connect to
+    the broker from other boxes.
+    """
+
+    def __init__(self, config: CrawlerConfig = None, handler=None,
+                 broker: Broker = None, processes=None):
+        config = config or CrawlerConfig()
+        if processes is None:
+            processes = broker.shards if broker else (config.worker_processes or multiprocessing.cpu_count())
+        if broker and processes > broker.shards:
+            raise ValueError("{} processes for {} shards".format(processes, broker.shards))
+        self.processes = processes
+        self.broker = broker or QueueBroker(processes)
+        self._workers = []
+        # shard -> (url, method) -> (host, record) sent and not answered
+        self._outstanding: typing.List[typing.Dict[tuple, tuple]] = [{} for _ in range(self.broker.shards)]
+        self._outstanding_lock = threading.Lock()
+        # monotonic time of the last heartbeat or result of each shard
+        self._last_seen = [0.0] * self.broker.shards
+        self._dead_shards = set()
+        CrawlerPipeline.__init__(self, config, handler)
+
+    def _init_engine(self):
+        # a pool in every worker
+        in_flight = self.config.max_workers * self.broker.shards
+        self.scheduler = self._build_scheduler(in_flight, self._execute)
+
+        self.dispacher_thread = threading.Thread(target=self._pipeline_dispatcher)
+        self.dispacher_thread.daemon = True
+
+    def _launch(self):
+        self._have_started_event.set()
+        self.budget.start()
+        self.metrics.start()
+        self._last_seen = [time.monotonic()] * self.broker.shards
+        self._start_workers()
+        self.broker.broadcast((_SETUP, (self._init_request, self._init_cookie)))
+        self.scheduler.start()
+        self.dispacher_thread.start()
+
+    def _start_workers(self):
+        handler = type(self.handlers)
+        for shard in range(self.processes):
+            args = (self.broker, shard, self.config, handler)
+            if self.broker.in_process:
+                worker = threading.Thread(target=run_worker, args=args, daemon=True)
+            else:
+                worker = multiprocessing.Process(target=run_worker, args=args, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _execute(self, host, record: FrontierRecord):
+        # the stages in the workers are not traced
+        self.tracer.done_waiting(self.tracer.trace_id(record.url), "host queue")
+        shard = shard_of(host, self.broker.shards)
+        with self._outstanding_lock:
+            self._outstanding[shard][(record.url, record.method)] = (host, record)
+            if shard not in self._dead_shards:
+                self.broker.put_task(shard, (_FETCH, (host, record)))
+                return
+        # nobody fetches the shard, the dispatcher gets a failed request
+        self.broker.put_result(_pack(None, host, record))
+
+    def _take(self, result: _RemoteResult) -> bool:
+        """False for a result no longer waited for, from a dead shard"""
+        shard = shard_of(result.host, self.broker.shards)
+        self._last_seen[shard] = time.monotonic()
+        with self._outstanding_lock:
+            return self._outstanding[shard].pop((result.record.url, result.record.method), None) is not None
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for shard in range(self.broker.shards):
+            if shard in self._dead_shards:
+                continue
+            if shard < len(self._workers) and not self._workers[shard].is_alive():
+                self._fail_shard(shard, "exited")
+            elif self._outstanding[shard] and now - self._last_seen[shard] > self.config.worker_timeout:
+                self._fail_shard(shard, "sent no heartbeat for {:.0f}s".format(now - self._last_seen[shard]))
+
+    def _fail_shard(self, shard, reason):
+        with self._outstanding_lock:
+            self._dead_shards.add(shard)
+            records = list(self._outstanding[shard].values())
+            self._outstanding[shard].clear()
+        logger.error("the worker of shard %s %s, %s requests failed", shard, reason, len(records))
+        for host, record in records:
+            self._dispatch(_FetchResult(host, record, None, None, []))
+
+    def _pipeline_dispatcher(self):
+        logger.info("dispatcher is running")
+        last_check = time.monotonic()
+        try:
+            while self._have_started_event.is_set():
+                result = self.broker.get_result(timeout=_POLL_INTERVAL)
+                if isinstance(result, _Heartbeat):
+                    self._last_seen[result.shard] = time.monotonic()
+                elif result is not None:
+                    for pattern in result.dup_patterns:
+                        self._count_dup_pattern(pattern)
+                    if self._take(result):
+                        self._dispatch(_unpack(result))
+                if time.monotonic() - last_check >= _POLL_INTERVAL:
+                    last_check = time.monotonic()
+                    self._check_workers()
+                if self._finished >= self._started:
+                    self._have_started_event.clear()
+        finally:
+            self.broker.broadcast((_STOP, None))
+            for worker in self._workers:
+                # a hung worker is a daemon
+                worker.join(self.config.worker_timeout)
+            self._on_finished()
+
+
+def _load_handler(path):
+    if not path:
+        return CrawlerPipelineHandler
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)
+
+
+def main(argv=None):
+    """the entry of crawlerpipeline.worker"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--address", required=True, help="host:port of the coordinator")
+    parser.add_argument("--authkey", default=os.environ.get(_AUTHKEY_ENV),
+                        help="hex key of the coordinator, {} by default".format(_AUTHKEY_ENV))
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--config", help="yaml config file")
+    parser.add_argument("--handler", help="module:class")
+    args = parser.parse_args(argv)
+    if not args.authkey:
+        parser.error("--authkey or {} is required".format(_AUTHKEY_ENV))
+    try:
+        authkey = bytes.fromhex(args.authkey)
+    except ValueError:
+        parser.error("--authkey is not hex")
+
+    host, _, port = args.address.rpartition(":")
+    broker = ManagerBroker(args.shards, (host, int(port)), authkey).connect()
+    config = CrawlerConfig()
+    if args.config:
+        config.merge_config_from_file(args.config)
+    run_worker(broker, args.shard, config, _load_handler(args.handler))
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import unittest
+
+from ..utils.admission import DomainTrie, AdmissionRules
+from ..utils.urlinfo import URLNormalizer
+
+
+class AdmissionRulesTester(unittest.TestCase):
+
+    def test_domain_trie(self):
+        trie = DomainTrie(["a.com", "*.b.com", ".c.com"])
+        self.assertEqual(trie.match("a.com"), "a.com")
+        self.assertIsNone(trie.match("x.a.com"))
+        self.assertIsNone(trie.match("b.com"))
+        self.assertEqual(trie.match("x.y.B.com"), "*.b.com")
+        self.assertEqual(trie.match("c.com"), "c.com")
+        self.assertEqual(trie.match("x.c.com"), "*.c.com")
+        self.assertIsNone(trie.match("xc.com"))
+
+    def test_evaluate(self):
+        normalizer = URLNormalizer("http://a.com/")
+        rules = AdmissionRules("a.com", allow_subdomain=True, domain_blacklist=["bad.a.com"],
+                               suffix_blacklist=[".jpg"], path_exclude=[r"^/logout"])
+        urls = ["/index", "http://x.a.com/", "http://bad.a.com/", "http://evila.com/",
+                "/a.JPG", "/logout?x=1"]
+        self.assertEqual(rules.evaluate(normalizer.parse(x) for x in urls),
+                         [True, True, False, False, False, False])
+        self.assertEqual(rules.stats(), {
+            "allowed": 2, "domain_blacklist:bad.a.com": 1, "subdomain": 1,
+            "suffix_blacklist:.jpg": 1, "path_exclude:^/logout": 1,
+        })
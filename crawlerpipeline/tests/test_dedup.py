@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import os
+import pickle
+import tempfile
+import unittest
+
+from ..utils.dedup import DedupSet, ScalableBloomFilter, ExactHashSet
+
+
+class DedupTestCase(unittest.TestCase):
+
+    def _check(self, dedup: DedupSet, count):
+        keys = ["http://a.com/{}".format(i) for i in range(count)]
+        dups = sum(dedup.check_and_add(key) for key in keys)
+        self.assertTrue(all(key in dedup for key in keys))
+        others = sum("http://b.com/{}".format(i) in dedup for i in range(count))
+        return dups + others
+
+    def test_bloom_grows(self):
+        f = ScalableBloomFilter(capacity=1000, error_rate=0.001)
+        false_positives = self._check(f, 20000)
+        stats = f.stats()
+        self.assertGreater(stats.stages, 1)
+        self.assertLess(stats.fp_rate, 0.002)
+        self.assertLess(false_positives, 40000 * 0.004)
+
+        f = ScalableBloomFilter(capacity=1000, error_rate=0.001, memory_limit=4000)
+        self._check(f, 20000)
+        self.assertTrue(f.stats().saturated)
+        self.assertLessEqual(f.nbytes(), 4000)
+
+    def test_exact(self):
+        f = ExactHashSet(capacity=100)
+        self.assertEqual(self._check(f, 5000), 0)
+        self.assertEqual(len(pickle.loads(pickle.dumps(f))), 5000)
+
+        with tempfile.TemporaryDirectory() as path:
+            f = ExactHashSet(capacity=100, path=os.path.join(path, "urls"))
+            self.assertEqual(self._check(f, 5000), 0)
+            self.assertEqual(os.path.getsize(os.path.join(path, "urls")), f.nbytes())
+            state = pickle.dumps(f)
+            f.close()
+            g = pickle.loads(state)
+            self.assertIn("http://a.com/4999", g)
+            g.close()
+
+            f = ExactHashSet(capacity=100, memory_limit=8 * 1024)
+            keys = ["http://a.com/{}".format(i) for i in range(5000)]
+            for key in keys:
+                f.check_and_add(key)
+            stats = f.stats()
+            self.assertTrue(stats.saturated)
+            self.assertEqual(stats.stages, 2)
+            self.assertLessEqual(f.nbytes(), 8 * 1024 * 9 // 8)
+            # an url is never new twice, the crawl of a cyclic site ends
+            self.assertTrue(all(f.check_and_add(key) for key in keys))
+            self.assertEqual(len(pickle.loads(pickle.dumps(f))), len(f))
+
+            f = ExactHashSet(capacity=100, memory_limit=8 * 1024, path=os.path.join(path, "full"))
+            self._check(f, 5000)
+            self.assertTrue(f.stats().saturated)
+            self.assertTrue(os.path.exists(os.path.join(path, "full.overflow")))
+            f.close()
+
+    def test_bloom_mmap(self):
+        with tempfile.TemporaryDirectory() as path:
+            f = ScalableBloomFilter(capacity=1000, path=os.path.join(path, "urls"))
+            self._check(f, 3000)
+            state = pickle.dumps(f)
+            f.close()
+            g = pickle.loads(state)
+            self.assertIn("http://a.com/2999", g)
+            g.close()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import time
+import unittest
+
+from ..utils.delivery import EventDelivery
+
+
+class EventDeliveryTestCase(unittest.TestCase):
+
+    def test_delivery(self):
+        calls = []
+
+        def slow(items):
+            time.sleep(0.01)
+            calls.append(list(items))
+
+        delivery = EventDelivery(maxsize=2).start()
+        for i in range(20):
+            delivery.put(slow, [i])
+        delivery.close()
+
+        self.assertEqual([i for items in calls for i in items], list(range(20)))
+        # merged while the handler was busy
+        self.assertLess(len(calls), 20)
+        self.assertGreater(delivery.blocked, 0)
+        self.assertEqual(delivery.delivered, 20)
+
+    def test_put_nowait(self):
+        delivery = EventDelivery(maxsize=1)
+        self.assertTrue(delivery.put_nowait(print, [1]))
+        self.assertFalse(delivery.put_nowait(print, [2]))
+        # nothing to put
+        self.assertTrue(delivery.put_nowait(print, []))
+        self.assertEqual(delivery.blocked, 0)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import unittest
+
+from ..core import _LinkReader
+from ..utils.extractor import EXTRACTORS, TagScanLinkExtractor, content_type_is_html, sniff_html
+
+_PAGE = b"""<!DOCTYPE html>
+<html><head>
+<link rel="stylesheet" href="/static/a.css">
+<script src='/static/a.js'>var x = '<a href="/in-script">';</script>
+<style>a > b { color: red }</style>
+</head><body>
+<!-- <a href="/in-comment"> -->
+<a title="a > b" href="/list?a=1&amp;b=2">list</a>
+<A HREF=/upper>upper</A>
+<img data-src="/lazy.png" src="/img.png"/>
+<a href="">empty</a>
+<a href="http://example.com/?q=\xe4\xb8\xad">utf8</a>
+</body></html>
+"""
+
+_EXPECTED = [
+    "/static/a.css", "/static/a.js", "/list?a=1&b=2",
+    "/upper", "/img.png", "http://example.com/?q=中",
+]
+
+
+class ExtractorTestCase(unittest.TestCase):
+
+    def test_extractors_agree(self):
+        for name, cls in EXTRACTORS.items():
+            self.assertEqual(cls("utf-8").extract(_PAGE), _EXPECTED, name)
+
+    def test_tagscan_chunks(self):
+        for size in (1, 3, 7, 64):
+            extractor = TagScanLinkExtractor("utf-8")
+            links = []
+            for i in range(0, len(_PAGE), size):
+                links.extend(extractor.feed(_PAGE[i:i + size]))
+            links.extend(extractor.close())
+            self.assertEqual(links, _EXPECTED, size)
+
+    def test_sniff(self):
+        self.assertTrue(content_type_is_html("text/html; charset=utf-8"))
+        self.assertFalse(content_type_is_html("image/png"))
+        self.assertIsNone(content_type_is_html(None))
+        self.assertTrue(sniff_html(_PAGE[:16]))
+        self.assertFalse(sniff_html(b"\x89PNG\r\n\x1a\n\0\0\0\rIHDR"))
+
+    def test_link_reader(self):
+        reader = _LinkReader(TagScanLinkExtractor("utf-8"), None)
+        self.assertFalse(reader.feed(b"PK\x03\x04\0\0"))
+        self.assertEqual(reader.close(), [])
+
+        # stop in the middle of the page
+        size = _PAGE.index(b"/upper")
+        reader = _LinkReader(TagScanLinkExtractor("utf-8"), None, max_size=size)
+        self.assertTrue(reader.feed(_PAGE[:64]))
+        self.assertFalse(reader.feed(_PAGE[64:]))
+        self.assertTrue(reader.truncated)
+        self.assertEqual(reader.close(), _EXPECTED[:3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import os
+import tempfile
+import unittest
+
+from ..utils.frontier import FrontierRecord, MemoryFrontier, SQLiteFrontier, CrawlBudget
+
+
+class SQLiteFrontierTestCase(unittest.TestCase):
+
+    def test_resume_after_crash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "frontier.sqlite3")
+            frontier = SQLiteFrontier(path)
+            for i in range(3):
+                frontier.push(FrontierRecord("http://a.com/{}".format(i), "GET", 1))
+
+            first = frontier.pop()
+            frontier.done(first)
+            in_flight = frontier.pop()
+            frontier.save_state("pipeline", b"state")
+            frontier.commit()
+
+            # not committed, lost on crash
+            frontier.push(FrontierRecord("http://a.com/3", "GET", 1))
+            frontier.done(in_flight)
+            frontier._conn.close()
+
+            frontier = SQLiteFrontier(path)
+            self.assertEqual(len(frontier), 2)
+            self.assertEqual(frontier.load_state("pipeline"), b"state")
+            self.assertEqual(frontier.pop().url, "http://a.com/1")
+            self.assertEqual(frontier.pop().url, "http://a.com/2")
+            self.assertIsNone(frontier.pop())
+            frontier.close()
+
+    def test_priority(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for frontier in (MemoryFrontier(), SQLiteFrontier(os.path.join(tmp, "f.sqlite3"))):
+                for i, priority in enumerate((2, 1, 2, 0, 1)):
+                    frontier.push(FrontierRecord("http://a.com/{}".format(i), priority=priority,
+                                                 parent="http://a.com/"))
+                records = [frontier.pop() for _ in range(5)]
+                self.assertEqual([r.url[-1] for r in records], list("31402"))
+                self.assertEqual(records[0].parent, "http://a.com/")
+                frontier.close()
+
+    def test_budget(self):
+        budget = CrawlBudget(max_pages=4, max_domain_pages=2, max_depth=3)
+        self.assertTrue(budget.admit("a.com", 0))
+        self.assertFalse(budget.admit("a.com", 4))
+        self.assertTrue(budget.admit("a.com", 3))
+        self.assertFalse(budget.admit("a.com", 1))
+        self.assertTrue(budget.admit("b.com", 1))
+        self.assertTrue(budget.admit("c.com", 1))
+        self.assertFalse(budget.admit("d.com", 1))
+        self.assertFalse(budget.out_of_time())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import json
+import threading
+import unittest
+
+from ..utils.metrics import Metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_counter_threads(self):
+        metrics = Metrics()
+
+        def work():
+            for _ in range(10000):
+                metrics.counter("pages_total").inc()
+                metrics.counter("responses_total", status=200).inc()
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(metrics.counter("pages_total").value, 80000)
+        self.assertEqual(metrics.snapshot()["counters"]["responses_total"], {"status=200": 80000})
+
+    def test_histogram_export(self):
+        metrics = Metrics()
+        histogram = metrics.histogram("fetch_seconds", buckets=(0.1, 1, 10))
+        for value in (0.05, 0.5, 0.5, 0.5, 5):
+            histogram.observe(value)
+        metrics.gauge("frontier_size", lambda: 3)
+
+        snapshot = histogram.snapshot()
+        self.assertEqual((snapshot.count, snapshot.sum), (5, 6.55))
+        self.assertTrue(0.1 < snapshot.p50 < 1)
+        self.assertTrue(1 < snapshot.p99 < 10)
+
+        text = metrics.to_prometheus()
+        self.assertIn('crawler_fetch_seconds_bucket{le="1.0"} 4', text)
+        self.assertIn('crawler_fetch_seconds_bucket{le="+Inf"} 5', text)
+        self.assertIn("crawler_frontier_size 3", text)
+        self.assertEqual(json.loads(metrics.to_json())["gauges"], {"frontier_size": 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
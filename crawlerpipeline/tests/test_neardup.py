@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import random
+import unittest
+
+from ..utils import neardup
+from ..utils.reqfilter import FakeStaticPathFilter
+from ..utils.urlinfo import URLNormalizer
+
+
+class NearDupIndexTestCase(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rand = random.Random(1)
+        index = neardup.NearDupIndex(distance=3)
+        stored = []
+        # enough to merge the band tables a few times
+        for i in range(12000):
+            if stored and rand.random() < 0.5:
+                fp = rand.choice(stored[-100:])
+                for _ in range(rand.randint(0, 5)):
+                    fp ^= 1 << rand.randrange(64)
+            else:
+                fp = rand.getrandbits(64)
+
+            expected = any(bin(fp ^ x).count("1") <= 3 for x in stored[-100:])
+            if expected:
+                self.assertTrue(index.has_near_dup(fp))
+            if not index.check_and_add(fp):
+                stored.append(fp)
+        self.assertEqual(len(index), len(stored))
+
+    def test_fingerprint(self):
+        a = neardup.fingerprint("GET:query:id@http://example.com/post/AAAA/S.STATIC")
+        b = neardup.fingerprint("GET:query:id@http://example.com/post/AAAA/S.STATIC")
+        c = neardup.fingerprint("GET:query:q@http://another.org/search/list.php")
+        self.assertEqual(a, b)
+        self.assertGreater(bin(a ^ c).count("1"), 3)
+
+    def test_content_fingerprint(self):
+        from ..bench.site import SiteSpec, SyntheticSite
+
+        site = SyntheticSite(SiteSpec(pages=200, trap=0.2))
+        index = neardup.NearDupIndex(distance=3)
+        for path in site.paths:
+            self.assertFalse(index.check_and_add(neardup.content_fingerprint(site.response(path)[1])))
+        # the same page with other session ids
+        traps = [link for path in site.paths for link in site.links(path) if site.is_trap(link)]
+        found = sum(index.has_near_dup(neardup.content_fingerprint(site.response(link)[1])) for link in traps)
+        self.assertGreater(found, len(traps) * 0.8)
+        self.assertIsNone(neardup.content_fingerprint(b"<html><script>var a;</script></html>"))
+
+    def test_template_pages(self):
+        rand = random.Random(2)
+        vocabulary = ["".join(rand.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(7)) for _ in range(2000)]
+        menu = " ".join(rand.choice(vocabulary) for _ in range(300))
+        footer = " ".join(rand.choice(vocabulary) for _ in range(100))
+
+        def page(words, nav=True):
+            text = " ".join(rand.choice(vocabulary) for _ in range(words))
+            if nav:
+                return "<nav>{}</nav><main>{}</main><footer>{}</footer>".format(menu, text, footer).encode()
+            return "<div>{}</div><div>{}</div><div>{}</div>".format(menu, text, footer).encode()
+
+        for nav in (True, False):
+            for words in (20, 50):
+                templates = neardup.TemplateShingles()
+                index = neardup.NearDupIndex(distance=3)
+                merged = 0
+                for _ in range(200):
+                    hashes = neardup.content_shingles(page(words, nav))
+                    template = templates.observe("a.com", hashes)
+                    fp = neardup.shingles_fingerprint(hashes, template)
+                    if template is not None and fp is not None:
+                        merged += index.check_and_add(fp)
+                self.assertEqual(merged, 0, (nav, words))
+
+        # the same page is still a near duplicate once the template is known
+        fp = neardup.shingles_fingerprint(neardup.content_shingles(page(50, nav=False)), template)
+        self.assertFalse(index.check_and_add(fp))
+        self.assertTrue(index.check_and_add(fp ^ 1))
+
+class FakeStaticPathFilterTestCase(unittest.TestCase):
+
+    def test_check_and_add(self):
+        f = FakeStaticPathFilter(distance=2)
+        self.assertFalse(f.check_and_add("http://a.com/post/2019/12/a.html?id=1"))
+        self.assertTrue(f.url_is_duplicate("http://a.com/post/2019/12/a.html?id=1"))
+        self.assertTrue(f.check_and_add("http://a.com/post/2020/01/b.html?id=1"))
+        self.assertFalse(f.check_and_add("http://a.com/about"))
+
+    def test_urlinfo(self):
+        f = FakeStaticPathFilter(distance=2, ignore_param_value=True)
+        normalizer = URLNormalizer("http://a.com/", False, f.path_template, f.query_template)
+        for raw in ("/post/2019/12/a.html?id=1&b=2#top", "http://a.com",
+                    "http://a.com:8080/a/b/?x", "list.php?c=1"):
+            info = normalizer.parse(raw)
+            self.assertEqual(f._final_url(info, method="GET"),
+                             f._final_url(info.url, method="GET"), raw)
+
+        info = normalizer.parse("/post/1/a.php?id=1&b=2#top")
+        self.assertEqual(info.url, "http://a.com/post/1/a.php?id=1&b=2")
+        self.assertEqual((info.domain, info.suffix, info.query_keys), ("a.com", ".php", ("b", "id")))
+        self.assertIsNone(normalizer.parse("javascript:void(0)"))
+        self.assertIs(normalizer.parse("/post/1/a.php?id=1&b=2#top"), info)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import logging
+import unittest
+
+from ..utils import outils
+
+
+class _ListHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+class LoggingTestCase(unittest.TestCase):
+
+    def _logger(self, name):
+        logger = logging.getLogger(name)
+        logger.propagate = False
+        handler = _ListHandler()
+        handler.setFormatter(outils.ColorFormatter("%(levelname)s %(message)s"))
+        logger.addHandler(handler)
+        return logger, handler
+
+    def test_sampled_log(self):
+        logger, handler = self._logger("test-sampled")
+        log = outils.SampledLog(logger, every=10)
+        logger.setLevel(logging.INFO)
+        for i in range(100):
+            log("checking: %s", i)
+        self.assertEqual(handler.messages, [])
+
+        logger.setLevel(logging.DEBUG)
+        for i in range(100):
+            log("checking: %s", i)
+        self.assertEqual(len(handler.messages), 10)
+        self.assertEqual(handler.messages[0], outils.blue("DEBUG checking: 0"))
+
+    def test_queue_handler(self):
+        logger, handler = self._logger("test-queue")
+        logger.setLevel(logging.INFO)
+        listener = outils.use_queue_handler(logger)
+        self.assertIs(outils.use_queue_handler(logger), listener)
+        logger.warning("%s pages", 3)
+        outils._listeners.pop(logger.name).stop()
+        self.assertEqual(handler.messages, [outils.yellow("WARNING 3 pages")])
@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
 # coding:utf-8
-import unittest
+import os
+import gzip
+import json
 import time
+import sqlite3
+import tempfile
+import unittest
+import threading
+from urllib.parse import urlparse
 
 from ..core import CrawlerPipelineHandler
 from ..core import CrawlerPipeline
 from ..core import CrawlerPipelineSummary
+from ..config import CrawlerConfig
+from ..aiocore import AsyncCrawlerPipeline
+from ..distributed import DistributedCrawlerPipeline, main as worker_main
+from ..utils.broker import RedisBroker, LocalRedis, ManagerBroker, shard_of
+from ..bench.site import SiteSpec, SyntheticSite, SiteServer
 
 
 class CrawlerPipelineHandlerDemo(CrawlerPipelineHandler):
@@ -14,6 +26,45 @@ class CrawlerPipelineHandlerDemo(CrawlerPipelineHandler):
         print("curren domain: {}".format(domain))
 
 
+class BatchHandler(CrawlerPipelineHandler):
+
+    def __init__(self, pipeline):
+        CrawlerPipelineHandler.__init__(self, pipeline)
+        self.batches = []
+        self.domains = []
+
+    def on_new_urls(self, urls):
+        # a slow sink
+        time.sleep(0.005)
+        self.batches.append(urls)
+
+    def on_new_domain(self, domain):
+        self.domains.append(domain)
+
+    def extra_url_checker_batch(self, urls):
+        return ["/item/" not in url for url in urls]
+
+
+class ItemHandler(CrawlerPipelineHandler):
+
+    def __init__(self, pipeline):
+        CrawlerPipelineHandler.__init__(self, pipeline)
+        self.events = []
+
+    def on_new_url(self, url):
+        self.events.append(("url", url))
+
+    def on_new_domain(self, domain):
+        self.events.append(("domain", domain))
+
+
+class ScoreHandler(CrawlerPipelineHandler):
+    PREFERRED = ("/news/", "/post/", "/about/", "/team/", "/product/")
+
+    def score_url(self, url, depth, parent):
+        return 1 if any(word in url for word in self.PREFERRED) else 0
+
+
 class PipelineTestCase(unittest.TestCase):
 
     def test_pipeline_basic(self):
@@ -26,5 +77,371 @@ class PipelineTestCase(unittest.TestCase):
 
         self.assertIsInstance(pipeline.get_summary(), CrawlerPipelineSummary)
 
+    def test_async_pipeline_basic(self):
+        with SiteServer(SyntheticSite(SiteSpec(pages=20, page_size=1024))) as server:
+            pipeline = AsyncCrawlerPipeline(handler=CrawlerPipelineHandlerDemo)
+            pipeline.start(start_url=server.url, method="GET",
+                           headers=None, data=None, params=None, auth=None, cookies=None,)
+
+            pipeline.wait_until_finished()
+
+        summary = pipeline.get_summary()
+        self.assertIsInstance(summary, CrawlerPipelineSummary)
+        self.assertEqual(summary.current_finished_request_count,
+                         summary.current_started_request_count)
+        # the pages were fetched on the event loop, not only the start url
+        self.assertGreaterEqual(summary.metrics["counters"]["responses_total"]["status=200"], 18)
+        self.assertEqual(summary.metrics["counters"]["fetch_errors_total"][""], 0)
+        # every fetch task was kept until it finished
+        self.assertEqual(pipeline._tasks, set())
+
+    def test_dispatch_error(self):
+        class BrokenPipeline(CrawlerPipeline):
+            def _handle_links(self, fetch_result, trace_id):
+                if fetch_result.record.url.endswith("/"):
+                    raise RuntimeError("broken")
+                CrawlerPipeline._handle_links(self, fetch_result, trace_id)
+
+        with SiteServer(SyntheticSite(SiteSpec(pages=20))) as server:
+            for cls in (BrokenPipeline, type("AsyncBrokenPipeline", (BrokenPipeline, AsyncCrawlerPipeline), {})):
+                pipeline = cls()
+                pipeline.start(start_url=server.url + "/")
+                # the dispatcher survives and the crawl ends
+                pipeline.wait_until_finished()
+                self.assertEqual(pipeline._dispatch_errors.value, 1, cls.__name__)
+                self.assertFalse(pipeline._have_started_event.is_set())
+
+    def test_unparsable_record(self):
+        class MailtoPipeline(CrawlerPipeline):
+            def _handle_links(self, fetch_result, trace_id):
+                if fetch_result.record.depth == 0:
+                    self._schedule("mailto:a@example.com", depth=1)
+                CrawlerPipeline._handle_links(self, fetch_result, trace_id)
+
+        with SiteServer(SyntheticSite(SiteSpec(pages=20))) as server:
+            pipeline = MailtoPipeline()
+            pipeline.start(start_url=server.url)
+            pipeline.wait_until_finished()
+        summary = pipeline.get_summary()
+        self.assertEqual(summary.current_finished_request_count, summary.current_started_request_count)
+        self.assertEqual(summary.metrics["counters"]["fetch_errors_total"][""], 1)
+
+    def test_synthetic_site(self):
+        spec = SiteSpec(pages=50, page_size=1024)
+        with SiteServer(SyntheticSite(spec)) as server:
+            for cls in (CrawlerPipeline, AsyncCrawlerPipeline):
+                pipeline = cls()
+                pipeline.start(start_url=server.url)
+                pipeline.wait_until_finished()
+
+                summary = pipeline.get_summary()
+                ok = summary.metrics["counters"]["responses_total"]["status=200"]
+                # every page, and about one page of each fake static template
+                self.assertGreaterEqual(ok, 45, cls)
+                self.assertLessEqual(ok, 50 + 8, cls)
+                self.assertEqual(summary.current_finished_request_count, ok)
+
+    def test_slowdown_retry(self):
+        spec = SiteSpec(pages=50, page_size=1024, throttle=0.3)
+        for cls in (CrawlerPipeline, AsyncCrawlerPipeline):
+            with SiteServer(SyntheticSite(spec)) as server:
+                pipeline = cls()
+                pipeline.start(start_url=server.url)
+                pipeline.wait_until_finished()
+
+                summary = pipeline.get_summary()
+                statuses = summary.metrics["counters"]["responses_total"]
+                # the throttled pages are fetched again after their Retry-After
+                self.assertGreater(statuses["status=429"], 0, cls)
+                self.assertEqual(summary.metrics["counters"]["slowdown_retries_total"][""],
+                                 statuses["status=429"], cls)
+                self.assertGreaterEqual(statuses["status=200"], 45, cls)
+                self.assertEqual(summary.current_finished_request_count, statuses["status=200"], cls)
+
+    def test_crawl_order(self):
+        spec = SiteSpec(pages=300, page_size=1024, fake_static=0)
+        with SiteServer(SyntheticSite(spec)) as server, tempfile.TemporaryDirectory() as path:
+            fetched = {}
+            for order in ("bfs", "dfs", "score"):
+                # the default frontier_window holds every url of the site
+                config = CrawlerConfig()
+                config._options.update(crawl_order=order, sink="jsonl", sink_path=os.path.join(path, order))
+                pipeline = CrawlerPipeline(config, handler=ScoreHandler)
+                pipeline.start(start_url=server.url)
+                pipeline.wait_until_finished()
+                rows = []
+                for filename in pipeline.sink_writer.sink.files:
+                    with gzip.open(filename, "rt") as fp:
+                        rows.extend(json.loads(line) for line in fp)
+                fetched[order] = rows
+
+            def mean(values):
+                return sum(values) / len(values)
+
+            third = len(fetched["bfs"]) // 3
+            depths = {order: [row["depth"] for row in rows] for order, rows in fetched.items()}
+            self.assertLess(mean(depths["bfs"][:third]), mean(depths["bfs"][-third:]))
+            self.assertGreater(mean(depths["dfs"][:third]), mean(depths["dfs"][-third:]))
+            self.assertGreater(max(depths["dfs"][:third]), max(depths["bfs"][:third]))
+            preferred = [any(word in row["url"] for word in ScoreHandler.PREFERRED) for row in fetched["score"]]
+            self.assertGreater(sum(preferred[:third]), 2 * sum(preferred[-third:]))
+
+    def test_elastic_pool(self):
+        spec = SiteSpec(pages=200, page_size=1024, latency=0.05)
+        with SiteServer(SyntheticSite(spec)) as server:
+            config = CrawlerConfig()
+            config._config["crawler_options"]["poolsize"] = 2
+            config._options.update(pool_max_size=16, pool_scale_interval=0.1, host_concurrency=16)
+            pipeline = CrawlerPipeline(config)
+            pipeline.start(start_url=server.url)
+            pipeline.wait_until_finished()
+
+            decisions = pipeline.worker_pool.scaling_decisions()
+            self.assertEqual(decisions[0].action, "grow")
+            self.assertLessEqual(max(d.size for d in decisions), 16)
+            self.assertGreater(pipeline.get_summary().current_finished_request_count, 190)
+
+    def test_trace(self):
+        spec = SiteSpec(pages=50, page_size=1024)
+        with SiteServer(SyntheticSite(spec)) as server, tempfile.TemporaryDirectory() as path:
+            for cls in (CrawlerPipeline, AsyncCrawlerPipeline):
+                config = CrawlerConfig()
+                config._options.update(trace_sample_every=1, trace_path=os.path.join(path, "trace.json"))
+                pipeline = cls(config)
+                sampler = pipeline.profile(5, os.path.join(path, "stacks.txt"), interval=0.001)
+                pipeline.start(start_url=server.url)
+                pipeline.wait_until_finished()
+                sampler.stop()
+
+                with open(config.trace_path) as fp:
+                    events = json.load(fp)["traceEvents"]
+                names = {e["name"] for e in events}
+                self.assertLessEqual({"host queue", "result queue", "fetch", "on_result", "dedup"}, names, cls)
+                fetches = [e for e in events if e["name"] == "fetch"]
+                self.assertEqual(len(fetches), pipeline.get_summary().current_finished_request_count)
+                self.assertGreater(sampler.samples, 0)
+                with open(os.path.join(path, "stacks.txt")) as fp:
+                    self.assertIn("_pipeline_dispatcher" if cls is CrawlerPipeline else "_crawl", fp.read())
+
+    def test_saturated_dedup(self):
+        # every page links the next one, the site is a cycle
+        spec = SiteSpec(pages=300, page_size=1024, fake_static=0)
+        with SiteServer(SyntheticSite(spec)) as server:
+            config = CrawlerConfig()
+            # only the url set stops the pages found again
+            config._options.update(dedup_backend="exact", dedup_capacity=16, dedup_memory_limit=1024,
+                                   url_simhash_distance=0)
+            pipeline = CrawlerPipeline(config)
+            pipeline.start(start_url=server.url)
+            summary = self._wait(pipeline, 30)
+
+            self.assertEqual(summary.metrics["gauges"]["dedup_saturated"], 1)
+            # no page is crawled twice
+            self.assertLessEqual(summary.current_finished_request_count, 300)
+
+    def test_batch_handler(self):
+        spec = SiteSpec(pages=50, page_size=1024)
+        with SiteServer(SyntheticSite(spec)) as server:
+            for queue_size in (0, 2):
+                config = CrawlerConfig()
+                config._options["handler_queue_size"] = queue_size
+                pipeline = CrawlerPipeline(config, handler=BatchHandler)
+                pipeline.start(start_url=server.url)
+                pipeline.wait_until_finished()
+
+                handler = pipeline.handlers
+                urls = [url for urls in handler.batches for url in urls]
+                self.assertEqual(len(urls), len(set(urls)))
+                self.assertTrue(any("/item/" in url for url in urls))
+                self.assertEqual(handler.domains, ["127.0.0.1"])
+                summary = pipeline.get_summary()
+                self.assertEqual(summary.current_finished_request_count,
+                                 summary.metrics["counters"]["responses_total"]["status=200"])
+                if queue_size:
+                    # pages merged in one call
+                    self.assertLess(len(handler.batches), summary.current_finished_request_count)
+
+    def test_item_handler(self):
+        spec = SiteSpec(pages=50, page_size=1024)
+        with SiteServer(SyntheticSite(spec)) as server:
+            for queue_size in (0, 2):
+                config = CrawlerConfig()
+                config._options["handler_queue_size"] = queue_size
+                pipeline = CrawlerPipeline(config, handler=ItemHandler)
+                pipeline.start(start_url=server.url)
+                pipeline.wait_until_finished()
+
+                # the domain right after its first url, as one url at a time
+                events = pipeline.handlers.events
+                self.assertEqual(events[0][0], "url")
+                self.assertEqual(events[1], ("domain", "127.0.0.1"))
+                self.assertEqual([kind for kind, _ in events].count("domain"), 1)
+                self.assertGreater(len(events), 40)
+
+    def test_sink(self):
+        spec = SiteSpec(pages=50, page_size=1024)
+        with SiteServer(SyntheticSite(spec)) as server, tempfile.TemporaryDirectory() as path:
+            config = CrawlerConfig()
+            config._options.update(sink="sqlite", sink_path=path + "/crawl.sqlite3", sink_body=True)
+            pipeline = CrawlerPipeline(config)
+            pipeline.start(start_url=server.url)
+            pipeline.wait_until_finished()
+
+            db = sqlite3.connect(path + "/crawl.sqlite3")
+            rows = db.execute("SELECT url, status, length(body) FROM results").fetchall()
+            db.close()
+            self.assertEqual(len(rows), pipeline.get_summary().current_finished_request_count)
+            self.assertTrue(all(size >= 1024 for url, status, size in rows if status == 200))
+
+            # the async engine waits for a full buffer off the loop
+            config = CrawlerConfig()
+            config._options.update(sink="sqlite", sink_path=path + "/async.sqlite3", sink_body=True,
+                                   sink_buffer_size=4096, sink_batch_size=2)
+            pipeline = AsyncCrawlerPipeline(config)
+            pipeline.start(start_url=server.url)
+            pipeline.wait_until_finished()
+            db = sqlite3.connect(path + "/async.sqlite3")
+            count, = db.execute("SELECT count(*) FROM results").fetchone()
+            db.close()
+            self.assertEqual(count, pipeline.get_summary().current_finished_request_count)
+            self.assertFalse(pipeline._backlog)
+
+            # bodies cut at max_body_size are marked in the warc
+            engines = (
+                ("thread", CrawlerPipeline),
+                ("distributed", lambda c: DistributedCrawlerPipeline(c, broker=RedisBroker(LocalRedis(), shards=2))),
+            )
+            for name, build in engines:
+                config = CrawlerConfig()
+                config._options.update(sink="warc", sink_path="{}/warc-{}".format(path, name), sink_body=True,
+                                       max_body_size=512, max_pages=5)
+                pipeline = build(config)
+                pipeline.start(start_url=server.url)
+                pipeline.wait_until_finished()
+                with gzip.open(pipeline.sink_writer.sink.files[0], "rb") as fp:
+                    data = fp.read()
+                self.assertEqual(data.count(b"WARC-Type: response"), 5, name)
+                self.assertEqual(data.count(b"WARC-Truncated: length"), 5, name)
+
+    def test_recrawl_cache(self):
+        with tempfile.TemporaryDirectory() as path:
+            for etag in (1, 0):
+                spec = SiteSpec(pages=50, page_size=1024, etag=etag)
+                with SiteServer(SyntheticSite(spec), use_asyncio=bool(etag)) as server:
+                    counts = []
+                    for cls in (CrawlerPipeline, AsyncCrawlerPipeline):
+                        config = CrawlerConfig()
+                        config._options["recrawl_cache"] = "{}/recrawl-{}.sqlite3".format(path, etag)
+                        pipeline = cls(config)
+                        pipeline.start(start_url=server.url)
+                        pipeline.wait_until_finished()
+                        summary = pipeline.get_summary()
+                        counts.append(summary.current_finished_request_count)
+
+                    statuses = summary.metrics["counters"]["responses_total"]
+                    hits = summary.metrics["gauges"]["recrawl_cache_hits"]
+                    # the second crawl finds the same pages with the links of the cache,
+                    # but the fake static page of a template may be another one
+                    self.assertEqual(counts[0], counts[1])
+                    self.assertGreaterEqual(hits, counts[1] - 8)
+                    if etag:
+                        self.assertEqual(statuses["status=304"], hits)
+                    else:
+                        self.assertEqual(statuses, {"status=200": counts[1]})
+
+    def test_near_dup_content(self):
+        spec = SiteSpec(pages=50, page_size=2048, trap=0.2)
+        with SiteServer(SyntheticSite(spec)) as server:
+            for distance in (0, 3):
+                config = CrawlerConfig()
+                config._options.update(max_pages=300, content_simhash_distance=distance)
+                pipeline = CrawlerPipeline(config)
+                pipeline.start(start_url=server.url)
+                pipeline.wait_until_finished()
+
+                summary = pipeline.get_summary()
+                near_dups = summary.metrics["counters"]["near_dup_pages_total"][""]
+                if distance:
+                    # the pages with session ids are not parsed, the crawl ends
+                    self.assertGreater(near_dups, 0)
+                    self.assertLess(summary.current_finished_request_count, 300)
+                else:
+                    self.assertEqual(summary.current_finished_request_count, 300)
+
+    def test_distributed(self):
+        self.assertEqual(shard_of("127.0.0.1:8080", 8), shard_of("127.0.0.1:8080", 8))
+        spec = SiteSpec(pages=50, page_size=1024)
+        with SiteServer(SyntheticSite(spec)) as server:
+            # the workers are threads with a LocalRedis
+            pipeline = DistributedCrawlerPipeline(broker=RedisBroker(LocalRedis(), shards=2))
+            pipeline.start(start_url=server.url)
+            pipeline.wait_until_finished()
+
+            summary = pipeline.get_summary()
+            ok = summary.metrics["counters"]["responses_total"]["status=200"]
+            self.assertGreaterEqual(ok, 45)
+            self.assertEqual(summary.current_finished_request_count, ok)
+
+    def test_manager_broker(self):
+        spec = SiteSpec(pages=50, page_size=1024)
+        with SiteServer(SyntheticSite(spec)) as server:
+            broker = ManagerBroker(shards=2).serve()
+            try:
+                # no default key, the coordinator generates one
+                self.assertEqual(len(broker.authkey), 32)
+                with self.assertRaises(ValueError):
+                    ManagerBroker(2, broker.address).connect()
+                with self.assertRaises(SystemExit):
+                    worker_main(["--address", "127.0.0.1:1", "--shards", "2", "--shard", "0"])
+
+                # the workers connect as ``python -m crawlerpipeline.worker``
+                pipeline = DistributedCrawlerPipeline(broker=broker, processes=0)
+                address = "{}:{}".format(*broker.address)
+                workers = [threading.Thread(target=worker_main, daemon=True, args=([
+                    "--address", address, "--authkey", broker.authkey.hex(), "--shards", "2",
+                    "--shard", str(shard)],)) for shard in range(2)]
+                for worker in workers:
+                    worker.start()
+                pipeline.start(start_url=server.url)
+                summary = self._wait(pipeline, 30)
+                for worker in workers:
+                    worker.join(10)
+                    self.assertFalse(worker.is_alive())
+
+                ok = summary.metrics["counters"]["responses_total"]["status=200"]
+                self.assertGreaterEqual(ok, 45)
+                self.assertEqual(summary.current_finished_request_count, ok)
+            finally:
+                broker.close()
+
+    def _wait(self, pipeline, seconds):
+        waiter = threading.Thread(target=pipeline.wait_until_finished, daemon=True)
+        waiter.start()
+        waiter.join(seconds)
+        self.assertFalse(waiter.is_alive())
+        summary = pipeline.get_summary()
+        self.assertEqual(summary.current_finished_request_count, summary.current_started_request_count)
+        return summary
+
+    def test_distributed_dead_worker(self):
+        spec = SiteSpec(pages=200, page_size=1024, latency=0.3)
+        with SiteServer(SyntheticSite(spec)) as server:
+            pipeline = DistributedCrawlerPipeline(processes=2)
+            pipeline.start(start_url=server.url)
+            time.sleep(0.5)
+            # the worker process of the site is gone with its requests
+            pipeline._workers[shard_of(urlparse(server.url).netloc, 2)].kill()
+            summary = self._wait(pipeline, 30)
+            self.assertGreater(summary.metrics["counters"]["fetch_errors_total"][""], 0)
+
+            # no worker ever connects
+            config = CrawlerConfig()
+            config._options["worker_timeout"] = 1
+            pipeline = DistributedCrawlerPipeline(config, broker=RedisBroker(LocalRedis()), processes=0)
+            pipeline.start(start_url=server.url)
+            summary = self._wait(pipeline, 30)
+            self.assertEqual(summary.metrics["counters"]["fetch_errors_total"][""], 1)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import os
+import time
+import tempfile
+import unittest
+
+from ..utils.recrawl import RecrawlCache
+
+
+class RecrawlCacheTestCase(unittest.TestCase):
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = RecrawlCache(os.path.join(path, "recrawl.sqlite3"))
+            self.assertIsNone(cache.get("http://a.com/"))
+            cache.put("http://a.com/", '"v1"', "", "h", ["/a", "/b"])
+            entry = cache.get("http://a.com/")
+            self.assertEqual(entry.links, ["/a", "/b"])
+            self.assertEqual(entry.validators, {"If-None-Match": '"v1"'})
+            # a hit is a page validated unchanged, not a lookup
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            cache.touch("http://a.com/")
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            for i in range(100):
+                cache.put("http://a.com/{}".format(i), "", "", "h", ["/x"] * 10)
+            cache.max_size = cache.size() // 2
+            cache.evict()
+            self.assertLessEqual(cache.size(), cache.max_size)
+            # the newest are kept
+            self.assertIsNotNone(cache.get("http://a.com/99"))
+            self.assertIsNone(cache.get("http://a.com/"))
+
+            cache.max_age = 0.001
+            time.sleep(0.01)
+            self.assertIsNone(cache.get("http://a.com/99"))
+            cache.evict()
+            self.assertEqual(len(cache), 0)
+            cache.close()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import time
+import unittest
+import email.utils
+
+from ..utils.scheduler import HostScheduler, parse_retry_after
+
+
+class HostSchedulerTester(unittest.TestCase):
+    """"""
+
+    def test_round_robin(self):
+        """"""
+        submitted = []
+        scheduler = HostScheduler(lambda h, i: submitted.append(i),
+                                  max_in_flight=4, host_concurrency=2)
+        for i in range(4):
+            scheduler.put("a.com", "a{}".format(i))
+        scheduler.put("b.com", "b0")
+        scheduler.put("c.com", "c0")
+
+        picked, _ = scheduler._pick(time.monotonic())
+        self.assertEqual([i for _, i in picked], ["a0", "b0", "c0"])
+
+        # max_in_flight is reached
+        picked, _ = scheduler._pick(time.monotonic())
+        self.assertEqual([i for _, i in picked], ["a1"])
+        picked, _ = scheduler._pick(time.monotonic())
+        self.assertEqual(picked, [])
+
+        scheduler.task_done("a.com", 200, 0.1)
+        picked, _ = scheduler._pick(time.monotonic())
+        self.assertEqual([i for _, i in picked], ["a2"])
+
+    def test_priority(self):
+        """"""
+        scheduler = HostScheduler(lambda h, i: None, max_in_flight=10)
+        for item, priority in (("a", 2), ("b", 0), ("c", 1), ("d", 0)):
+            scheduler.put("a.com", item, priority)
+        picked, _ = scheduler._pick(time.monotonic())
+        self.assertEqual([i for _, i in picked], ["b"])
+        self.assertEqual(scheduler.drain(), ["d", "c", "a"])
+
+    def test_slowdown(self):
+        """"""
+        scheduler = HostScheduler(lambda h, i: None, host_concurrency=8, adaptive=True)
+        scheduler.put("a.com", 1)
+        scheduler.put("a.com", 2)
+        scheduler._pick(time.monotonic())
+        scheduler.task_done("a.com", 429, 0.1, retry_after=10)
+
+        self.assertEqual(scheduler.stats()["a.com"].limit, 4)
+        picked, wait = scheduler._pick(time.monotonic())
+        self.assertEqual(picked, [])
+        self.assertGreater(wait, 9)
+
+    def test_retry_after(self):
+        """"""
+        self.assertEqual(parse_retry_after("120"), 120)
+        self.assertIsNone(parse_retry_after("soon"))
+        later = email.utils.formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(parse_retry_after(later), 30, delta=2)
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0)
+
+        # not adaptive, the host still backs off
+        scheduler = HostScheduler(lambda h, i: None, host_concurrency=8)
+        scheduler.put("a.com", 1)
+        scheduler._pick(time.monotonic())
+        scheduler.task_done("a.com", 503, 0.1, retry_after=parse_retry_after(later))
+        scheduler.put("a.com", 1)
+        picked, wait = scheduler._pick(time.monotonic())
+        self.assertEqual(picked, [])
+        self.assertGreater(wait, 25)
+        self.assertEqual(scheduler.stats()["a.com"].limit, 8)
+
+    def test_latency_outlier(self):
+        """"""
+        scheduler = HostScheduler(lambda h, i: None, host_concurrency=8, adaptive=True)
+        latencies = [0.004] + [0.02 + 0.02 * (i % 3) / 2 for i in range(200)]
+        limits = []
+        for latency in latencies:
+            scheduler.put("a.com", latency)
+            scheduler._pick(time.monotonic())
+            scheduler.task_done("a.com", 200, latency)
+            limits.append(scheduler.stats()["a.com"].limit)
+        self.assertEqual(min(limits), 8)
+
+        # the host really gets slower
+        for _ in range(20):
+            scheduler.put("a.com", 1)
+            scheduler._pick(time.monotonic())
+            scheduler.task_done("a.com", 200, 0.5)
+        self.assertLess(scheduler.stats()["a.com"].limit, 8)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import os
+import gzip
+import json
+import time
+import base64
+import sqlite3
+import tempfile
+import unittest
+
+from ..utils.sink import SinkRecord, SinkWriter, JSONLSink, WARCSink, SQLiteSink
+
+
+class SinkTestCase(unittest.TestCase):
+
+    def _records(self, count):
+        return [SinkRecord("http://a.com/{}".format(i), "GET", 200, "OK", {"Content-Type": "text/html"},
+                           0.1, time.time(), 1, "http://a.com/", b"<html>%d</html>" % i)
+                for i in range(count)]
+
+    def test_sinks(self):
+        with tempfile.TemporaryDirectory() as path:
+            sink = JSONLSink(os.path.join(path, "jsonl"), rotate_size=4096)
+            writer = SinkWriter(sink, max_buffer=4096, batch_size=50).start()
+            for record in self._records(2000):
+                writer.put(record)
+                self.assertLessEqual(writer.buffered_bytes, 4096)
+            writer.close()
+            self.assertGreater(len(sink.files), 1)
+            lines = []
+            for filename in sink.files:
+                with gzip.open(filename, "rt") as fp:
+                    lines.extend(json.loads(line) for line in fp)
+            self.assertEqual(len(lines), 2000)
+            self.assertEqual(base64.b64decode(lines[5]["body"]), b"<html>5</html>")
+
+            sink = WARCSink(os.path.join(path, "warc"))
+            writer = SinkWriter(sink).start()
+            for record in self._records(10):
+                writer.put(record)
+            writer.close()
+            with gzip.open(sink.files[0], "rb") as fp:
+                data = fp.read()
+            self.assertEqual(data.count(b"WARC-Type: response"), 10)
+            self.assertNotIn(b"WARC-Truncated", data)
+
+            sink = WARCSink(os.path.join(path, "warc-truncated"))
+            writer = SinkWriter(sink).start()
+            writer.put(self._records(1)[0]._replace(truncated="length"))
+            writer.close()
+            with gzip.open(sink.files[0], "rb") as fp:
+                self.assertIn(b"WARC-Truncated: length\r\n", fp.read())
+
+            sink = SQLiteSink(os.path.join(path, "crawl.sqlite3"))
+            writer = SinkWriter(sink, batch_size=7).start()
+            for record in self._records(100):
+                writer.put(record)
+            writer.close()
+            db = sqlite3.connect(sink.path)
+            self.assertEqual(db.execute("SELECT count(*) FROM results").fetchone()[0], 100)
+            db.close()
+
+    def test_put_nowait(self):
+        with tempfile.TemporaryDirectory() as path:
+            records = self._records(2)
+            writer = SinkWriter(JSONLSink(os.path.join(path, "jsonl")), max_buffer=records[0].size)
+            self.assertTrue(writer.put_nowait(records[0]))
+            self.assertFalse(writer.put_nowait(records[1]))
+            self.assertEqual(writer.buffered_bytes, records[0].size)
+            writer.close()
+            self.assertEqual(writer.written, 1)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+
+from ..config import CrawlerConfig, _DEFAULT_CONFIG
+from ..core import CrawlerPipeline
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# loaded on first use only
+_HEAVY = ("yaml", "colorama", "numpy", "aiohttp", "bs4", "simhash", "bloom_filter")
+
+
+def import_times(code) -> dict:
+    """module -> cumulative import time in us, from python -X importtime"""
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=_ROOT,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode:
+        raise AssertionError(process.stderr)
+    times = {}
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                times[name.strip()] = int(cumulative)
+    return times
+
+
+class StartupTestCase(unittest.TestCase):
+
+    def test_import_package(self):
+        times = import_times("import crawlerpipeline")
+        self.assertIn("crawlerpipeline", times)
+        self.assertNotIn("crawlerpipeline.utils.frontier", times)
+        self.assertNotIn("requests", times)
+
+    def test_new_pipeline(self):
+        times = import_times("from crawlerpipeline import CrawlerPipeline; CrawlerPipeline()")
+        # the lazy import of core is not timed, its own imports are
+        self.assertIn("crawlerpipeline.utils.frontier", times)
+        for name in _HEAVY:
+            self.assertNotIn(name, times)
+
+    def test_config(self):
+        config = CrawlerConfig()
+        config._options["poolsize"] = 3
+        self.assertEqual(CrawlerConfig().poolsize, _DEFAULT_CONFIG["crawler_options"]["poolsize"])
+
+        with tempfile.TemporaryDirectory() as path:
+            filename = os.path.join(path, "crawler.yml")
+            with open(filename, "w") as fp:
+                fp.write("crawler_options:\n  poolsize: 7\n")
+            config.merge_config_from_file(filename)
+            self.assertEqual(config.poolsize, 7)
+            # parsed once, each config gets its own copy
+            config._options["poolsize"] = 8
+            other = CrawlerConfig()
+            other.merge_config_from_file(filename)
+            self.assertEqual(other.poolsize, 7)
+
+            with open(filename, "w") as fp:
+                fp.write("crawler_options:\n  poolsize: 9\n")
+            os.utime(filename, ns=(0, 1))
+            other.merge_config_from_file(filename)
+            self.assertEqual(other.poolsize, 9)
+
+            # the options left out of the file keep their defaults
+            pipeline = CrawlerPipeline(other)
+            self.assertEqual(pipeline.config.url_simhash_distance,
+                             _DEFAULT_CONFIG["crawler_options"]["url_simhash_distance"])
+            self.assertEqual(pipeline.worker_pool.size, 9)
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import os
+import time
+import unittest
+import threading
+
+from ..utils.trace import Tracer, StackSampler
+
+
+class TraceTestCase(unittest.TestCase):
+
+    def test_tracer(self):
+        tracer = Tracer(sample_every=1)
+        trace_id = tracer.trace_id("http://a.com/")
+        self.assertTrue(trace_id)
+        tracer.wait(trace_id, "task queue")
+
+        def worker():
+            tracer.done_waiting(trace_id, "task queue")
+            with tracer.stage(trace_id, "fetch", url="http://a.com/"):
+                time.sleep(0.01)
+
+        thread = threading.Thread(target=worker, name="labor")
+        thread.start()
+        thread.join()
+
+        events = tracer.chrome_trace()["traceEvents"]
+        fetch = [e for e in events if e["name"] == "fetch"][0]
+        self.assertGreaterEqual(fetch["dur"], 10000)
+        self.assertEqual(fetch["args"]["url"], "http://a.com/")
+        self.assertIn({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": fetch["tid"],
+                       "args": {"name": "labor"}}, events)
+        self.assertEqual([e["ph"] for e in events if e["name"] == "task queue"], ["b", "e"])
+        self.assertEqual(tracer.summary()["fetch"]["count"], 1)
+
+        off = Tracer(sample_every=0)
+        self.assertEqual(off.trace_id("http://a.com/"), 0)
+        with off.stage(0, "fetch"):
+            pass
+        self.assertEqual(len(off), 0)
+
+    def test_sampler(self):
+
+        def busy_loop(stop):
+            while not stop.is_set():
+                sum(range(1000))
+
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_loop, args=(stop,), name="busy")
+        thread.start()
+        sampler = StackSampler(interval=0.002).start(seconds=0.2)
+        sampler.wait()
+        stop.set()
+        thread.join()
+        self.assertGreater(sampler.samples, 10)
+        self.assertTrue(any(line.startswith("busy;") and "busy_loop" in line
+                            for line in sampler.collapsed().splitlines()))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import unittest
+
+import requests
+
+from ..core import CrawlerPipeline
+from ..config import CrawlerConfig
+from ..utils import transport
+from ..bench.site import SiteSpec, SyntheticSite, SiteServer
+
+
+class TransportTestCase(unittest.TestCase):
+
+    def test_connection_reuse(self):
+        site = SyntheticSite(SiteSpec(pages=20, page_size=1024))
+        with SiteServer(site) as server:
+            client = transport.RequestsTransport(pool_maxsize=4, pool_connections=1)
+            for path in site.paths:
+                prepared = client.prepare_request(requests.Request("GET", server.url.rstrip("/") + path))
+                self.assertEqual(client.send(prepared).status_code, 200)
+            self.assertEqual(client.stats(), transport.TransportStats(1, 20))
+            client.close()
+            self.assertEqual(client.stats(), transport.TransportStats(1, 20))
+
+    def test_pipeline_transport(self):
+        site = SyntheticSite(SiteSpec(pages=50, page_size=1024))
+        with SiteServer(site) as server:
+            config = CrawlerConfig()
+            config._options.update(poolsize=4, host_concurrency=6, max_pages=50)
+            pipeline = CrawlerPipeline(config)
+            # a connection for each worker of the host at most
+            self.assertEqual(pipeline.transport.adapter._pool_maxsize, 6)
+            pipeline.start(start_url=server.url)
+            pipeline.wait_until_finished()
+
+            gauges = pipeline.get_summary().metrics["gauges"]
+            self.assertEqual(gauges["transport_requests"], pipeline.get_summary().current_finished_request_count)
+            self.assertLessEqual(gauges["transport_connections"], 6)
+
+    def test_httpx_stream(self):
+        site = SyntheticSite(SiteSpec(pages=4, page_size=1 << 20))
+        with SiteServer(site) as server:
+            client = transport.HTTPXTransport(pool_maxsize=2, pool_connections=1)
+            url = server.url.rstrip("/") + site.paths[1]
+            prepared = client.prepare_request(requests.Request("GET", url))
+
+            response = client.send(prepared, stream=True)
+            self.assertEqual(response.status_code, 200)
+            chunk = next(response.iter_content(65536))
+            self.assertEqual(len(chunk), 65536)
+            # the rest of the body is not downloaded
+            self.assertLess(response.raw._rsp.num_bytes_downloaded, 1 << 19)
+            response.close()
+
+            response = client.send(prepared)
+            self.assertEqual(len(response.content), len(site.response(site.paths[1])[1]))
+            self.assertEqual(client.stats().requests, 2)
+            client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
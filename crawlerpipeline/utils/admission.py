@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import re
+import typing
+import threading
+import collections
+from .urlinfo import URLInfo, URLNormalizer, split_domain
+
+
+class DomainTrie(object):
+    """
+    Domain rules keyed by the reversed labels.
+
+        example.com      the domain only
+        *.example.com    the subdomains only
+        .example.com     the domain and its subdomains
+    """
+
+    # marks stored in the trie nodes
+    _EXACT = "$"
+    _SUBDOMAIN = "*"
+
+    def __init__(self, rules=()):
+        self._root = {}
+        self._size = 0
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule: str):
+        rule = rule.strip().lower()
+        if rule.startswith("*."):
+            marks, rule = (self._SUBDOMAIN,), rule[2:]
+        elif rule.startswith("."):
+            marks, rule = (self._EXACT, self._SUBDOMAIN), rule[1:]
+        else:
+            marks = (self._EXACT,)
+
+        node = self._root
+        for label in reversed(split_domain(rule).split(".")):
+            node = node.setdefault(label, {})
+        for mark in marks:
+            node[mark] = rule if mark == self._EXACT else "*." + rule
+        self._size += 1
+
+    def match(self, domain: str) -> typing.Optional[str]:
+        """the matched rule or None"""
+        node = self._root
+        labels = domain.lower().split(".")
+        for i in range(len(labels) - 1, -1, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return None
+            if i and self._SUBDOMAIN in node:
+                return node[self._SUBDOMAIN]
+        return node.get(self._EXACT)
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+
+class AdmissionRules(object):
+    """
+    The stateless url checks compiled once, in order:
+
+    1. domain blacklist
+    2. domain whitelist, or the netloc (subdomains) of the start url
+    3. suffix blacklist, unless static files with query are allowed
+    4. path exclude / include regex
+
+    evaluate() checks the links of a page in one call and is safe to call
+    from the worker threads, the hits of every rule are counted.
+    """
+
+    ALLOWED = "allowed"
+
+    def __init__(self, init_netloc, domain_whitelist=(), domain_blacklist=(),
+                 allow_subdomain=False, suffix_blacklist=(),
+                 allow_static_file_with_query=False, path_include=(), path_exclude=()):
+        self.init_netloc = init_netloc
+        self.blacklist = DomainTrie(domain_blacklist)
+        self.whitelist = DomainTrie(domain_whitelist)
+        # subdomains of the start url, when there is no whitelist
+        self.subdomains = DomainTrie(["." + split_domain(init_netloc)]) if allow_subdomain else None
+        self.suffix_blacklist = frozenset(x.lower() for x in suffix_blacklist)
+        self.allow_static_file_with_query = allow_static_file_with_query
+        self.path_include = [re.compile(x) for x in path_include]
+        self.path_exclude = [re.compile(x) for x in path_exclude]
+
+        self._hits = collections.Counter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, init_netloc):
+        return cls(
+            init_netloc,
+            domain_whitelist=config.domain_whitelist,
+            domain_blacklist=config.domain_blacklist,
+            allow_subdomain=config.allow_to_crawl_subdomain,
+            suffix_blacklist=config.suffix_blacklist,
+            allow_static_file_with_query=config.allow_static_file_with_query,
+            path_include=config.path_include,
+            path_exclude=config.path_exclude,
+        )
+
+    def check(self, info: URLInfo) -> str:
+        """the name of the rule rejecting the url, or ALLOWED"""
+        # 1.
+        if self.blacklist:
+            rule = self.blacklist.match(info.domain)
+            if rule:
+                return "domain_blacklist:" + rule
+        # 2.
+        if self.whitelist:
+            if not self.whitelist.match(info.domain):
+                return "domain_whitelist"
+        elif self.subdomains is not None:
+            if not self.subdomains.match(info.domain):
+                return "subdomain"
+        elif info.netloc != self.init_netloc:
+            return "netloc"
+        # 3.
+        suffix = info.suffix.lower()
+        if suffix in self.suffix_blacklist:
+            if not (self.allow_static_file_with_query and info.query):
+                return "suffix_blacklist:" + suffix
+        # 4.
+        for pattern in self.path_exclude:
+            if pattern.search(info.path):
+                return "path_exclude:" + pattern.pattern
+        if self.path_include:
+            for pattern in self.path_include:
+                if pattern.search(info.path):
+                    return self.ALLOWED
+            return "path_include"
+        return self.ALLOWED
+
+    def evaluate(self, infos: typing.Iterable[URLInfo]) -> typing.List[bool]:
+        """check a batch of urls, True for the allowed ones"""
+        hits = collections.Counter()
+        results = []
+        for info in infos:
+            rule = self.check(info)
+            hits[rule] += 1
+            results.append(rule == self.ALLOWED)
+
+        with self._lock:
+            self._hits.update(hits)
+        return results
+
+    def stats(self) -> typing.Dict[str, int]:
+        """hits of every rule"""
+        with self._lock:
+            return dict(self._hits)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Message brokers between the coordinator and the crawl workers.
+
+Every worker reads the tasks of its shard, all of them write to one
+result queue. A host always goes to the same shard (shard_of), so the
+connections and the politeness of a host stay in one worker.
+"""
+import time
+import pickle
+import logging
+import secrets
+import queue
+import typing
+import zlib
+import threading
+import multiprocessing
+from collections import deque, defaultdict
+from multiprocessing.managers import BaseManager
+
+logger = logging.getLogger("pipeline")
+
+
+def shard_of(netloc: str, shards: int) -> int:
+    """stable in every process, unlike hash()"""
+    return zlib.crc32(netloc.encode()) % shards
+
+
+class Broker(object):
+    # workers must be threads of the coordinator process
+    in_process = False
+
+    def __init__(self, shards=1):
+        self.shards = shards
+
+    def put_task(self, shard: int, message):
+        raise NotImplementedError()
+
+    def get_task(self, shard: int, timeout=None):
+        """None on timeout"""
+        raise NotImplementedError()
+
+    def put_result(self, message):
+        raise NotImplementedError()
+
+    def get_result(self, timeout=None):
+        """None on timeout"""
+        raise NotImplementedError()
+
+    def broadcast(self, message):
+        for shard in range(self.shards):
+            self.put_task(shard, message)
+
+    def close(self):
+        pass
+
+
+class QueueBroker(Broker):
+    """multiprocessing queues, for the worker processes forked on this box"""
+
+    def __init__(self, shards=1, context=None):
+        Broker.__init__(self, shards)
+        context = context or multiprocessing
+        self._tasks = [context.Queue() for _ in range(shards)]
+        self._results = context.Queue()
+
+    @staticmethod
+    def _get(q, timeout):
+        try:
+            return q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def put_task(self, shard, message):
+        self._tasks[shard].put(message)
+
+    def get_task(self, shard, timeout=None):
+        return self._get(self._tasks[shard], timeout)
+
+    def put_result(self, message):
+        self._results.put(message)
+
+    def get_result(self, timeout=None):
+        return self._get(self._results, timeout)
+
+    def close(self):
+        for q in self._tasks + [self._results]:
+            q.close()
+            q.join_thread()
+
+
+class _QueueManager(BaseManager):
+    pass
+
+
+class ManagerBroker(QueueBroker):
+    """
+    The queues are served by the coordinator over a socket, workers on
+    other boxes connect with the address and authkey.
+
+        coordinator: ManagerBroker(shards, ("0.0.0.0", 7777)).serve()
+        worker:      ManagerBroker(shards, ("10.0.0.1", 7777), key).connect()
+
+    The server unpickles what it receives, anyone with the authkey can run
+    code on the coordinator. serve() without one generates a random key
+    and logs it in hex, the --authkey of the workers.
+    """
+
+    def __init__(self, shards=1, address=("127.0.0.1", 0), authkey: bytes = None):
+        Broker.__init__(self, shards)
+        self.address = address
+        self.authkey = authkey
+        self._manager = None
+
+    def serve(self):
+        if not self.authkey:
+            self.authkey = secrets.token_bytes(32)
+            # a warning, shown before the pipeline logger is set up
+            logger.warning("workers connect to the broker with --authkey %s", self.authkey.hex())
+        tasks = [queue.Queue() for _ in range(self.shards)]
+        results = queue.Queue()
+        _QueueManager.register("get_tasks", callable=lambda shard: tasks[shard])
+        _QueueManager.register("get_results", callable=lambda: results)
+        self._manager = _QueueManager(self.address, self.authkey)
+        self._manager.start()
+        self.address = self._manager.address
+        self._bind()
+        return self
+
+    def connect(self):
+        if not self.authkey:
+            raise ValueError("the authkey of the coordinator is required")
+        _QueueManager.register("get_tasks")
+        _QueueManager.register("get_results")
+        self._manager = _QueueManager(self.address, self.authkey)
+        self._manager.connect()
+        self._bind()
+        return self
+
+    def _bind(self):
+        self._tasks = [self._manager.get_tasks(shard) for shard in range(self.shards)]
+        self._results = self._manager.get_results()
+
+    def __getstate__(self):
+        # a forked worker connects again
+        return {"shards": self.shards, "address": self.address, "authkey": bytes(self.authkey)}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+        self.connect()
+
+    def close(self):
+        if self._manager is not None and hasattr(self._manager, "shutdown"):
+            self._manager.shutdown()
+
+
+class RedisBroker(Broker):
+    """
+    Lists of a Redis compatible server, the client needs rpush and blpop.
+    Messages are pickled, only use it with a trusted server.
+    """
+
+    def __init__(self, client=None, shards=1, prefix="crawlerpipeline", url="redis://127.0.0.1:6379/0"):
+        Broker.__init__(self, shards)
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.in_process = isinstance(client, LocalRedis)
+
+    def _key(self, name):
+        return "{}:{}".format(self.prefix, name)
+
+    def _pop(self, key, timeout):
+        # 0 blocks forever for redis
+        item = self.client.blpop([key], timeout=0 if timeout is None else max(timeout, 0.01))
+        return pickle.loads(item[1]) if item else None
+
+    def put_task(self, shard, message):
+        self.client.rpush(self._key("tasks:{}".format(shard)), pickle.dumps(message))
+
+    def get_task(self, shard, timeout=None):
+        return self._pop(self._key("tasks:{}".format(shard)), timeout)
+
+    def put_result(self, message):
+        self.client.rpush(self._key("results"), pickle.dumps(message))
+
+    def get_result(self, timeout=None):
+        return self._pop(self._key("results"), timeout)
+
+
+class LocalRedis(object):
+    """In process stand-in of the redis lists used by RedisBroker."""
+
+    def __init__(self):
+        self._lists: typing.Dict[str, deque] = defaultdict(deque)
+        self._cond = threading.Condition()
+
+    def rpush(self, key, *values):
+        with self._cond:
+            self._lists[key].extend(values)
+            self._cond.notify_all()
+            return len(self._lists[key])
+
+    def blpop(self, keys, timeout=0):
+        if isinstance(keys, str):
+            keys = [keys]
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            while True:
+                for key in keys:
+                    if self._lists.get(key):
+                        return key, self._lists[key].popleft()
+                wait = None if deadline is None else deadline - time.monotonic()
+                if wait is not None and wait <= 0:
+                    return None
+                self._cond.wait(wait)
+
+    def llen(self, key):
+        with self._cond:
+            return len(self._lists.get(key, ()))
+
+    def delete(self, *keys):
+        with self._cond:
+            return sum(1 for key in keys if self._lists.pop(key, None) is not None)
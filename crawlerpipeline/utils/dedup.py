@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Sets of the urls already seen, used by FakeStaticPathFilter.
+
+    bloom  ScalableBloomFilter, a new stage of twice the capacity when one
+           is full, the false positive rate stays under error_rate
+    exact  ExactHashSet, 64 bit hashes in an open addressing table, no
+           false positive in practice, 16 bytes for each url
+
+Both keep their table in memory, or in a file mapped with mmap when a
+path is given. With memory_limit the set stops growing at that size:
+the bloom filter overfills its last stage (the false positive rate goes
+up), the exact set puts the new urls in a bloom filter of the memory
+left. Either way an url is never new twice, but new urls may be taken
+for seen ones. stats() tells when that happens.
+"""
+import os
+import math
+import mmap
+import typing
+import logging
+from hashlib import blake2b
+
+logger = logging.getLogger("pipeline")
+
+_MASK = (1 << 64) - 1
+
+
+def key_hash(key: str) -> int:
+    """128 bits, stable in every process"""
+    return int.from_bytes(blake2b(key.encode(), digest_size=16).digest(), "little")
+
+
+class DedupStats(typing.NamedTuple):
+    backend: str
+    count: int
+    # elements before the set has to grow
+    capacity: int
+    nbytes: int
+    # estimated false positive rate of a lookup
+    fp_rate: float
+    stages: int
+    # reached memory_limit
+    saturated: bool
+
+
+class _Buffer(object):
+    """bytes in memory or in a mapped file, kept through pickle"""
+
+    def __init__(self, nbytes, path=None):
+        self.nbytes = nbytes
+        self.path = path
+        self._open(create=True)
+
+    def _open(self, create):
+        self._mmap = None
+        if not self.path:
+            self.data = bytearray(self.nbytes)
+            return
+        if create:
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with open(self.path, "wb") as fp:
+                fp.truncate(self.nbytes)
+        with open(self.path, "r+b") as fp:
+            self._mmap = mmap.mmap(fp.fileno(), self.nbytes)
+        self.data = memoryview(self._mmap)
+
+    def view(self, typecode):
+        return memoryview(self.data).cast(typecode)
+
+    def flush(self):
+        if self._mmap is not None:
+            self._mmap.flush()
+
+    def close(self, remove=False):
+        if self._mmap is not None:
+            self.data.release()
+            self._mmap.close()
+            self._mmap = None
+            if remove:
+                os.remove(self.path)
+
+    @classmethod
+    def open(cls, nbytes, path):
+        """map an existing file"""
+        buffer = cls.__new__(cls)
+        buffer.nbytes, buffer.path = nbytes, path
+        buffer._open(create=False)
+        return buffer
+
+    def __getstate__(self):
+        # the bytes themselves, the file keeps changing after a checkpoint
+        return {"nbytes": self.nbytes, "path": self.path, "data": bytes(self.data)}
+
+    def __setstate__(self, state):
+        self.nbytes, self.path = state["nbytes"], state["path"]
+        if self.path:
+            with open(self.path, "wb") as fp:
+                fp.write(state["data"])
+            self._open(create=False)
+        else:
+            self._mmap = None
+            self.data = bytearray(state["data"])
+
+
+class DedupSet(object):
+    backend = ""
+
+    def __contains__(self, key: str) -> bool:
+        raise NotImplementedError()
+
+    def add(self, key: str):
+        raise NotImplementedError()
+
+    def check_and_add(self, key: str) -> bool:
+        """True if key is in the set, otherwise it is added"""
+        if key in self:
+            return True
+        self.add(key)
+        return False
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def stats(self) -> DedupStats:
+        raise NotImplementedError()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _BloomStage(object):
+
+    def __init__(self, capacity, error_rate, path=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.bits / capacity * math.log(2))))
+        self.count = 0
+        self._buffer = _Buffer((self.bits + 7) // 8, path)
+        self._data = self._buffer.data
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._data = self._buffer.data
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("_data")
+        return state
+
+    def _indexes(self, h):
+        h1, h2 = h & _MASK, (h >> 64) | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def contains(self, h) -> bool:
+        data = self._data
+        for i in self._indexes(h):
+            if not data[i >> 3] & (1 << (i & 7)):
+                return False
+        return True
+
+    def add(self, h):
+        data = self._data
+        for i in self._indexes(h):
+            data[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def fp_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+
+class ScalableBloomFilter(DedupSet):
+    """
+    Bloom filter in stages, stage i holds capacity * growth ** i urls at
+    error_rate * (1 - ratio) * ratio ** i, the total stays under error_rate.
+    """
+    backend = "bloom"
+
+    def __init__(self, capacity=100000, error_rate=0.0001, memory_limit=0, path=None,
+                 growth=2, ratio=0.5):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.memory_limit = memory_limit
+        self.path = path
+        self.growth = growth
+        self.ratio = ratio
+        self.saturated = False
+        self._stages: typing.List[_BloomStage] = []
+        self._grow()
+
+    def _grow(self):
+        i = len(self._stages)
+        capacity = self.capacity * self.growth ** i
+        # the first stage takes error_rate * (1 - ratio)
+        error_rate = self.error_rate * (1 - self.ratio) * self.ratio ** i
+        path = "{}.{}".format(self.path, i) if self.path else None
+        if self._stages and self.memory_limit:
+            bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+            if self.nbytes() + bits / 8 > self.memory_limit:
+                if not self.saturated:
+                    logger.warning("url dedup bloom filter is at its memory limit, "
+                                   "the false positive rate is going up")
+                self.saturated = True
+                return
+        self._stages.append(_BloomStage(capacity, error_rate, path))
+
+    def __contains__(self, key):
+        h = key_hash(key)
+        return any(stage.contains(h) for stage in self._stages)
+
+    def add(self, key):
+        self._add(key_hash(key))
+
+    def _add(self, h):
+        stage = self._stages[-1]
+        if stage.count >= stage.capacity and not self.saturated:
+            self._grow()
+            stage = self._stages[-1]
+        stage.add(h)
+
+    def check_and_add(self, key):
+        h = key_hash(key)
+        for stage in self._stages:
+            if stage.contains(h):
+                return True
+        self._add(h)
+        return False
+
+    def __len__(self):
+        return sum(stage.count for stage in self._stages)
+
+    def nbytes(self):
+        return sum(stage._buffer.nbytes for stage in self._stages)
+
+    def stats(self):
+        ok = 1.0
+        for stage in self._stages:
+            ok *= 1 - stage.fp_rate()
+        return DedupStats(self.backend, len(self), sum(s.capacity for s in self._stages),
+                          self.nbytes(), 1 - ok, len(self._stages), self.saturated)
+
+    def flush(self):
+        for stage in self._stages:
+            stage._buffer.flush()
+
+    def close(self):
+        for stage in self._stages:
+            stage._buffer.close()
+
+
+class ExactHashSet(DedupSet):
+    """
+    64 bit hashes in a linear probing table, grown at half full. The
+    chance of a false positive among n urls is about n / 2 ** 64.
+
+    At memory_limit the urls not in the table go to a bloom filter of the
+    memory left, at least an eighth of the table, sized for
+    overflow_error_rate. It overfills like a saturated ScalableBloomFilter.
+    """
+    backend = "exact"
+
+    def __init__(self, capacity=100000, memory_limit=0, path=None, max_load=0.5,
+                 overflow_error_rate=0.001):
+        self.memory_limit = memory_limit
+        self.path = path
+        self.max_load = max_load
+        self.overflow_error_rate = overflow_error_rate
+        self.saturated = False
+        self.count = 0
+        self._overflow: typing.Optional[_BloomStage] = None
+        size = 1 << max(4, int(math.ceil(math.log2(capacity / max_load))))
+        self._buffer = _Buffer(size * 8, path)
+        self._table = self._buffer.view("Q")
+        self._size = size
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state.pop("_table")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._table = self._buffer.view("Q")
+
+    @staticmethod
+    def _slot_hash(h):
+        # 0 marks an empty slot
+        return (h & _MASK) or 1
+
+    def _find(self, h):
+        """the slot of h, or the empty slot where it goes"""
+        table, mask = self._table, self._size - 1
+        i = h & mask
+        while True:
+            v = table[i]
+            if v == h or v == 0:
+                return i
+            i = (i + 1) & mask
+
+    def __contains__(self, key):
+        h = key_hash(key)
+        slot_hash = self._slot_hash(h)
+        if self._table[self._find(slot_hash)] == slot_hash:
+            return True
+        return self._overflow is not None and self._overflow.contains(h)
+
+    def add(self, key):
+        self._add(key_hash(key))
+
+    def _add(self, h) -> bool:
+        """True if h was in the set"""
+        slot_hash = self._slot_hash(h)
+        i = self._find(slot_hash)
+        if self._table[i] == slot_hash:
+            return True
+        if self.count + 1 > self._size * self.max_load:
+            if not self._resize():
+                return self._add_overflow(h)
+            i = self._find(slot_hash)
+        self._table[i] = slot_hash
+        self.count += 1
+        return False
+
+    def _add_overflow(self, h) -> bool:
+        """the table is full, the bloom filter takes the whole 128 bits"""
+        if self._overflow is None:
+            nbytes = max(self.memory_limit - self._buffer.nbytes, self._buffer.nbytes // 8)
+            capacity = max(1, int(nbytes * 8 * math.log(2) ** 2 / -math.log(self.overflow_error_rate)))
+            self._overflow = _BloomStage(capacity, self.overflow_error_rate,
+                                         self.path + ".overflow" if self.path else None)
+        if self._overflow.contains(h):
+            return True
+        self._overflow.add(h)
+        return False
+
+    def check_and_add(self, key):
+        return self._add(key_hash(key))
+
+    def _resize(self) -> bool:
+        size = self._size * 2
+        if self.memory_limit and size * 8 > self.memory_limit:
+            # the table may be filled a little more before it stops
+            if self.count + 1 <= self._size * 0.9:
+                return True
+            if not self.saturated:
+                logger.warning("url dedup set is at its memory limit, new urls go to a bloom filter")
+            self.saturated = True
+            return False
+
+        old, old_buffer = self._table, self._buffer
+        path = self.path + ".new" if self.path else None
+        self._buffer = _Buffer(size * 8, path)
+        self._table, self._size = self._buffer.view("Q"), size
+        mask = size - 1
+        table = self._table
+        for h in old:
+            if h:
+                i = h & mask
+                while table[i]:
+                    i = (i + 1) & mask
+                table[i] = h
+        old.release()
+        old_buffer.close(remove=False)
+        if self.path:
+            self._table.release()
+            self._buffer.close()
+            os.replace(path, self.path)
+            self._buffer = _Buffer.open(size * 8, self.path)
+            self._table = self._buffer.view("Q")
+        return True
+
+    def __len__(self):
+        return self.count + (self._overflow.count if self._overflow is not None else 0)
+
+    def nbytes(self):
+        return self._buffer.nbytes + (self._overflow._buffer.nbytes if self._overflow is not None else 0)
+
+    def stats(self):
+        fp_rate = self.count / 2.0 ** 64
+        if self._overflow is not None:
+            fp_rate = max(fp_rate, self._overflow.fp_rate())
+        return DedupStats(self.backend, len(self), int(self._size * self.max_load), self.nbytes(),
+                          fp_rate, 1 if self._overflow is None else 2, self.saturated)
+
+    def flush(self):
+        self._buffer.flush()
+        if self._overflow is not None:
+            self._overflow._buffer.flush()
+
+    def close(self):
+        self._table.release()
+        self._buffer.close()
+        if self._overflow is not None:
+            self._overflow._buffer.close()
+
+
+DEDUP_BACKENDS = {
+    "bloom": ScalableBloomFilter,
+    "exact": ExactHashSet,
+}
+
+
+def build_dedup_set(backend="bloom", capacity=100000, error_rate=0.0001, memory_limit=0,
+                    path=None) -> DedupSet:
+    if backend == "bloom":
+        return ScalableBloomFilter(capacity, error_rate, memory_limit, path)
+    elif backend == "exact":
+        return ExactHashSet(capacity, memory_limit, path)
+    raise ValueError("unknown dedup backend: {}, choose from {}".format(backend, list(DEDUP_BACKENDS)))
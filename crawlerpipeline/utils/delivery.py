@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Deliver the events of a crawl to slow handlers in a background thread.
+
+The queue is bounded: when the handler can not keep up, put blocks the
+dispatcher (backpressure) instead of piling up the events in memory.
+Batches of the same hook waiting in the queue are merged, a handler
+writing to a database gets one call for many pages.
+"""
+import queue
+import logging
+import threading
+
+logger = logging.getLogger("pipeline")
+
+_CLOSE = object()
+
+
+class EventDelivery(object):
+
+    def __init__(self, maxsize=64, max_merge=10000, name="event-delivery"):
+        self.maxsize = maxsize
+        # max items in one merged batch
+        self.max_merge = max_merge
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self.delivered = 0
+        self.errors = 0
+        # put calls which waited for a free slot
+        self.blocked = 0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def pending_count(self):
+        return self._queue.qsize()
+
+    @property
+    def full(self):
+        return self._queue.full()
+
+    def put(self, hook, items: list):
+        """call hook(items) in the delivery thread"""
+        if not self.put_nowait(hook, items):
+            self.blocked += 1
+            self._queue.put((hook, items))
+
+    def put_nowait(self, hook, items: list) -> bool:
+        """False if the queue is full, for a caller which must not block"""
+        if not items:
+            return True
+        try:
+            self._queue.put_nowait((hook, items))
+        except queue.Full:
+            return False
+        return True
+
+    def close(self):
+        """deliver what is left and stop the thread"""
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+
+    def _next_batches(self, first):
+        """merge the batches waiting after first, in order, per hook"""
+        batches = [first]
+        size = len(first[1])
+        while size < self.max_merge:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _CLOSE:
+                # delivered after the merged batches
+                self._queue.put(_CLOSE)
+                break
+            hook, items = item
+            if hook == batches[-1][0]:
+                batches[-1] = (hook, batches[-1][1] + items)
+            else:
+                batches.append(item)
+            size += len(items)
+        return batches
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                break
+            for hook, items in self._next_batches(item):
+                try:
+                    hook(items)
+                    self.delivered += len(items)
+                except Exception:
+                    self.errors += 1
+                    logger.exception("error in %s", getattr(hook, "__name__", hook))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import re
+import codecs
+import typing
+from html import unescape
+from html.parser import HTMLParser
+
+# attributes carrying links
+LINK_ATTRS = ("href", "src")
+
+
+class LinkExtractor(object):
+    """
+    Collect the raw href/src values of a html page.
+
+    Feed the page in chunks of bytes (or str) and close it at the end,
+    every call returns the links found since the last call.
+    """
+
+    def __init__(self, encoding=None):
+        self.encoding = encoding or "utf-8"
+
+    def feed(self, data) -> typing.List[str]:
+        raise NotImplementedError()
+
+    def close(self) -> typing.List[str]:
+        return []
+
+    def extract(self, data) -> typing.List[str]:
+        """extract links from a whole page"""
+        return self.feed(data) + self.close()
+
+
+_TAG = re.compile(rb"""<(?:(!--)|([a-zA-Z][^\s/>]*)((?:"[^"]*"|'[^']*'|[^'">])*)>)""")
+_ATTR = re.compile(rb"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+_RAWTEXT_END = {
+    b"script": re.compile(rb"</script", re.I),
+    b"style": re.compile(rb"</style", re.I),
+}
+_LINK_ATTRS = tuple(x.encode() for x in LINK_ATTRS)
+
+
+class TagScanLinkExtractor(LinkExtractor):
+    """
+    Tokenize the raw bytes with regex, only the attributes of start tags
+    are read, comments and script/style content are skipped.
+    """
+
+    def __init__(self, encoding=None):
+        LinkExtractor.__init__(self, encoding)
+        self._buf = b""
+        # inside <script>/<style> waiting for the end tag
+        self._rawtext = None
+
+    def _decode(self, value: bytes):
+        value = value.decode(self.encoding, "replace").strip()
+        if "&" in value:
+            value = unescape(value)
+        return value
+
+    def _attrs(self, attrs: bytes, out: list):
+        for m in _ATTR.finditer(attrs):
+            if m.group(1).lower() in _LINK_ATTRS:
+                value = m.group(2) or m.group(3) or m.group(4)
+                if value:
+                    out.append(self._decode(value))
+
+    def _scan(self, final):
+        buf, pos, out = self._buf, 0, []
+        while True:
+            if self._rawtext:
+                m = _RAWTEXT_END[self._rawtext].search(buf, pos)
+                if m is None:
+                    # keep the tail in case the end tag is split
+                    pos = len(buf) if final else max(pos, len(buf) - 8)
+                    break
+                self._rawtext = None
+                pos = m.end()
+
+            m = _TAG.search(buf, pos)
+            if m is None:
+                if not final:
+                    # an unfinished tag at the end of the chunk
+                    last = buf.rfind(b"<", pos)
+                    pos = last if last >= 0 else len(buf)
+                else:
+                    pos = len(buf)
+                break
+
+            if m.group(1):
+                end = buf.find(b"-->", m.end())
+                if end < 0:
+                    pos = len(buf) if final else m.start()
+                    break
+                pos = end + 3
+                continue
+
+            if m.group(3):
+                self._attrs(m.group(3), out)
+            pos = m.end()
+            name = m.group(2).lower()
+            if name in _RAWTEXT_END:
+                self._rawtext = name
+
+        self._buf = buf[pos:]
+        return out
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode(self.encoding, "replace")
+        self._buf += data
+        return self._scan(False)
+
+    def close(self):
+        return self._scan(True)
+
+
+class _LinkParser(HTMLParser):
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        for name, value in attrs:
+            if name in LINK_ATTRS and value:
+                self.links.append(value.strip())
+
+    handle_startendtag = handle_starttag
+
+
+class HTMLParserLinkExtractor(LinkExtractor):
+    """Stream the page through html.parser.HTMLParser without a tree."""
+
+    def __init__(self, encoding=None):
+        LinkExtractor.__init__(self, encoding)
+        self._decoder = codecs.getincrementaldecoder(self.encoding)("replace")
+        self._parser = _LinkParser()
+
+    def _flush(self):
+        links, self._parser.links = self._parser.links, []
+        return links
+
+    def feed(self, data):
+        if isinstance(data, bytes):
+            data = self._decoder.decode(data)
+        self._parser.feed(data)
+        return self._flush()
+
+    def close(self):
+        self._parser.feed(self._decoder.decode(b"", final=True))
+        self._parser.close()
+        return self._flush()
+
+
+class SoupLinkExtractor(LinkExtractor):
+    """The BeautifulSoup tree walking, buffers the whole page."""
+
+    def __init__(self, encoding=None):
+        LinkExtractor.__init__(self, encoding)
+        self._chunks = []
+
+    def feed(self, data):
+        if isinstance(data, str):
+            data = data.encode(self.encoding, "replace")
+        self._chunks.append(data)
+        return []
+
+    def close(self):
+        import bs4
+
+        soup = bs4.BeautifulSoup(b"".join(self._chunks), 'html.parser',
+                                 from_encoding=self.encoding)
+        self._chunks = []
+        links = []
+        for atag in soup.find_all():
+            for name in LINK_ATTRS:
+                _url = atag.attrs.get(name)
+                if _url:
+                    links.append(_url)
+        return links
+
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+# content types saying nothing about the body
+_UNKNOWN_CONTENT_TYPES = ("", "text/plain", "application/octet-stream")
+_HTML_MARKS = (b"<!doctype html", b"<html", b"<head", b"<body", b"<a ", b"<div", b"<!--")
+
+
+def content_type_is_html(content_type):
+    """True for html, False for other types, None if body must be sniffed"""
+    mime = (content_type or "").split(";", 1)[0].strip().lower()
+    if mime in HTML_CONTENT_TYPES:
+        return True
+    if mime in _UNKNOWN_CONTENT_TYPES:
+        return None
+    return False
+
+
+def sniff_html(head: bytes):
+    """guess from the first bytes of the body"""
+    if b"\0" in head:
+        return False
+    head = head[:1024].lower()
+    return any(mark in head for mark in _HTML_MARKS)
+
+
+EXTRACTORS = {
+    "fast": TagScanLinkExtractor,
+    "htmlparser": HTMLParserLinkExtractor,
+    "bs4": SoupLinkExtractor,
+}
+
+
+def get_extractor(name) -> typing.Type[LinkExtractor]:
+    if name not in EXTRACTORS:
+        raise ValueError("unknown link extractor: {}, choose from {}".format(
+            name, list(EXTRACTORS)
+        ))
+    return EXTRACTORS[name]
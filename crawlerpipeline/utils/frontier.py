@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import os
+import time
+import heapq
+import typing
+import sqlite3
+import itertools
+import threading
+from collections import Counter
+
+CRAWL_ORDERS = ("bfs", "dfs", "score")
+
+
+class FrontierRecord(typing.NamedTuple):
+    url: str
+    method: str = "GET"
+    # 0 for the start request
+    depth: int = 0
+    # row id in the persistent frontier
+    key: int = 0
+    # the lowest is popped first, FIFO for the same priority
+    priority: float = 0
+    # the page the url was found in
+    parent: str = ""
+    # fetches answered 429/503 so far, not kept in the frontier
+    retries: int = 0
+
+
+class CrawlBudget(object):
+    """Page, per domain page, depth and time limits of a crawl, 0 for no limit."""
+
+    def __init__(self, max_pages=0, max_domain_pages=0, max_depth=0, seconds=0):
+        self.max_pages = max_pages
+        self.max_domain_pages = max_domain_pages
+        self.max_depth = max_depth
+        self.seconds = seconds
+        self.pages = 0
+        self.domain_pages = Counter()
+        self._deadline = None
+
+    def start(self):
+        """the time budget counts from here"""
+        if self.seconds:
+            self._deadline = time.monotonic() + self.seconds
+
+    def out_of_time(self):
+        return self._deadline is not None and time.monotonic() > self._deadline
+
+    def admit(self, domain, depth=0) -> bool:
+        """count a page if it fits in the budget"""
+        if self.max_depth and depth > self.max_depth:
+            return False
+        if self.max_pages and self.pages >= self.max_pages:
+            return False
+        if self.max_domain_pages and self.domain_pages[domain] >= self.max_domain_pages:
+            return False
+        self.pages += 1
+        self.domain_pages[domain] += 1
+        return True
+
+
+class MemoryFrontier(object):
+    """Priority frontier, lost when the process exits."""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, record: FrontierRecord):
+        # flat entries, a record is rebuilt on pop
+        heapq.heappush(self._heap, (record.priority, next(self._seq), record.url,
+                                    record.method, record.depth, record.parent))
+
+    def pop(self) -> typing.Optional[FrontierRecord]:
+        if not self._heap:
+            return None
+        priority, _, url, method, depth, parent = heapq.heappop(self._heap)
+        return FrontierRecord(url, method, depth, 0, priority, parent)
+
+    def done(self, record: FrontierRecord):
+        pass
+
+    def clear(self):
+        self._heap.clear()
+
+    def save_state(self, name, value: bytes):
+        pass
+
+    def load_state(self, name) -> typing.Optional[bytes]:
+        return None
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteFrontier(object):
+    """
+    Priority frontier stored in sqlite.
+
+    Popped records stay in the table until ``done`` so a crash never loses
+    in-flight urls. Nothing is durable until ``commit``, which also stores
+    the blobs given to ``save_state``, so a commit is a consistent
+    checkpoint of the frontier and the crawler state.
+    """
+
+    def __init__(self, path):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS frontier ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, "
+            "method TEXT NOT NULL, depth INTEGER NOT NULL, "
+            "state INTEGER NOT NULL DEFAULT 0, "
+            "priority REAL NOT NULL DEFAULT 0, parent TEXT NOT NULL DEFAULT '')"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(frontier)")}
+        # checkpoints of the FIFO frontier
+        if "priority" not in columns:
+            self._conn.execute("ALTER TABLE frontier ADD COLUMN priority REAL NOT NULL DEFAULT 0")
+            self._conn.execute("ALTER TABLE frontier ADD COLUMN parent TEXT NOT NULL DEFAULT ''")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS frontier_order ON frontier (state, priority, id)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value BLOB)"
+        )
+        # in-flight records of a previous run are pending again
+        self._conn.execute("UPDATE frontier SET state = 0 WHERE state = 1")
+        self._conn.commit()
+        self._pending = self._conn.execute(
+            "SELECT COUNT(*) FROM frontier WHERE state = 0").fetchone()[0]
+
+    def __len__(self):
+        return self._pending
+
+    def push(self, record: FrontierRecord):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO frontier (url, method, depth, priority, parent) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (record.url, record.method, record.depth, record.priority, record.parent)
+            )
+            self._pending += 1
+
+    def pop(self) -> typing.Optional[FrontierRecord]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, url, method, depth, priority, parent FROM frontier "
+                "WHERE state = 0 ORDER BY priority, id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE frontier SET state = 1 WHERE id = ?", (row[0],))
+            self._pending -= 1
+        key, url, method, depth, priority, parent = row
+        return FrontierRecord(url, method, depth, key, priority, parent)
+
+    def done(self, record: FrontierRecord):
+        with self._lock:
+            self._conn.execute("DELETE FROM frontier WHERE id = ?", (record.key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM frontier")
+            self._conn.execute("DELETE FROM state")
+            self._conn.commit()
+            self._pending = 0
+
+    def save_state(self, name, value: bytes):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO state (name, value) VALUES (?, ?)",
+                (name, value)
+            )
+
+    def load_state(self, name) -> typing.Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def commit(self):
+        with self._lock:
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
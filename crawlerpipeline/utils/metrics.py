@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import json
+import time
+import typing
+import bisect
+import threading
+
+# seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class _Sharded(object):
+    """
+    Every thread writes its own cell so increments take no lock, the
+    readers sum the cells of all threads.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = []
+        self._lock = threading.Lock()
+
+    def _new_cell(self):
+        raise NotImplementedError()
+
+    def _cell(self) -> list:
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = self._new_cell()
+            with self._lock:
+                self._cells.append(cell)
+            return cell
+
+    def _all_cells(self):
+        with self._lock:
+            return list(self._cells)
+
+
+class Counter(_Sharded):
+
+    def _new_cell(self):
+        return [0]
+
+    def inc(self, amount=1):
+        self._cell()[0] += amount
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in self._all_cells())
+
+
+class HistogramSnapshot(typing.NamedTuple):
+    count: int
+    sum: float
+    p50: float
+    p90: float
+    p99: float
+    # upper bounds and the cumulative counts
+    buckets: typing.Tuple[typing.Tuple[float, int], ...]
+
+
+class Histogram(_Sharded):
+    """Fixed buckets, quantiles are interpolated inside a bucket."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        _Sharded.__init__(self)
+        self.bounds = tuple(buckets)
+
+    def _new_cell(self):
+        # bucket counts, +Inf, sum
+        return [0] * (len(self.bounds) + 1) + [0.0]
+
+    def observe(self, value):
+        cell = self._cell()
+        cell[bisect.bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+
+    def _quantile(self, counts, total, q):
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.bounds[i - 1] if i else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def snapshot(self) -> HistogramSnapshot:
+        counts = [0] * (len(self.bounds) + 1)
+        total_sum = 0.0
+        for cell in self._all_cells():
+            for i in range(len(counts)):
+                counts[i] += cell[i]
+            total_sum += cell[-1]
+        total = sum(counts)
+
+        cumulative, buckets = 0, []
+        for bound, count in zip(self.bounds + (float("inf"),), counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return HistogramSnapshot(
+            total, total_sum,
+            self._quantile(counts, total, 0.5),
+            self._quantile(counts, total, 0.9),
+            self._quantile(counts, total, 0.99),
+            tuple(buckets),
+        )
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in labels) + "}"
+
+
+class Metrics(object):
+    """
+    Counters, histograms and gauges of a crawl, a metric is named with
+    its labels. Gauges are functions called when taking a snapshot.
+    """
+
+    def __init__(self, prefix="crawler"):
+        self.prefix = prefix
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+        self._counters: typing.Dict[tuple, Counter] = {}
+        self._histograms: typing.Dict[tuple, Histogram] = {}
+        self._gauges: typing.Dict[str, typing.Callable] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metrics, cls, name, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        metric = metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = metrics.get(key)
+                if metric is None:
+                    metric = metrics[key] = cls(*args)
+        return metric
+
+    def counter(self, name, **labels) -> Counter:
+        return self._get(self._counters, Counter, name, labels)
+
+    def histogram(self, name, buckets=LATENCY_BUCKETS, **labels) -> Histogram:
+        return self._get(self._histograms, Histogram, name, labels, buckets)
+
+    def gauge(self, name, func):
+        self._gauges[name] = func
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.stopped_at = None
+
+    def stop(self):
+        self.stopped_at = time.monotonic()
+
+    def elapsed(self):
+        return (self.stopped_at or time.monotonic()) - self.started_at
+
+    def snapshot(self) -> dict:
+        """
+        {"elapsed": seconds,
+         "counters": {name: {labels: value}},
+         "histograms": {name: {labels: HistogramSnapshot}},
+         "gauges": {name: value}}
+
+        labels are "" or "k=v,k2=v2"
+        """
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = list(self._histograms.items())
+        result = {"elapsed": self.elapsed(), "counters": {}, "histograms": {}, "gauges": {}}
+        for (name, labels), counter in counters:
+            key = ",".join("{}={}".format(k, v) for k, v in labels)
+            result["counters"].setdefault(name, {})[key] = counter.value
+        for (name, labels), histogram in histograms:
+            key = ",".join("{}={}".format(k, v) for k, v in labels)
+            result["histograms"].setdefault(name, {})[key] = histogram.snapshot()
+        for name, func in list(self._gauges.items()):
+            result["gauges"][name] = func()
+        return result
+
+    def to_json(self) -> str:
+        snapshot = self.snapshot()
+        for name, values in snapshot["histograms"].items():
+            for key, value in values.items():
+                value = value._asdict()
+                value["buckets"] = [[str(b), c] for b, c in value["buckets"]]
+                values[key] = value
+        return json.dumps(snapshot, sort_keys=True)
+
+    def to_prometheus(self) -> str:
+        """the prometheus text exposition format"""
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append("# TYPE {} {}".format(name, kind))
+
+        for (name, labels), counter in counters:
+            name = "{}_{}".format(self.prefix, name)
+            declare(name, "counter")
+            lines.append("{}{} {}".format(name, _labels_text(labels), counter.value))
+
+        for (name, labels), histogram in histograms:
+            name = "{}_{}".format(self.prefix, name)
+            declare(name, "histogram")
+            snapshot = histogram.snapshot()
+            for bound, count in snapshot.buckets:
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append("{}_bucket{} {}".format(name, _labels_text(labels + (("le", le),)), count))
+            lines.append("{}_sum{} {}".format(name, _labels_text(labels), snapshot.sum))
+            lines.append("{}_count{} {}".format(name, _labels_text(labels), snapshot.count))
+
+        for name, func in sorted(self._gauges.items()):
+            name = "{}_{}".format(self.prefix, name)
+            declare(name, "gauge")
+            lines.append("{} {}".format(name, func()))
+        return "\n".join(lines) + "\n"
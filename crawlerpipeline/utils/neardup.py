@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+64 bit simhash fingerprints and an index answering "is there a stored
+fingerprint within hamming distance k".
+
+The index splits the fingerprint into k + 1 bands, two fingerprints within
+distance k share at least one whole band (pigeonhole), so only the entries
+with an equal band are compared. Every band table keeps its entries in
+sorted numpy arrays plus a small dict of recent inserts which is merged
+from time to time. Without numpy the tables are plain dicts.
+"""
+import re
+import typing
+import hashlib
+from array import array
+from collections import Counter
+
+# numpy is slower to import than the rest of the package, see _np
+_numpy = False
+
+BITS = 64
+_MASK = (1 << BITS) - 1
+_WORD = re.compile(r"\w+")
+_FEATURE_WIDTH = 4
+
+
+def _np():
+    """numpy imported on first use, None without it"""
+    global _numpy
+    if _numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy = numpy
+    return _numpy
+
+
+# hash of the shingles, the same 4-grams show up in nearly every url
+_feature_cache = {}
+_FEATURE_CACHE_SIZE = 1 << 16
+
+
+if hasattr(int, "bit_count"):
+    _popcount = int.bit_count
+else:
+    def _popcount(x):
+        return bin(x).count("1")
+
+
+def _feature_hash(feature: str):
+    h = _feature_cache.get(feature)
+    if h is None:
+        if len(_feature_cache) >= _FEATURE_CACHE_SIZE:
+            _feature_cache.clear()
+        h = int.from_bytes(
+            hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+        _feature_cache[feature] = h
+    return h
+
+
+def features(text: str) -> typing.List[str]:
+    text = "".join(_WORD.findall(text.lower()))
+    width = _FEATURE_WIDTH
+    return [text[i:i + width] for i in range(max(len(text) - width + 1, 1))]
+
+
+def fingerprint(text: str) -> int:
+    """simhash of the 4-char shingles of text"""
+    weights = {}
+    for f in features(text):
+        h = _feature_hash(f)
+        weights[h] = weights.get(h, 0) + 1
+    return fingerprint_hashes(weights)
+
+
+def fingerprint_hashes(weights: typing.Dict[int, int]) -> int:
+    """simhash of {feature hash: weight}"""
+    numpy = _np()
+    if numpy is not None and len(weights) > 8:
+        hashes = numpy.fromiter(weights.keys(), dtype="<u8", count=len(weights))
+        w = numpy.fromiter(weights.values(), dtype=numpy.int64, count=len(weights))
+        bits = numpy.unpackbits(hashes.view(numpy.uint8), bitorder="little")
+        bits = bits.reshape(len(weights), BITS).astype(numpy.int64) * 2 - 1
+        v = w @ bits
+        return int.from_bytes(numpy.packbits(v > 0, bitorder="little").tobytes(), "little")
+
+    v = [0] * BITS
+    for h, weight in weights.items():
+        for i in range(BITS):
+            v[i] += weight if (h >> i) & 1 else -weight
+    return sum(1 << i for i in range(BITS) if v[i] > 0)
+
+
+_MARKUP = re.compile(r"<script.*?</script>|<style.*?</style>|<!--.*?-->|<[^>]*>", re.S | re.I)
+# the blocks of the site template around the main text
+_BOILERPLATE = re.compile(r"<(nav|header|footer|aside|menu)\b.*?</\1\s*>", re.S | re.I)
+_SHINGLE = 3
+
+
+def _shingle_hash(shingle: tuple) -> int:
+    h = _feature_cache.get(shingle)
+    if h is None:
+        if len(_feature_cache) >= _FEATURE_CACHE_SIZE:
+            _feature_cache.clear()
+        h = int.from_bytes(
+            hashlib.blake2b(" ".join(shingle).encode(), digest_size=8).digest(), "little")
+        _feature_cache[shingle] = h
+    return h
+
+
+def content_shingles(body: bytes, encoding="utf-8") -> typing.List[int]:
+    """
+    hashes of the 3-word shingles of the text of a html page, out of the
+    nav, header, footer and aside blocks, words with digits are skipped
+    """
+    text = _MARKUP.sub(" ", _BOILERPLATE.sub(" ", body.decode(encoding or "utf-8", "replace")))
+    # session ids, dates and counters are left out
+    words = [word for word in _WORD.findall(text.lower()) if word.isalpha()]
+    if not words:
+        return []
+    shingles = zip(*(words[i:] for i in range(_SHINGLE))) if len(words) >= _SHINGLE else [tuple(words)]
+    return [_shingle_hash(shingle) for shingle in shingles]
+
+
+def content_fingerprint(body: bytes, encoding="utf-8", template=None) -> typing.Optional[int]:
+    """
+    simhash of the content_shingles of a html page but the template
+    ones, None if there is no text left. The hashes are stable, the
+    fingerprints of two processes can be compared.
+    """
+    return shingles_fingerprint(content_shingles(body, encoding), template)
+
+
+def shingles_fingerprint(hashes: typing.List[int], template=None) -> typing.Optional[int]:
+    """simhash of the shingle hashes not in template"""
+    if template:
+        hashes = [h for h in hashes if h not in template]
+    if not hashes:
+        return None
+    numpy = _np()
+    if numpy is None:
+        weights = {}
+        for h in hashes:
+            weights[h] = weights.get(h, 0) + 1
+        return fingerprint_hashes(weights)
+
+    # a repeated shingle counts for each time it shows up
+    hashes = numpy.fromiter(hashes, dtype="<u8", count=len(hashes))
+    bits = numpy.unpackbits(hashes.view(numpy.uint8), bitorder="little").reshape(len(hashes), BITS)
+    ones = bits.sum(axis=0, dtype=numpy.int64)
+    return int.from_bytes(numpy.packbits(ones * 2 > len(hashes), bitorder="little").tobytes(), "little")
+
+
+class TemplateShingles(object):
+    """
+    The shingles of the template of each host: the ones found in at
+    least ratio of its first pages. Learned from the first learn pages of
+    a host, then fixed.
+    """
+
+    def __init__(self, min_pages=5, learn=50, ratio=0.5):
+        self.min_pages = min_pages
+        self.learn = learn
+        self.ratio = ratio
+        # host -> [pages, Counter of shingles or None once learned, template]
+        self._hosts = {}
+
+    def observe(self, host, hashes: typing.Iterable[int]) -> typing.Optional[frozenset]:
+        """
+        add the shingles of a page of host, return the template shingles
+        or None while fewer than min_pages pages of host were seen
+        """
+        state = self._hosts.get(host)
+        if state is None:
+            state = self._hosts[host] = [0, Counter(), None]
+        counts = state[1]
+        if counts is None:
+            return state[2]
+        counts.update(set(hashes))
+        state[0] += 1
+        pages = state[0]
+        # recomputed at min_pages, at the powers of 2 and at learn
+        if pages == self.min_pages or pages >= self.learn or pages > self.min_pages and not pages & (pages - 1):
+            least = pages * self.ratio
+            state[2] = frozenset(h for h, n in counts.items() if n >= least)
+            if pages >= self.learn:
+                state[1] = None
+        return state[2]
+
+
+class _BandTable(object):
+    """band value -> fingerprints"""
+
+    def __init__(self):
+        self._delta: typing.Dict[int, array] = {}
+        self._delta_size = 0
+        self._keys = None
+        self._fps = None
+
+    def __len__(self):
+        return self._delta_size + (len(self._keys) if self._keys is not None else 0)
+
+    def candidates(self, key):
+        found = self._delta.get(key)
+        if self._keys is not None:
+            numpy = _np()
+            _key = numpy.uint64(key)
+            lo = numpy.searchsorted(self._keys, _key, "left")
+            hi = numpy.searchsorted(self._keys, _key, "right")
+            if hi > lo:
+                return found, self._fps[lo:hi]
+        return found, None
+
+    def add(self, key, fp):
+        fps = self._delta.get(key)
+        if fps is None:
+            fps = self._delta[key] = array("Q")
+        fps.append(fp)
+        self._delta_size += 1
+
+        if _np() is not None:
+            main = len(self._keys) if self._keys is not None else 0
+            if self._delta_size > max(4096, main // 8):
+                self._merge()
+
+    def _merge(self):
+        numpy = _np()
+        keys = numpy.fromiter(
+            (k for k, fps in self._delta.items() for _ in fps),
+            dtype=numpy.uint64, count=self._delta_size)
+        fps = numpy.fromiter(
+            (fp for v in self._delta.values() for fp in v),
+            dtype=numpy.uint64, count=self._delta_size)
+        if self._keys is not None:
+            keys = numpy.concatenate((self._keys, keys))
+            fps = numpy.concatenate((self._fps, fps))
+        order = numpy.argsort(keys, kind="stable")
+        self._keys, self._fps = keys[order], fps[order]
+        self._delta, self._delta_size = {}, 0
+
+    def nbytes(self):
+        size = self._delta_size * 8
+        if self._keys is not None:
+            size += self._keys.nbytes + self._fps.nbytes
+        return size
+
+
+class NearDupIndex(object):
+    """fingerprints of 64 bits, near duplicated within distance"""
+
+    def __init__(self, distance=2):
+        self.distance = distance
+        nbands = distance + 1
+        width, rest = divmod(BITS, nbands)
+        self._bands = []
+        shift = 0
+        for i in range(nbands):
+            w = width + (1 if i < rest else 0)
+            self._bands.append((shift, (1 << w) - 1))
+            shift += w
+        self._tables = [_BandTable() for _ in self._bands]
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _is_near(self, fp, cands):
+        distance = self.distance
+        numpy = _np()
+        if len(cands) < 32 or numpy is None:
+            if not isinstance(cands, array):
+                cands = cands.tolist()
+            return any(_popcount(fp ^ c) <= distance for c in cands)
+
+        if isinstance(cands, array):
+            cands = numpy.frombuffer(cands, dtype=numpy.uint64)
+        diff = numpy.bitwise_xor(cands, numpy.uint64(fp))
+        if hasattr(numpy, "bitwise_count"):
+            counts = numpy.bitwise_count(diff)
+        else:
+            counts = numpy.unpackbits(diff.view(numpy.uint8)).reshape(
+                len(diff), BITS).sum(axis=1)
+        return bool((counts <= distance).any())
+
+    def has_near_dup(self, fp: int) -> bool:
+        for (shift, mask), table in zip(self._bands, self._tables):
+            delta, main = table.candidates((fp >> shift) & mask)
+            if delta and self._is_near(fp, delta):
+                return True
+            if main is not None and self._is_near(fp, main):
+                return True
+        return False
+
+    def add(self, fp: int):
+        fp &= _MASK
+        for (shift, mask), table in zip(self._bands, self._tables):
+            table.add((fp >> shift) & mask, fp)
+        self._count += 1
+
+    def check_and_add(self, fp: int) -> bool:
+        """True if a near duplicate exists, otherwise fp is added"""
+        if self.has_near_dup(fp):
+            return True
+        self.add(fp)
+        return False
+
+    def nbytes(self):
+        """bytes of the stored fingerprints"""
+        return sum(t.nbytes() for t in self._tables)
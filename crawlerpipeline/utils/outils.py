@@ -2,17 +2,28 @@
 # coding:utf-8
 import sys
 import os
+import queue
+import atexit
 import logging
+import itertools
 from logging import StreamHandler
+from logging.handlers import QueueHandler, QueueListener
 from datetime import datetime
-import colorama
-
-colorama.init(autoreset=True)
 
 _LOGGER_NAME = 'cli'
 _LOGGER_FMT = '[%(asctime)s] [%(name)s] %(levelname)s : %(message)s'
 CLEAR_LINE = '\033[K'
 CLEAR_SCREEN = '\033[J'
+# ansi codes, what colorama.Fore and colorama.Style hold
+_RESET = '\033[0m'
+_GREEN = '\033[32m'
+_YELLOW = '\033[33m'
+_RED = '\033[31m'
+_BLUE = '\033[34m'
+_BRIGHT = '\033[1m'
+_DIM = '\033[2m'
+
+_console_ready = False
 
 _loggers = {}
 
@@ -21,28 +32,38 @@ def get_stty_size():
     return os.popen('stty size', 'r').read().split()
 
 
+def _init_console():
+    """only the windows console needs colorama to translate the codes"""
+    global _console_ready
+    if not _console_ready:
+        _console_ready = True
+        if os.name == "nt":
+            import colorama
+            colorama.init()
+
+
 def green(msg):
-    return colorama.Fore.GREEN + msg
+    return _GREEN + msg + _RESET
 
 
 def yellow(msg):
-    return colorama.Fore.YELLOW + msg
+    return _YELLOW + msg + _RESET
 
 
 def red(msg):
-    return colorama.Fore.RED + msg
+    return _RED + msg + _RESET
 
 
 def blue(msg):
-    return colorama.Fore.BLUE + msg
+    return _BLUE + msg + _RESET
 
 
 def bright(msg):
-    return colorama.Style.BRIGHT + msg
+    return _BRIGHT + msg + _RESET
 
 
 def dim(msg):
-    return colorama.Style.DIM + msg
+    return _DIM + msg + _RESET
 
 
 def _newline(msg):
@@ -50,56 +71,118 @@ def _newline(msg):
 
 
 def clear_line():
-    print("\r" + colorama.ansi.clear_line(), end="")
+    _init_console()
+    print("\r\033[2K", end="")
 
 
 def clear_screen():
-    print("\r" + colorama.ansi.clear_screen(), end="\r")
-
-
-class _FilterByLevel(logging.Filter):
-    """"""
-
-    def __init__(self, name="", needlevel=""):
-        logging.Filter.__init__(self, name)
-        self._needlevel = needlevel
-
-    def filter(self, record):
-        return record.levelno == self._needlevel
+    _init_console()
+    print("\r\033[2J", end="\r")
 
 
-def _set_logger(logger: logging.Logger):
+class ColorFormatter(logging.Formatter):
+    """one formatter for every level, the color is picked per record"""
     level2color = {
         logging.DEBUG: blue,
         logging.INFO: green,
         logging.WARN: yellow,
         logging.ERROR: red,
         logging.CRITICAL: [bright, red],
-        logging.FATAL: [bright, red],
     }
 
-    def _set(level, handler):
-        msg = _LOGGER_FMT
+    def __init__(self, fmt=_LOGGER_FMT, color=True):
+        logging.Formatter.__init__(self, fmt)
+        self.color = color
+
+    def format(self, record):
+        msg = logging.Formatter.format(self, record)
+        if not self.color:
+            return msg
+        handler = self.level2color.get(record.levelno)
         if callable(handler):
             msg = handler(msg)
         elif isinstance(handler, (tuple, list)):
             for _subhandler in handler:
                 msg = _subhandler(msg)
-        fmt = logging.Formatter(msg)
-        stdouthandler = logging.StreamHandler(sys.stdout)
-        stdouthandler.setLevel(level)
-        stdouthandler.setFormatter(fmt)
-        stdouthandler.addFilter(
-            _FilterByLevel(needlevel=level)
-        )
-        return stdouthandler
-
-    handlers = [_set(level, handler)
-                for (level, handler) in level2color.items()]
-    [logger.addHandler(hdlr) for hdlr in handlers]
+        return msg
+
+
+def _set_logger(logger: logging.Logger):
+    _init_console()
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(ColorFormatter(color=sys.stdout.isatty()))
+    logger.addHandler(handler)
     return logger
 
 
+class _QueueHandler(QueueHandler):
+    """
+    Leave the formatting to the listener thread. The arguments of a
+    record must not change after the call.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+# logger name -> QueueListener
+_listeners = {}
+
+
+def use_queue_handler(logger: logging.Logger) -> QueueListener:
+    """
+    Move the handlers of logger to a thread behind a queue, the calling
+    thread only puts the record. Once per logger, the listener is stopped
+    (and the queue written) at exit.
+    """
+    if logger.name not in _listeners:
+        handlers = list(logger.handlers)
+        for handler in handlers:
+            logger.removeHandler(handler)
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        logger.addHandler(_QueueHandler(log_queue))
+        if not _listeners:
+            atexit.register(_stop_listeners)
+        _listeners[logger.name] = listener
+    return _listeners[logger.name]
+
+
+def _stop_listeners():
+    while _listeners:
+        _listeners.popitem()[1].stop()
+
+
+def _after_fork():
+    # no listener thread in the child, write from the calling thread again
+    for name, listener in _listeners.items():
+        logger = logging.getLogger(name)
+        for handler in list(logger.handlers):
+            if isinstance(handler, _QueueHandler):
+                logger.removeHandler(handler)
+        for handler in listener.handlers:
+            logger.addHandler(handler)
+    _listeners.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class SampledLog(object):
+    """debug records of one call in every, when debug is enabled"""
+
+    def __init__(self, logger: logging.Logger, every=1):
+        self.logger = logger
+        self.every = max(1, every)
+        self._calls = itertools.count()
+
+    def __call__(self, msg, *args):
+        if self.logger.isEnabledFor(logging.DEBUG) and next(self._calls) % self.every == 0:
+            self.logger.debug(msg, *args)
+
+
 def println(msg="", *vargs, **kwargs):
     print(_newline(msg))
 
@@ -136,6 +219,7 @@ def __test():
 
     logger = get_logger()
     logger.setLevel(logging.DEBUG)
+    use_queue_handler(logger)
     logger.debug("test")
     logger.info("test")
     logger.warn("test")
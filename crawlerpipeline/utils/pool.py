@@ -1,25 +1,37 @@
 #!/usr/bin/env python3
-import uuid
-import unittest
 import time
+import typing
+import itertools
+import logging
+import unittest
 import traceback
-from threading import Thread, Event
+from threading import Thread, Event, Condition, Lock
 from queue import Queue, Empty
+from collections import deque
+
+logger = logging.getLogger("pipeline")
+
+# ids of the tasks and names of the labors, cheaper than uuid4
+_task_ids = itertools.count(1)
+_labor_ids = itertools.count(1)
 
 
 class _Task(object):
+    # one per queued url, no __dict__
+    __slots__ = ("_id", "func", "args", "kwargs")
 
     def __init__(self, func, args: list, kwargs: dict, id=None):
         if not callable(func):
             raise Exception("func: {} is not callable".format(func))
 
-        self._id = id if id else uuid.uuid4().hex
+        self._id = id if id else next(_task_ids)
         self.func = func
         self.args = args
         self.kwargs = kwargs
 
 
 class _Result(object):
+    __slots__ = ("task", "result", "traceback")
 
     def __init__(self, task, result=None, traceback=None):
         self.task = task
@@ -27,16 +39,30 @@ class _Result(object):
         self.traceback = traceback
 
 
-class _Labor(Thread):
+# put into task queue to let a labor exit
+_STOP = object()
+
 
-    def __init__(self, taskq, resultq, name=None):
+class _Labor(Thread):
+    """
+    A worker thread. The pool builds it with (taskq, resultq, name), as
+    subclasses given as Pool(_laborcls=...) expect, then sets the hooks
+    on_task_done, on_idle and idle_timeout before starting it.
+    """
+
+    def __init__(self, taskq, resultq, name=None, on_task_done=None,
+                 on_idle=None, idle_timeout=None):
         self.taskq = taskq
         self.resultq = resultq
-        name = name if name else "_labor-{}".format(uuid.uuid4())
+        name = name if name else "_labor-{}".format(next(_labor_ids))
         Thread.__init__(self, name=name)
         self.daemon = True
         self.labor_is_working = False
         self.is_executing_task = Event()
+        self.on_task_done = on_task_done
+        # called after idle_timeout seconds without a task, exit if it returns True
+        self.on_idle = on_idle
+        self.idle_timeout = idle_timeout
 
     def run(self):
         self.labor_is_working = True
@@ -49,10 +75,16 @@ class _Labor(Thread):
     def _run(self):
         while self.labor_is_working:
             try:
-                _task = self.taskq.get(timeout=1)
-                self.is_executing_task.set()
+                _task = self.taskq.get(timeout=self.idle_timeout)
             except Empty:
+                if self.on_idle(self):
+                    self.labor_is_working = False
                 continue
+            if _task is _STOP:
+                self.labor_is_working = False
+                break
+            self.is_executing_task.set()
+            started, cpu = time.monotonic(), time.thread_time()
 
             try:
                 # assert isinstance(_task, _Task)
@@ -69,89 +101,199 @@ class _Labor(Thread):
                 _task, result, trackinfo
             ))
             self.is_executing_task.clear()
+            if self.on_task_done:
+                self.on_task_done(time.monotonic() - started, time.thread_time() - cpu)
 
     def prepare_stop(self):
         self.labor_is_working = False
+        self.taskq.put(_STOP)
 
     def stop(self):
         self.join()
 
 
-class Pool(object):
+class ScalingDecision(typing.NamedTuple):
+    # unix time
+    at: float
+    # grow or retire
+    action: str
+    # workers after the decision
+    size: int
+    queued: int
+    busy: int
+    # part of the task time not spent on the cpu, in the last interval
+    io_ratio: float
+    # cpu seconds of the tasks for each second, the GIL caps it at 1
+    cpu_load: float
 
-    def __init__(self, size=20, _laborcls=_Labor, *args, **kwargs):
-        self.size = size
-        self.mainthread = Thread(name="pool-main", target=self._main)
-        self.mainthread.daemon = True
+
+class Pool(object):
+    """
+    size threads, or an elastic pool with max_size: every scale_interval
+    the pool grows (at most doubling) while tasks are queued, every worker
+    is busy and the tasks mostly wait on I/O. Threads do not help tasks
+    which hold the GIL, the pool does not grow when they use more than
+    max_cpu_load of a cpu. Workers idle for idle_timeout seconds exit
+    down to min_size.
+    """
+
+    def __init__(self, size=20, _laborcls=_Labor, min_size=None, max_size=None,
+                 scale_interval=0.5, idle_timeout=10.0, io_ratio=0.5, max_cpu_load=0.9):
+        self.elastic = max_size is not None
+        self.max_size = max_size if self.elastic else size
+        self.min_size = min(min_size or 1, self.max_size) if self.elastic else size
+        self.size = max(self.min_size, min(size, self.max_size))
+        self.scale_interval = scale_interval
+        self.idle_timeout = idle_timeout
+        self.min_io_ratio = io_ratio
+        self.max_cpu_load = max_cpu_load
         self._threads = {}
         self._working = False
-        self._dispatcher_queue = Queue()
         self.task_queue = Queue()
         self.result_queue = Queue()
         self._laborcls = _laborcls
 
-    def start(self):
-        [self._new_labor() for _ in range(self.size)]
-        self.mainthread.start()
+        # count of tasks which are executed but not finished
+        self._outstanding = 0
+        self._finished_cond = Condition()
+
+        # threads and task times of the current interval
+        self._lock = Lock()
+        self._wall = 0.0
+        self._cpu = 0.0
+        self._window_start = time.monotonic()
+        self.io_ratio = 1.0
+        self.cpu_load = 0.0
+        self._decisions = deque(maxlen=256)
+        self._scaler_stop = Event()
+        self._scaler = None
 
-    def _main(self):
+    def start(self):
         self._working = True
-        while self._working:
-            try:
-                _ret = self._dispatcher_queue.get(timeout=1)
-                if isinstance(_ret, _Task):
-                    self.task_queue.put(_ret, block=False)
-                elif isinstance(_ret, _Result):
-                    self.result_queue.put(_ret, block=False)
-            except Empty:
-                pass
+        [self._new_labor() for _ in range(self.size)]
+        if self.elastic:
+            self._scaler_stop.clear()
+            self._scaler = Thread(target=self._autoscale, name="pool-scaler", daemon=True)
+            self._scaler.start()
 
     def execute(self, func, args=(), kwargs={}, id=None):
         _t = _Task(func, args, kwargs, id)
-        self._dispatcher_queue.put(_t)
+        with self._finished_cond:
+            self._outstanding += 1
+        self.task_queue.put(_t)
+
+    def _on_task_done(self, wall=0.0, cpu=0.0):
+        with self._lock:
+            self._wall += wall
+            self._cpu += cpu
+        with self._finished_cond:
+            self._outstanding -= 1
+            if self._outstanding <= 0:
+                self._finished_cond.notify_all()
 
     def stop(self):
         self._working = False
-        self.mainthread.join()
-        [i.prepare_stop() for i in self._threads.values()]
-        [i.stop() for i in self._threads.values()]
+        self._scaler_stop.set()
+        if self._scaler is not None:
+            self._scaler.join()
+        with self._lock:
+            labors = list(self._threads.values())
+        [i.prepare_stop() for i in labors]
+        [i.stop() for i in labors]
 
     def _new_labor(self):
-        lname = uuid.uuid4()
-        labor = self._laborcls(self.task_queue, self.result_queue, lname)
+        labor = self._laborcls(self.task_queue, self.result_queue, None)
+        labor.on_task_done = self._on_task_done
+        labor.on_idle = self._on_idle
+        labor.idle_timeout = self.idle_timeout if self.elastic else None
         labor.daemon = True
-        self._threads[lname] = labor
+        with self._lock:
+            self._threads[labor.name] = labor
         labor.start()
 
+    def _on_idle(self, labor) -> bool:
+        with self._lock:
+            if not self._working or len(self._threads) <= self.min_size:
+                return False
+            del self._threads[labor.name]
+            size = len(self._threads)
+        self._decide("retire", size, "idle for {}s".format(self.idle_timeout))
+        return True
+
+    def _autoscale(self):
+        while not self._scaler_stop.wait(self.scale_interval):
+            self._scale()
+
+    def _scale(self):
+        with self._lock:
+            wall, cpu = self._wall, self._cpu
+            self._wall = self._cpu = 0.0
+            now = time.monotonic()
+            interval, self._window_start = now - self._window_start, now
+            size = len(self._threads)
+        # nothing finished yet: a crawler is waiting on the network
+        if wall > 0:
+            self.io_ratio = max(0.0, 1 - cpu / wall)
+        self.cpu_load = cpu / interval if interval > 0 else 0.0
+
+        queued = self.task_queue.qsize()
+        if not queued or size >= self.max_size or self.busy_count < size:
+            return
+        if self.io_ratio < self.min_io_ratio or self.cpu_load > self.max_cpu_load:
+            return
+        add = min(queued, self.max_size - size, size)
+        for _ in range(add):
+            self._new_labor()
+        self._decide("grow", size + add, "{} tasks queued".format(queued))
+
+    def _decide(self, action, size, reason):
+        decision = ScalingDecision(time.time(), action, size, self.task_queue.qsize(),
+                                   self.busy_count, self.io_ratio, self.cpu_load)
+        self._decisions.append(decision)
+        logger.debug("pool %s to %s workers: %s, io ratio %.2f, cpu load %.2f",
+                     action, size, reason, decision.io_ratio, decision.cpu_load)
+
+    def scaling_decisions(self) -> typing.List[ScalingDecision]:
+        """the last 256 decisions, oldest first"""
+        return list(self._decisions)
+
+    @property
+    def worker_count(self):
+        """"""
+        return len(self._threads)
+
+    @property
+    def busy_count(self):
+        """workers running a task"""
+        with self._lock:
+            labors = list(self._threads.values())
+        return sum(1 for labor in labors if labor.is_executing_task.is_set())
+
     def is_working(self):
         return self._working
 
+    @property
+    def outstanding_count(self):
+        """tasks executed but not finished yet"""
+        return self._outstanding
+
     def all_is_idle(self):
-        threads = [labor for labor in self._threads.values(
-        ) if labor.is_executing_task.is_set()]
-        if threads:
-            return False
-        else:
-            return True
+        return self.busy_count == 0
 
     def all_is_finished(self):
         """"""
-        return self.task_queue.empty() and self._dispatcher_queue.empty() \
-            and self.result_queue.empty() and self.all_is_idle()
+        return self._outstanding <= 0 and self.result_queue.empty()
 
-    def wait_until_all_is_finished(self):
-        """"""
-        count = 0
-        while True:
-            if self.all_is_finished():
-                count += 1
-            else:
-                count = 0
-
-            if count > 2:
-                break
-            else:
-                time.sleep(1)
+    def wait_until_all_is_finished(self, timeout=None):
+        """
+        Block until every executed task is finished.
+
+        :return: False if timeout
+        """
+        with self._finished_cond:
+            return self._finished_cond.wait_for(
+                lambda: self._outstanding <= 0, timeout=timeout
+            )
 
 
 def test(a, b, c):
@@ -178,8 +320,62 @@ class PoolTester(unittest.TestCase):
         pool.execute(test, (1, 2), {"c": "123123123"})
         pool.execute(test, (1, 2), {"c": "123123123"})
 
+        self.assertTrue(pool.wait_until_all_is_finished(timeout=5))
+        self.assertEqual(pool.result_queue.qsize(), 11)
+        pool.stop()
+
+    def test_elastic_pool(self):
+        """"""
+        pool = Pool(size=1, min_size=1, max_size=8, scale_interval=0.05, idle_timeout=0.3)
+        pool.start()
+        for _ in range(100):
+            pool.execute(time.sleep, (0.02,))
+        self.assertTrue(pool.wait_until_all_is_finished(timeout=10))
+        self.assertGreater(max(d.size for d in pool.scaling_decisions()), 4)
+        self.assertLessEqual(pool.worker_count, 8)
+
+        # back to min_size
+        deadline = time.monotonic() + 5
+        while pool.worker_count > 1 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(pool.worker_count, 1)
+        self.assertEqual(pool.scaling_decisions()[-1].action, "retire")
+        pool.stop()
+
+    def test_cpu_bound(self):
+        """"""
+
+        def spin(seconds):
+            end = time.thread_time() + seconds
+            while time.thread_time() < end:
+                pass
+
+        pool = Pool(size=1, min_size=1, max_size=8, scale_interval=0.05)
+        pool.start()
+        for _ in range(30):
+            pool.execute(spin, (0.01,))
+        self.assertTrue(pool.wait_until_all_is_finished(timeout=10))
+        # more threads would only wait for the GIL
+        self.assertEqual(pool.worker_count, 1)
         pool.stop()
 
+    def test_laborcls(self):
+        """"""
+
+        class OldLabor(_Labor):
+
+            def __init__(self, taskq, resultq, name=None):
+                _Labor.__init__(self, taskq, resultq, name)
+
+        for max_size in (None, 4):
+            pool = Pool(size=2, _laborcls=OldLabor, max_size=max_size, scale_interval=0.05)
+            pool.start()
+            for _ in range(20):
+                pool.execute(time.sleep, (0.01,))
+            self.assertTrue(pool.wait_until_all_is_finished(timeout=5))
+            self.assertEqual(pool.result_queue.qsize(), 20)
+            pool.stop()
+
 
 if __name__ == '__main__':
     unittest.main()
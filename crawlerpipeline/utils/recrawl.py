@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Validators and links of the pages of a previous crawl, for a rescan of
+the same site.
+
+A page with an ETag or a Last-Modified is requested with If-None-Match /
+If-Modified-Since, a 304 reuses the links of the cache. A page with the
+same content hash is not parsed again.
+"""
+import os
+import time
+import zlib
+import typing
+import sqlite3
+import threading
+from hashlib import blake2b
+
+
+class CacheEntry(typing.NamedTuple):
+    etag: str
+    last_modified: str
+    # content_hash of the body
+    content_hash: str
+    links: typing.List[str]
+    stored_at: float
+
+    @property
+    def validators(self) -> typing.Dict[str, str]:
+        """headers of a conditional request"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def content_hasher():
+    return blake2b(digest_size=16)
+
+
+class RecrawlCache(object):
+    """
+    Entries keyed by the normalized url in sqlite, shared by the worker
+    threads. Entries older than max_age seconds are dropped, then the
+    oldest ones until the cache is under max_size bytes.
+    """
+
+    def __init__(self, path, max_age=0, max_size=0, commit_every=200):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.max_age = max_age
+        self.max_size = max_size
+        self.commit_every = commit_every
+        # pages validated unchanged (a 304 or the same content hash)
+        self.hits = 0
+        # lookups without a valid entry
+        self.misses = 0
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "url TEXT PRIMARY KEY, etag TEXT NOT NULL, last_modified TEXT NOT NULL, "
+            "content_hash TEXT NOT NULL, links BLOB NOT NULL, stored_at REAL NOT NULL, "
+            "size INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_age ON entries (stored_at)")
+        self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def get(self, url) -> typing.Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_hash, links, stored_at FROM entries WHERE url = ?",
+                (url,)
+            ).fetchone()
+            if row is None or (self.max_age and row[4] < time.time() - self.max_age):
+                self.misses += 1
+                return None
+        links = zlib.decompress(row[3]).decode().split("\n") if row[3] else []
+        return CacheEntry(row[0], row[1], row[2], links, row[4])
+
+    def put(self, url, etag, last_modified, content_hash, links: typing.List[str]):
+        blob = zlib.compress("\n".join(links).encode()) if links else b""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag or "", last_modified or "", content_hash, blob, time.time(),
+                 len(url) + len(blob) + 64)
+            )
+            self._committed()
+
+    def touch(self, url):
+        """the page is still valid"""
+        with self._lock:
+            self.hits += 1
+            self._conn.execute("UPDATE entries SET stored_at = ? WHERE url = ?", (time.time(), url))
+            self._committed()
+
+    def _committed(self):
+        self._uncommitted += 1
+        if self._uncommitted >= self.commit_every:
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def evict(self) -> int:
+        """remove the expired entries, then the oldest over max_size"""
+        with self._lock:
+            removed = 0
+            if self.max_age:
+                removed += self._conn.execute(
+                    "DELETE FROM entries WHERE stored_at < ?", (time.time() - self.max_age,)).rowcount
+            if self.max_size:
+                row = self._conn.execute(
+                    "SELECT stored_at FROM (SELECT stored_at, SUM(size) OVER "
+                    "(ORDER BY stored_at DESC, url) AS total FROM entries) "
+                    "WHERE total > ? ORDER BY stored_at DESC LIMIT 1", (self.max_size,)
+                ).fetchone()
+                if row is not None:
+                    removed += self._conn.execute(
+                        "DELETE FROM entries WHERE stored_at <= ?", (row[0],)).rowcount
+            self._conn.commit()
+            self._uncommitted = 0
+            return removed
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
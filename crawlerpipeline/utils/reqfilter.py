@@ -1,15 +1,14 @@
 #!/usr/bin/env python3
 import os
-import simhash
-import bloom_filter
-import uuid
 from urllib.parse import urlparse, urlunparse
+from . import neardup, dedup
+from .urlinfo import URLInfo
 
 
 class RequestFilter(object):
-    def __init__(self, cap=100000, error_rate=0.0001):
-        self.bfilter = bloom_filter.BloomFilter(
-            max_elements=cap, error_rate=error_rate)
+    def __init__(self, cap=100000, error_rate=0.0001, bfilter=None):
+        # grows past cap instead of losing precision
+        self.bfilter = bfilter if bfilter is not None else dedup.ScalableBloomFilter(cap, error_rate)
 
     def _concat_url(self, url, method="GET", **kwargs):
         kwargs['method'] = method
@@ -36,8 +35,8 @@ class FakeStaticPathFilter(object):
         self.distance = distance
         self.filter_dothtml = filter_dothtml
         self.ignore_param_value = ignore_param_value
-        self._simindex = simhash.SimhashIndex([], k=distance)
-        self.bfilter = bloom_filter.BloomFilter() if not bloomfilter else bloom_filter
+        self._simindex = neardup.NearDupIndex(distance)
+        self.bfilter = bloomfilter if bloomfilter is not None else dedup.ScalableBloomFilter()
 
     def _prehandle_path(self, path):
         if "/" not in path:
@@ -71,12 +70,15 @@ class FakeStaticPathFilter(object):
         else:
             return filename
 
-    def _concat_url(self, url, path, **kwargs):
-        parseresult = urlparse(url)
-        if "&" in parseresult.query:
-            allquery = sorted(iter(parseresult.query.split("&")))
+    def path_template(self, path):
+        """canonical path, fake static paths share one template"""
+        return self._prehandle_path(path or "/")
+
+    def query_template(self, query):
+        if "&" in query:
+            allquery = sorted(iter(query.split("&")))
             if not self.ignore_param_value:
-                query = "&".join(allquery)
+                return "&".join(allquery)
             else:
                 _ret = []
                 for e in allquery:
@@ -85,21 +87,23 @@ class FakeStaticPathFilter(object):
                     except ValueError:
                         _i = None
                     _ret.append(e[:_i])
-                query = "&".join(_ret)
+                return "&".join(_ret)
         else:
             if not self.ignore_param_value:
-                query = parseresult.query
+                return query
             else:
-                if "=" in parseresult.query:
-                    query = parseresult.query.split("=")[0]
+                if "=" in query:
+                    return query.split("=")[0]
                 else:
-                    query = parseresult.query
+                    return query
+
+    def _concat(self, scheme, netloc, path, query, **kwargs):
         kwargs['query'] = query
         items_str = "".join([f"{key}:{value}" for (key, value) in sorted(iter(kwargs.items()))])
         # ParseResult(scheme, netloc, url, params, query, fragment)
         url = urlunparse([
-            parseresult.scheme,
-            parseresult.netloc,
+            scheme,
+            netloc,
             path,
             "",  # parseresult.params,
             "",  # parseresult.query,
@@ -107,12 +111,21 @@ class FakeStaticPathFilter(object):
         ])
         return f"{items_str}@{url}"
 
+    def _concat_url(self, url, path, **kwargs):
+        parseresult = urlparse(url)
+        return self._concat(parseresult.scheme, parseresult.netloc, path,
+                            self.query_template(parseresult.query), **kwargs)
+
+    def _final_url(self, url, **kwargs):
+        """url is a str or an URLInfo parsed with our templates"""
+        if isinstance(url, URLInfo):
+            return self._concat(url.scheme, url.netloc, url.path_template,
+                                url.query_template, **kwargs)
+
+        return self._concat_url(url, self.path_template(urlparse(url).path), **kwargs)
+
     def add_url(self, url, **kwargs):
-        _path = urlparse(url).path
-        if not _path:
-            _path = "/"
-        _path = self._prehandle_path(_path)
-        _final = self._concat_url(url, _path, **kwargs)
+        _final = self._final_url(url, **kwargs)
 
         if _final in self.bfilter:
             return
@@ -120,27 +133,35 @@ class FakeStaticPathFilter(object):
             self.bfilter.add(_final)
 
         if self.distance:
-            _shash = simhash.Simhash(_final)
-            result = self._simindex.get_near_dups(_shash)
-            if not result:
-                self._simindex.add(uuid.uuid4(), _shash)
+            self._simindex.check_and_add(neardup.fingerprint(_final))
 
     def url_is_duplicate(self, url, **kwargs):
-        path = urlparse(url).path
-        if not path:
-            path = "/"
-        _path = self._prehandle_path(path)
-        _final = self._concat_url(url, _path, **kwargs)
+        _final = self._final_url(url, **kwargs)
 
         if _final not in self.bfilter:
             if not self.distance:
                 return False
             else:
-                shash = simhash.Simhash(_final)
-                result = self._simindex.get_near_dups(shash)
-                if not result:
-                    return False
-                else:
-                    return True
+                return self._simindex.has_near_dup(neardup.fingerprint(_final))
         else:
             return True
+
+    def check_and_add(self, url, **kwargs):
+        """
+        url_is_duplicate and add_url in one pass.
+
+        :return: True if the url is duplicated, otherwise it is added.
+        """
+        _final = self._final_url(url, **kwargs)
+
+        if _final in self.bfilter:
+            return True
+        if self.distance and self._simindex.check_and_add(neardup.fingerprint(_final)):
+            return True
+        self.bfilter.add(_final)
+        return False
+
+    def stats(self) -> dedup.DedupStats:
+        """of the url set, None for a bloomfilter without stats"""
+        stats = getattr(self.bfilter, "stats", None)
+        return stats() if stats else None
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+import time
+import datetime
+import email.utils
+import heapq
+import typing
+import itertools
+from collections import deque
+from threading import Thread, Condition
+
+# status codes meaning the host asks us to slow down
+SLOWDOWN_STATUS = (429, 503)
+# latencies kept per host, the baseline is their 10th percentile
+LATENCY_WINDOW = 20
+
+
+def parse_retry_after(value) -> typing.Optional[float]:
+    """seconds of a Retry-After header, delay-seconds or an HTTP-date"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        # an HTTP-date is always GMT
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, date.timestamp() - time.time())
+
+
+class _TokenBucket(object):
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(float(burst), 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """seconds to wait until a token is available, 0 for now"""
+        if self.rate <= 0:
+            return 0
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        if self.rate <= 0:
+            return
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _HostState(object):
+
+    def __init__(self, limit, rate, burst):
+        # (priority, seq, item), the lowest priority first
+        self.queue = []
+        self.running = 0
+        self.limit = limit
+        self.bucket = _TokenBucket(rate, burst)
+        self.backoff_until = 0
+        self.slowdowns = 0
+        self.successes = 0
+        self.latency = None
+        # recent latencies, the baseline is taken from them
+        self.samples = deque(maxlen=LATENCY_WINDOW)
+
+    def wait_time(self, now):
+        return max(self.backoff_until - now, self.bucket.wait_time(now))
+
+
+class HostStats(typing.NamedTuple):
+    queued: int
+    running: int
+    limit: int
+    latency: float
+    slowdowns: int
+
+
+class HostScheduler(object):
+    """
+    Politeness layer between the dispatcher and the worker pool.
+
+    Items are queued per host, the lowest priority first and FIFO for the
+    same priority, and handed to ``submit(host, item)`` in round-robin
+    order across hosts, never exceeding ``max_in_flight`` in
+    total nor the per host concurrency limit and rate limit, 0 for no
+    per host limit. Call ``task_done`` when a submitted item finished,
+    a 429/503 response backs the host off for its Retry-After (or
+    exponentially), the items put back meanwhile wait for it. With
+    ``adaptive`` the per host limit is adapted from latency and halved on
+    429/503 responses.
+    """
+
+    def __init__(self, submit, max_in_flight=20, host_concurrency=0,
+                 host_rate=0, host_burst=1, adaptive=False, max_backoff=60):
+        self.submit = submit
+        self.max_in_flight = max_in_flight
+        self.host_concurrency = host_concurrency or max_in_flight
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.adaptive = adaptive
+        self.max_backoff = max_backoff
+
+        self._hosts: typing.Dict[str, _HostState] = {}
+        # round-robin order of hosts having queued items
+        self._ready = deque()
+        self._in_flight = 0
+        self._queued = 0
+        self._seq = itertools.count()
+        self._cond = Condition()
+        self._working = False
+        self._thread = Thread(name="host-scheduler", target=self._main)
+        self._thread.daemon = True
+
+    def start(self):
+        self._working = True
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._working = False
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    @property
+    def pending_count(self):
+        """queued items not submitted yet"""
+        return self._queued
+
+    @property
+    def in_flight_count(self):
+        """submitted items not done yet"""
+        return self._in_flight
+
+    def drain(self) -> list:
+        """remove the queued items not submitted yet"""
+        with self._cond:
+            items = []
+            for state in self._hosts.values():
+                items.extend(item for _, _, item in sorted(state.queue))
+                state.queue.clear()
+            self._ready.clear()
+            self._queued = 0
+            return items
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = _HostState(self.host_concurrency, self.host_rate, self.host_burst)
+            self._hosts[host] = state
+        return state
+
+    def put(self, host, item, priority=0):
+        with self._cond:
+            state = self._host(host)
+            if not state.queue:
+                self._ready.append(host)
+            heapq.heappush(state.queue, (priority, next(self._seq), item))
+            self._queued += 1
+            self._cond.notify_all()
+
+    def task_done(self, host, status_code=None, latency=None, retry_after=None):
+        with self._cond:
+            state = self._host(host)
+            state.running -= 1
+            self._in_flight -= 1
+            if status_code in SLOWDOWN_STATUS:
+                self._back_off(state, retry_after)
+            elif self.adaptive:
+                self._adapt(state, latency)
+            self._cond.notify_all()
+
+    def _back_off(self, state: _HostState, retry_after):
+        state.slowdowns += 1
+        if self.adaptive:
+            # multiplicative decrease
+            state.successes = 0
+            state.limit = max(1, state.limit // 2)
+        if retry_after is None:
+            retry_after = min(2 ** state.slowdowns, self.max_backoff)
+        state.backoff_until = time.monotonic() + min(retry_after, self.max_backoff)
+
+    def _adapt(self, state: _HostState, latency):
+        if latency is None:
+            return
+        state.latency = latency if state.latency is None else state.latency * 0.8 + latency * 0.2
+        state.samples.append(latency)
+        if len(state.samples) < LATENCY_WINDOW // 2:
+            return
+
+        # a low percentile of the recent latencies, one fast outlier does
+        # not pin the baseline and an old one leaves the window
+        baseline = sorted(state.samples)[len(state.samples) // 10]
+        if state.latency > baseline * 4:
+            # the host is getting slower with more connections
+            state.limit = max(1, state.limit - 1)
+            state.successes = 0
+        else:
+            # additive increase
+            state.successes += 1
+            if state.successes >= state.limit and state.limit < self.host_concurrency:
+                state.limit += 1
+                state.successes = 0
+
+    def _pick(self, now):
+        """
+        Pick the items can be submitted now.
+
+        :return: (items, seconds to wait for the next rate limited item)
+        """
+        picked = []
+        wait = None
+        for _ in range(len(self._ready)):
+            if self._in_flight >= self.max_in_flight:
+                break
+
+            host = self._ready.popleft()
+            state = self._hosts[host]
+            if state.running >= state.limit:
+                self._ready.append(host)
+                continue
+
+            delay = state.wait_time(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+                self._ready.append(host)
+                continue
+
+            state.bucket.consume(now)
+            state.running += 1
+            self._in_flight += 1
+            self._queued -= 1
+            picked.append((host, heapq.heappop(state.queue)[2]))
+            if state.queue:
+                self._ready.append(host)
+        return picked, wait
+
+    def _main(self):
+        while True:
+            with self._cond:
+                if not self._working:
+                    break
+                picked, wait = self._pick(time.monotonic())
+                if not picked:
+                    self._cond.wait(timeout=wait)
+                    continue
+
+            for host, item in picked:
+                self.submit(host, item)
+
+    def stats(self) -> typing.Dict[str, HostStats]:
+        with self._cond:
+            return {
+                host: HostStats(len(s.queue), s.running, s.limit,
+                                s.latency, s.slowdowns)
+                for host, s in self._hosts.items()
+            }
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Write the fetched responses to disk: gzip JSON lines, WARC or SQLite.
+
+The dispatcher hands SinkRecords to a SinkWriter, a thread writes them
+in batches. The records waiting for the writer never take more than
+max_buffer bytes, put blocks until the writer catches up.
+"""
+import os
+import gzip
+import json
+import time
+import uuid
+import base64
+import typing
+import sqlite3
+import logging
+import datetime
+import threading
+from collections import deque
+
+logger = logging.getLogger("pipeline")
+
+
+class SinkRecord(typing.NamedTuple):
+    url: str
+    method: str
+    # None if the request failed
+    status: typing.Optional[int]
+    reason: str
+    headers: typing.Dict[str, str]
+    # seconds until the headers
+    elapsed: float
+    # unix time
+    fetched_at: float
+    depth: int
+    parent: str
+    # None unless sink_body, at most max_body_size
+    body: typing.Optional[bytes] = None
+    # why body is incomplete, a WARC-Truncated reason: "length" or
+    # "disconnect", "" for a complete body
+    truncated: str = ""
+
+    @property
+    def size(self):
+        """about the bytes of memory"""
+        return 512 + len(self.url) + len(self.parent) + (len(self.body) if self.body else 0) + \
+            sum(len(k) + len(v) for k, v in self.headers.items())
+
+
+class Sink(object):
+    """write_batch and close are only called from the writer thread"""
+
+    def write_batch(self, records: typing.List[SinkRecord]):
+        raise NotImplementedError()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _RotatingSink(Sink):
+    """files in a directory, a new one every rotate_size bytes"""
+    suffix = ""
+
+    def __init__(self, path, rotate_size=0, prefix="crawl"):
+        self.path = path
+        self.rotate_size = rotate_size
+        self.prefix = prefix
+        self.files = []
+        self._raw = None
+        self._seq = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _open(self):
+        name = "{}-{}-{:05d}{}".format(
+            self.prefix, time.strftime("%Y%m%d%H%M%S"), self._seq, self.suffix)
+        self._seq += 1
+        filename = os.path.join(self.path, name)
+        self.files.append(filename)
+        self._raw = open(filename, "wb")
+
+    def _file(self):
+        if self._raw is not None and self.rotate_size and self._size() >= self.rotate_size:
+            self._close_file()
+        if self._raw is None:
+            self._open()
+        return self._raw
+
+    def _size(self):
+        return self._raw.tell()
+
+    def _close_file(self):
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+
+    def flush(self):
+        if self._raw is not None:
+            self._raw.flush()
+
+    def close(self):
+        self._close_file()
+
+
+class JSONLSink(_RotatingSink):
+    """
+    A json object for each line, the body in base64. The compressor
+    keeps a part of the output, files rotate on the uncompressed size.
+    """
+    suffix = ".jsonl.gz"
+
+    def __init__(self, path, rotate_size=0, prefix="crawl", compresslevel=6):
+        _RotatingSink.__init__(self, path, rotate_size, prefix)
+        self.compresslevel = compresslevel
+        self._gzip = None
+        self._uncompressed = 0
+
+    def _open(self):
+        _RotatingSink._open(self)
+        self._gzip = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=self.compresslevel)
+        self._uncompressed = 0
+
+    def _size(self):
+        return self._uncompressed
+
+    def _close_file(self):
+        if self._gzip is not None:
+            self._gzip.close()
+            self._gzip = None
+        _RotatingSink._close_file(self)
+
+    def write_batch(self, records):
+        self._file()
+        lines = []
+        for record in records:
+            item = record._asdict()
+            if record.body is not None:
+                item["body"] = base64.b64encode(record.body).decode()
+            lines.append(json.dumps(item, ensure_ascii=False))
+        lines.append("")
+        self._uncompressed += self._gzip.write("\n".join(lines).encode())
+
+    def flush(self):
+        if self._gzip is not None:
+            self._gzip.flush()
+
+
+# the body is decoded by the http client
+_HOP_HEADERS = {"content-encoding", "transfer-encoding", "content-length", "connection"}
+
+
+class WARCSink(_RotatingSink):
+    """
+    WARC/1.1 response records, each one a gzip member. The body is the
+    decoded one, Content-Encoding and Transfer-Encoding are dropped from
+    the http headers. Failed requests are not written.
+    """
+    suffix = ".warc.gz"
+
+    def __init__(self, path, rotate_size=0, prefix="crawl", compresslevel=6):
+        _RotatingSink.__init__(self, path, rotate_size, prefix)
+        self.compresslevel = compresslevel
+
+    def _open(self):
+        _RotatingSink._open(self)
+        self._raw.write(self._member(self._warcinfo()))
+
+    def _warcinfo(self):
+        payload = "software: crawlerpipeline\r\nformat: WARC File Format 1.1\r\n".encode()
+        return self._record("warcinfo", payload, "application/warc-fields")
+
+    @staticmethod
+    def _record(kind, payload: bytes, content_type, url=None, date=None, truncated=""):
+        date = date or datetime.datetime.now(datetime.timezone.utc)
+        headers = [
+            "WARC/1.1",
+            "WARC-Type: {}".format(kind),
+            "WARC-Record-ID: <urn:uuid:{}>".format(uuid.uuid4()),
+            "WARC-Date: {}".format(date.strftime("%Y-%m-%dT%H:%M:%SZ")),
+        ]
+        if url:
+            headers.append("WARC-Target-URI: {}".format(url))
+        if truncated:
+            headers.append("WARC-Truncated: {}".format(truncated))
+        headers.append("Content-Type: {}".format(content_type))
+        headers.append("Content-Length: {}".format(len(payload)))
+        return "\r\n".join(headers).encode() + b"\r\n\r\n" + payload + b"\r\n\r\n"
+
+    def _member(self, data):
+        return gzip.compress(data, self.compresslevel)
+
+    def write_batch(self, records):
+        raw = self._file()
+        for record in records:
+            if record.status is None:
+                continue
+            body = record.body or b""
+            lines = ["HTTP/1.1 {} {}".format(record.status, record.reason)]
+            lines.extend("{}: {}".format(k, v) for k, v in record.headers.items()
+                         if k.lower() not in _HOP_HEADERS)
+            lines.append("Content-Length: {}".format(len(body)))
+            payload = "\r\n".join(lines).encode("latin-1", "replace") + b"\r\n\r\n" + body
+            date = datetime.datetime.fromtimestamp(record.fetched_at, datetime.timezone.utc)
+            raw.write(self._member(self._record(
+                "response", payload, "application/http;msgtype=response", record.url, date,
+                record.truncated)))
+
+
+class SQLiteSink(Sink):
+    """one row for each record, a transaction for each batch"""
+
+    def __init__(self, path, rotate_size=0, prefix="crawl"):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.files = [path]
+        # opened in the writer thread
+        self._db = None
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "url TEXT, method TEXT, status INTEGER, reason TEXT, headers TEXT, elapsed REAL,"
+            "fetched_at REAL, depth INTEGER, parent TEXT, body BLOB)"
+        )
+        return db
+
+    def write_batch(self, records):
+        if self._db is None:
+            self._db = self._connect()
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(r.url, r.method, r.status, r.reason, json.dumps(r.headers), r.elapsed,
+                  r.fetched_at, r.depth, r.parent, r.body) for r in records]
+            )
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+SINKS = {
+    "jsonl": JSONLSink,
+    "warc": WARCSink,
+    "sqlite": SQLiteSink,
+}
+
+
+def get_sink(name) -> typing.Type[Sink]:
+    if name not in SINKS:
+        raise ValueError("unknown sink: {}, choose from {}".format(name, list(SINKS)))
+    return SINKS[name]
+
+
+class SinkWriter(object):
+    """Buffer the records of the dispatcher and write them in a thread."""
+
+    def __init__(self, sink: Sink, max_buffer=16 * 1024 * 1024, batch_size=500, flush_interval=1.0):
+        self.sink = sink
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._records = deque()
+        self._buffered = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        # put calls waiting for room
+        self._waiting = 0
+        self._thread = threading.Thread(target=self._run, name="sink-writer", daemon=True)
+        self.written = 0
+        self.errors = 0
+        # put calls which waited for the writer
+        self.blocked = 0
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def buffered_bytes(self):
+        return self._buffered
+
+    def put(self, record: SinkRecord):
+        size = record.size
+        with self._cond:
+            if self._records and self._buffered + size > self.max_buffer:
+                self.blocked += 1
+                self._waiting += 1
+                self._cond.notify_all()
+                # a record bigger than the buffer waits for an empty one
+                while self._records and self._buffered + size > self.max_buffer:
+                    self._cond.wait()
+                self._waiting -= 1
+            self._append(record, size)
+
+    def put_nowait(self, record: SinkRecord) -> bool:
+        """False if the buffer is full, for a caller which must not block"""
+        size = record.size
+        with self._cond:
+            if self._records and self._buffered + size > self.max_buffer:
+                self._cond.notify_all()
+                return False
+            self._append(record, size)
+        return True
+
+    def _append(self, record, size):
+        self._records.append((record, size))
+        self._buffered += size
+        if len(self._records) >= self.batch_size:
+            self._cond.notify_all()
+
+    def close(self):
+        """write the records left and close the sink"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+        else:
+            self._write(self._take())
+            self.sink.close()
+
+    def _take(self):
+        batch = []
+        with self._cond:
+            while self._records and len(batch) < self.batch_size:
+                record, size = self._records.popleft()
+                batch.append(record)
+                self._buffered -= size
+            self._cond.notify_all()
+        return batch
+
+    def _write(self, batch):
+        if not batch:
+            return
+        try:
+            self.sink.write_batch(batch)
+            self.written += len(batch)
+        except Exception:
+            self.errors += 1
+            logger.exception("error in %s", type(self.sink).__name__)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._records) < self.batch_size and not self._waiting and not self._closed:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            batch = self._take()
+            self._write(batch)
+            if not batch:
+                if closed:
+                    break
+                self.sink.flush()
+        self.sink.close()
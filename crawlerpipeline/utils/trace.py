@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+Where the time of a request goes: spans of its stages and queue waits,
+exported as Chrome trace events (chrome://tracing or ui.perfetto.dev),
+and a stack sampler for a window of a running crawl.
+
+A stage runs in one thread and is a complete event on the track of that
+thread. A wait (host queue, task queue, result queue) starts in a thread
+and ends in another, it is an async event of the request.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import typing
+import threading
+import contextlib
+from collections import Counter
+
+_NULL_STAGE = contextlib.nullcontext()
+
+
+class Tracer(object):
+    """
+    Spans of one url in every sample_every (a hash of the url, so the
+    threads agree without sharing state), none with sample_every=0.
+    At most max_events are kept, the next ones are counted in dropped.
+    """
+
+    def __init__(self, sample_every=1, max_events=1000000):
+        self.sample_every = sample_every
+        self.max_events = max_events
+        self.dropped = 0
+        # (kind, name, start, duration, thread id, trace id, args)
+        self._events = []
+        self._waits = {}
+        self._threads = {}
+        self._origin = time.perf_counter()
+
+    @property
+    def enabled(self):
+        return self.sample_every > 0
+
+    def __len__(self):
+        return len(self._events)
+
+    def trace_id(self, url) -> int:
+        """non zero for the urls traced"""
+        if not self.sample_every:
+            return 0
+        h = zlib.crc32(url.encode())
+        return h + 1 if h % self.sample_every == 0 else 0
+
+    def _add(self, event):
+        if len(self._events) >= self.max_events:
+            self.dropped += 1
+        else:
+            self._events.append(event)
+
+    def _thread(self):
+        thread = threading.current_thread()
+        if thread.ident not in self._threads:
+            self._threads[thread.ident] = thread.name
+        return thread.ident
+
+    def span(self, trace_id, name, start, end=None, **args):
+        """a stage which ran in this thread, start and end from perf_counter"""
+        if trace_id:
+            end = time.perf_counter() if end is None else end
+            self._add(("X", name, start, end - start, self._thread(), trace_id, args))
+
+    @contextlib.contextmanager
+    def _stage(self, trace_id, name, args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.span(trace_id, name, start, **args)
+
+    def stage(self, trace_id, name, **args):
+        """context manager timing a stage, a shared no-op one for trace_id 0"""
+        if not trace_id:
+            return _NULL_STAGE
+        return self._stage(trace_id, name, args)
+
+    def wait(self, trace_id, name):
+        """the request enters a queue"""
+        if trace_id:
+            self._waits[(trace_id, name)] = time.perf_counter()
+
+    def done_waiting(self, trace_id, name):
+        """and leaves it, in any thread"""
+        if trace_id:
+            start = self._waits.pop((trace_id, name), None)
+            if start is not None:
+                self._add(("W", name, start, time.perf_counter() - start, None, trace_id, None))
+
+    def summary(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        """count, mean, p50, p99 and max milliseconds of each stage and wait"""
+        durations = {}
+        for kind, name, _, duration, _, _, _ in list(self._events):
+            durations.setdefault(name, []).append(duration * 1000)
+        stats = {}
+        for name, values in durations.items():
+            values.sort()
+            stats[name] = {
+                "count": len(values),
+                "mean": sum(values) / len(values),
+                "p50": values[len(values) // 2],
+                "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+                "max": values[-1],
+            }
+        return stats
+
+    def chrome_trace(self) -> dict:
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in list(self._threads.items())]
+        for kind, name, start, duration, tid, trace_id, args in list(self._events):
+            ts = (start - self._origin) * 1e6
+            if kind == "X":
+                events.append({"name": name, "cat": "stage", "ph": "X", "ts": ts, "dur": duration * 1e6,
+                               "pid": pid, "tid": tid, "args": dict(args, trace_id=trace_id)})
+            else:
+                wait = {"name": name, "cat": "wait", "id": trace_id, "pid": pid, "tid": 0}
+                events.append(dict(wait, ph="b", ts=ts))
+                events.append(dict(wait, ph="e", ts=ts + duration * 1e6))
+        return {"traceEvents": events, "displayTimeUnit": "ms",
+                "otherData": {"dropped": self.dropped, "sample_every": self.sample_every}}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.chrome_trace(), fp)
+
+
+class StackSampler(object):
+    """
+    Sample the stacks of every thread each interval seconds from a
+    thread, unlike cProfile which only sees the thread enabling it.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self, seconds=None, path=None):
+        """sample for seconds or until stop, then write to path"""
+        self._seconds = seconds
+        self._path = path
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        end = time.monotonic() + self._seconds if self._seconds else None
+        while not self._stop.wait(self.interval):
+            if end is not None and time.monotonic() >= end:
+                break
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+        if self._path:
+            self.write(self._path)
+
+    def collapsed(self) -> str:
+        """one "thread;outer;...;inner count" line per stack, for flamegraph.pl or speedscope"""
+        return "".join("{} {}\n".format(stack, count) for stack, count in self.stacks.most_common())
+
+    def top(self, n=20) -> typing.List[typing.Tuple[str, int]]:
+        """the functions on top of the stacks, idle threads included"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+    def write(self, path):
+        with open(path, "w") as fp:
+            fp.write(self.collapsed())
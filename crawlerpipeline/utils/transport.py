@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import time
+import typing
+import datetime
+import threading
+from http.cookiejar import DefaultCookiePolicy
+import requests
+from requests.adapters import HTTPAdapter
+from requests.cookies import RequestsCookieJar, cookiejar_from_dict
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from urllib3.util.retry import Retry
+
+
+class _RejectAllPolicy(DefaultCookiePolicy):
+    """keep the cookies of the jar fixed"""
+
+    def set_ok(self, cookie, request):
+        return False
+
+
+def build_cookiejar(cookies=None, fixed=False) -> RequestsCookieJar:
+    """
+    The jar shared by every worker, http.cookiejar.CookieJar locks itself.
+    A fixed jar never takes the cookies set by responses.
+    """
+    jar = RequestsCookieJar(policy=_RejectAllPolicy() if fixed else None)
+    if cookies:
+        if isinstance(cookies, dict):
+            cookiejar_from_dict(cookies, jar)
+        else:
+            jar.update(cookies)
+    return jar
+
+
+def build_response(status_code, reason, url, headers, body: bytes,
+                   prepared_request: requests.PreparedRequest, elapsed) -> requests.Response:
+    """Adapt the response of another http client to requests.Response."""
+    response = requests.Response()
+    response.status_code = status_code
+    response.reason = reason
+    response.url = str(url)
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.request = prepared_request
+    response.elapsed = datetime.timedelta(seconds=elapsed)
+    response._content = body
+    response._content_consumed = True
+    return response
+
+
+class _StreamedBody(object):
+    """
+    The raw of a requests.Response over a streamed httpx response,
+    requests.Response.iter_content reads it with stream like urllib3's.
+    """
+
+    def __init__(self, rsp):
+        self._rsp = rsp
+
+    def stream(self, chunk_size, decode_content=True) -> typing.Iterator[bytes]:
+        return self._rsp.iter_bytes(chunk_size)
+
+    def close(self):
+        # an unfinished body closes the connection
+        self._rsp.close()
+
+
+class TransportStats(typing.NamedTuple):
+    # connections opened
+    connections: int
+    # requests sent
+    requests: int
+
+
+class RequestsTransport(object):
+    """
+    A requests.Session for each worker thread, all of them share one
+    HTTPAdapter (its connection pools are thread-safe) sized for the
+    concurrency, and one cookie jar.
+    """
+
+    def __init__(self, pool_maxsize=20, pool_connections=20, timeout=None,
+                 max_retries=0, retry_backoff=0, cookies=None, fixed_cookie=False):
+        self.timeout = timeout
+        self.fixed_cookie = fixed_cookie
+        self.cookiejar = build_cookiejar(cookies, fixed_cookie)
+        # 429/503 come back to the host scheduler instead of a worker
+        # sleeping for their Retry-After
+        retries = Retry(total=max_retries, backoff_factor=retry_backoff,
+                        status_forcelist=(502, 504), raise_on_status=False,
+                        respect_retry_after_header=False)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections,
+                                   pool_maxsize=pool_maxsize, max_retries=retries)
+        self._local = threading.local()
+        # stats of a closed transport
+        self._final_stats = None
+
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self.adapter)
+            session.mount("https://", self.adapter)
+            session.cookies = self.cookiejar
+            self._local.session = session
+        return session
+
+    def prepare_request(self, request: requests.Request) -> requests.PreparedRequest:
+        return self.session().prepare_request(request)
+
+    def send(self, prepared_request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session().send(prepared_request, **kwargs)
+
+    def stats(self) -> TransportStats:
+        if self._final_stats:
+            return self._final_stats
+        connections = requests_ = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_ += pool.num_requests
+        return TransportStats(connections, requests_)
+
+    def close(self):
+        self._final_stats = self.stats()
+        self.adapter.close()
+
+
+class HTTPXTransport(RequestsTransport):
+    """Send with a shared httpx.Client, HTTP/2 if the server supports it."""
+
+    def __init__(self, pool_maxsize=20, pool_connections=20, timeout=None,
+                 max_retries=0, retry_backoff=0, cookies=None, fixed_cookie=False):
+        import httpx
+
+        RequestsTransport.__init__(self, pool_maxsize, pool_connections, timeout,
+                                   max_retries, retry_backoff, cookies, fixed_cookie)
+        if isinstance(timeout, (tuple, list)):
+            timeout = httpx.Timeout(timeout[1], connect=timeout[0])
+        self.client = httpx.Client(
+            # cookies come from self.cookiejar with the prepared request
+            cookies=build_cookiejar(fixed=True),
+            timeout=timeout, follow_redirects=True,
+            limits=httpx.Limits(max_connections=pool_connections * pool_maxsize,
+                                max_keepalive_connections=pool_maxsize),
+            transport=httpx.HTTPTransport(http2=True, retries=max_retries),
+        )
+        self._sent = 0
+
+    def send(self, prepared_request: requests.PreparedRequest, stream=False, **kwargs) -> requests.Response:
+        """with stream the body is read by iter_content, as with requests"""
+        started = time.monotonic()
+        request = self.client.build_request(prepared_request.method, prepared_request.url,
+                                            headers=dict(prepared_request.headers),
+                                            content=prepared_request.body)
+        rsp = self.client.send(request, stream=stream)
+        self._sent += 1
+        if not self.fixed_cookie:
+            for cookie in rsp.cookies.jar:
+                self.cookiejar.set_cookie(cookie)
+        response = build_response(rsp.status_code, rsp.reason_phrase, rsp.url, rsp.headers,
+                                  False if stream else rsp.content, prepared_request,
+                                  time.monotonic() - started)
+        if stream:
+            response.raw = _StreamedBody(rsp)
+            response._content_consumed = False
+        return response
+
+    def stats(self) -> TransportStats:
+        """connections are the ones kept in the httpx pool"""
+        if self._final_stats:
+            return self._final_stats
+        pool = self.client._transport._pool
+        return TransportStats(len(pool.connections), self._sent)
+
+    def close(self):
+        self._final_stats = self.stats()
+        self.client.close()
+
+
+TRANSPORTS = {
+    "requests": RequestsTransport,
+    "httpx": HTTPXTransport,
+}
+
+
+def get_transport(name) -> typing.Type[RequestsTransport]:
+    if name not in TRANSPORTS:
+        raise ValueError("unknown transport: {}, choose from {}".format(
+            name, list(TRANSPORTS)
+        ))
+    return TRANSPORTS[name]
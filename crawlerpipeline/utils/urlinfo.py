@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# coding:utf-8
+import os
+import typing
+import functools
+from urllib.parse import urljoin, urlparse
+
+# links never crawled
+_IGNORED_SCHEMES = ("javascript:", "data:", "ftp:", "mailto:")
+
+
+class URLInfo(typing.NamedTuple):
+    """A url parsed once and shared by every filter stage."""
+    url: str
+    scheme: str
+    netloc: str
+    # netloc without port
+    domain: str
+    path: str
+    query: str
+    suffix: str
+    query_keys: typing.Tuple[str, ...]
+    # canonical path and query used by FakeStaticPathFilter
+    path_template: str
+    query_template: str
+
+
+def split_domain(netloc):
+    return netloc[:netloc.index(":")] if ":" in netloc else netloc
+
+
+def _query_keys(query):
+    if not query:
+        return ()
+    return tuple(sorted(e.partition("=")[0] for e in query.split("&")))
+
+
+class URLNormalizer(object):
+    """
+    Fix the links found in pages and parse them into URLInfo, the results
+    are kept in a bounded LRU keyed by the raw link because the same hrefs
+    show up on nearly every page of a site.
+    """
+
+    def __init__(self, base_url, allow_fragment=False, path_template=None,
+                 query_template=None, cache_size=65536):
+        self.base_url = base_url
+        self.allow_fragment = allow_fragment
+        self._path_template = path_template
+        self._query_template = query_template
+        self.parse = functools.lru_cache(maxsize=cache_size)(self._parse)
+
+    def fix(self, url):
+        """absolute url of a link, None for the links never crawled"""
+        if url.startswith(_IGNORED_SCHEMES):
+            return
+        elif not url.startswith("http"):
+            url = urljoin(self.base_url, url)
+
+        if not self.allow_fragment and "#" in url:
+            return url[:url.index("#")]
+        else:
+            return url
+
+    def _parse(self, raw) -> typing.Optional[URLInfo]:
+        url = self.fix(raw)
+        if not url:
+            return None
+
+        parts = urlparse(url)
+        _, suffix = os.path.splitext(parts.path)
+        return URLInfo(
+            url=url,
+            scheme=parts.scheme,
+            netloc=parts.netloc,
+            domain=split_domain(parts.netloc),
+            path=parts.path,
+            query=parts.query,
+            suffix=suffix,
+            query_keys=_query_keys(parts.query),
+            path_template=self._path_template(parts.path) if self._path_template else parts.path,
+            query_template=self._query_template(parts.query) if self._query_template else parts.query,
+        )
+
+    def cache_info(self):
+        return self.parse.cache_info()
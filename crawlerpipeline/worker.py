@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+# coding:utf-8
+"""
+A crawl worker connected to the coordinator of DistributedCrawlerPipeline.
+
+    python -m crawlerpipeline.worker --address 10.0.0.1:7777 \\
+        --authkey <hex key logged by the coordinator> --shards 8 --shard 3
+"""
+import sys
+from .distributed import main
+
+if __name__ == "__main__":
+    sys.exit(main())